@@ -23,7 +23,8 @@ class CombatantCard(QDialog):
         eff_text.setReadOnly(True)
         eff_list = []
         if "custom_effects" in self.combatant.effects:
-            for eff_name, (val, dur) in self.combatant.effects["custom_effects"].items():
+            for eff_name in self.combatant.effects["custom_effects"]:
+                dur = self.combatant.effect_duration(eff_name)
                 if dur is None:
                     eff_list.append(f"{eff_name}")
                 else:
@@ -3,15 +3,38 @@ from PySide6.QtWidgets import (
     QPushButton, QTableWidget, QTableWidgetItem,
     QLineEdit, QLabel, QSpinBox, QCheckBox, QComboBox,
     QFrame, QToolButton, QSizePolicy, QGroupBox,
-    QGridLayout, QHeaderView
+    QGridLayout, QHeaderView, QFileDialog, QMessageBox
 )
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QFont, QFontDatabase
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QFont, QFontDatabase, QKeySequence, QShortcut
 from battle_engine import BattleEngine
+from dice_roll import compile_formula
 from combatant_factory import CombatantFactory
+import os
 import sys
+from bisect import bisect_left
 from pathlib import Path
 from battle_state_exporter import BattleStateExporter
+from session_journal import SessionJournal, recover
+import encounter_file
+
+# порт SSE-рассылки для экранов игроков (Pui/player_ui.py --push PORT)
+PUSH_PORT = int(os.environ["TNDM_PUSH_PORT"]) if os.environ.get("TNDM_PUSH_PORT") else None
+# формат экспорта: "snapshot" — battle_state.json целиком, "stream" — ключевой
+# кадр и патчи в battle_state.jsonl (Pui/player_ui.py --stream, патчи по SSE)
+EXPORT_MODE = os.environ.get("TNDM_EXPORT_MODE", "snapshot")
+
+ENCOUNTER_FILTER = "Встречи (*.tndm)"
+
+# шанс уложить считается точно, только если distribution() дешевле этого
+# (~0.1 с); иначе — оценка по броскам, не больше KILL_CHANCE_SAMPLE_DICE костей
+KILL_CHANCE_MAX_COST = 400_000
+KILL_CHANCE_SAMPLE_DICE = 100_000
+KILL_CHANCE_MIN_SAMPLES = 100
+# пересчёт после паузы в наборе формулы
+KILL_CHANCE_DELAY_MS = 250
+# как часто проверять ошибки фоновой записи (экспорт для игроков, журнал сессии)
+WRITE_ERROR_CHECK_MS = 1000
 
 TABLE_HEADERS = [
     "", "Имя", "Текущие HP", "Временные HP", "Класс брони",
@@ -24,7 +47,9 @@ class MasterUI(QWidget):
         self.setWindowTitle("tndm/dnd/tracker")
         self.resize(1400, 850)
         self.factory = CombatantFactory()
-        self.battle_engine = BattleEngine()
+        # бой, прерванный сбоем, восстанавливается из журнала сессии
+        recovered = recover()
+        self.battle_engine = recovered or BattleEngine()
         self.current_initiative_group = None
         self.round_counter = 0
         self.turn_started = set()
@@ -45,11 +70,36 @@ class MasterUI(QWidget):
         self.start_btn = QPushButton("Начать бой")
         self.table = QTableWidget(0, len(TABLE_HEADERS))
         self.remove_effect_name_input = QLineEdit()
+        self.kill_formula_input = QLineEdit()
+        self.kill_chance_label = QLabel("")
+        self.kill_chance_timer = QTimer(self)
+        self.kill_chance_timer.setSingleShot(True)
+        self.kill_chance_timer.setInterval(KILL_CHANCE_DELAY_MS)
+        self.kill_chance_timer.timeout.connect(self.update_kill_chance)
         self.init_ui()
         self.state_exporter = BattleStateExporter(
             self.battle_engine,
-            interval=0.5
+            coalesce=0.03,
+            mode=EXPORT_MODE,
+            push_port=PUSH_PORT
         )
+        self._push_error_shown = False
+        self.session_journal = SessionJournal(self.battle_engine)
+        self.session_journal.start()
+        self._write_errors_shown = set()
+        self.write_error_timer = QTimer(self)
+        self.write_error_timer.setInterval(WRITE_ERROR_CHECK_MS)
+        self.write_error_timer.timeout.connect(self._check_write_errors)
+        self.write_error_timer.start()
+        if recovered is not None:
+            if recovered.in_combat:
+                self._start_exporter()
+            self._sync_turn_display()
+
+    def closeEvent(self, event):
+        self.state_exporter.shutdown()
+        self.session_journal.stop()
+        super().closeEvent(event)
 
     def apply_theme(self):
         card_border = "#5F4A3C"
@@ -186,8 +236,22 @@ class MasterUI(QWidget):
         next_btn.clicked.connect(self.next_turn)
         end_btn = QPushButton("Завершить бой")
         end_btn.clicked.connect(self.end_battle)
+        undo_btn = QPushButton("Отменить")
+        undo_btn.clicked.connect(self.undo)
+        redo_btn = QPushButton("Повторить")
+        redo_btn.clicked.connect(self.redo)
+        QShortcut(QKeySequence.Undo, self, activated=self.undo)
+        QShortcut(QKeySequence.Redo, self, activated=self.redo)
         controls_layout.addWidget(next_btn)
         controls_layout.addWidget(end_btn)
+        controls_layout.addWidget(undo_btn)
+        controls_layout.addWidget(redo_btn)
+        save_encounter_btn = QPushButton("Сохранить встречу")
+        save_encounter_btn.clicked.connect(self.save_encounter)
+        load_encounter_btn = QPushButton("Загрузить встречу")
+        load_encounter_btn.clicked.connect(self.load_encounter)
+        controls_layout.addWidget(save_encounter_btn)
+        controls_layout.addWidget(load_encounter_btn)
         layout.addLayout(controls_layout)
 
         setup_row = QHBoxLayout()
@@ -349,6 +413,12 @@ class MasterUI(QWidget):
         action_layout.addWidget(QLabel("Количество временных HP"), 2, 0)
         action_layout.addWidget(self.temp_set_input, 2, 1)
         action_layout.addWidget(temp_set_btn, 2, 2)
+        self.kill_formula_input.setPlaceholderText("Например, 8d6")
+        self.kill_formula_input.textChanged.connect(self.schedule_kill_chance)
+        self.kill_chance_label.setWordWrap(True)
+        action_layout.addWidget(QLabel("Шанс уложить формулой"), 3, 0)
+        action_layout.addWidget(self.kill_formula_input, 3, 1)
+        action_layout.addWidget(self.kill_chance_label, 4, 0, 1, 3)
         action_group.setLayout(action_layout)
         bottom_row.addWidget(action_group, 2)
 
@@ -367,20 +437,17 @@ class MasterUI(QWidget):
 
     def attack(self):
             damage = self.damage_input.value()
-            for combatant in self.get_selected_combatants:
-                combatant.take_damage(damage)
+            self.battle_engine.apply_damage(self.get_selected_combatants, damage)
             self.refresh_table()
 
     def heal(self):
         amount = self.heal_input.value()
-        for combatant in self.get_selected_combatants:
-            combatant.heal(amount)
+        self.battle_engine.apply_heal(self.get_selected_combatants, amount)
         self.refresh_table()
 
     def set_temp_hp(self):
         amount = self.temp_set_input.value()
-        for combatant in self.get_selected_combatants:
-            combatant.add_temp_hp(amount)
+        self.battle_engine.apply_temp_hp(self.get_selected_combatants, amount)
         self.refresh_table()
 
     def add_player(self):
@@ -416,8 +483,10 @@ class MasterUI(QWidget):
             ac=ac,
             hp_input=hp_input
         )
-        for m in monsters:
-            self.battle_engine.add_combatant(m)
+        # группа монстров — один шаг отмены
+        with self.battle_engine.batch():
+            for m in monsters:
+                self.battle_engine.add_combatant(m)
         self.refresh_table()
         self.monster_name_input.clear()
         self.monster_custom_name_input.clear()
@@ -428,7 +497,7 @@ class MasterUI(QWidget):
 
     def start_battle(self):
         self.battle_engine.start_combat()
-        self.state_exporter.start()
+        self._start_exporter()
         self.round_counter = self.battle_engine.round
         self.current_initiative_group = self.battle_engine.current_initiative_group
         self.round_label.setText(f"Раунд боя: {self.round_counter}")
@@ -445,20 +514,80 @@ class MasterUI(QWidget):
 
         self.refresh_table()
 
+    def undo(self):
+        if self.battle_engine.undo():
+            self._sync_turn_display()
+
+    def redo(self):
+        if self.battle_engine.redo():
+            self._sync_turn_display()
+
+    def save_encounter(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить встречу", "", ENCOUNTER_FILTER)
+        if not path:
+            return
+        try:
+            encounter_file.save(self.battle_engine, path)
+        except OSError as e:
+            QMessageBox.warning(self, "Сохранить встречу", str(e))
+
+    def load_encounter(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Загрузить встречу", "", ENCOUNTER_FILTER)
+        if not path:
+            return
+        try:
+            encounter_file.load(path, self.battle_engine)
+        except (OSError, encounter_file.EncounterFormatError) as e:
+            QMessageBox.warning(self, "Загрузить встречу", str(e))
+            return
+        if self.battle_engine.in_combat:
+            self._start_exporter()
+        self._sync_turn_display()
+
+    def _start_exporter(self):
+        self.state_exporter.start()
+        error = self.state_exporter.push_error
+        if error is not None and not self._push_error_shown:
+            # предупреждаем один раз: экспорт в файлы работает и без сервера
+            self._push_error_shown = True
+            QMessageBox.warning(
+                self, "Экраны игроков",
+                f"Сервер для экранов игроков не запущен (порт {PUSH_PORT}): {error}"
+            )
+
+    def _check_write_errors(self):
+        self._warn_write_error(
+            "export", self.state_exporter.write_error, "Экраны игроков",
+            "Не удалось записать состояние боя для игроков (запись повторяется)"
+        )
+        self._warn_write_error(
+            "journal", self.session_journal.error, "Журнал сессии",
+            "Не удалось записать журнал сессии, бой не восстановится после сбоя"
+        )
+
+    def _warn_write_error(self, source, error, title, text):
+        if error is None:
+            # запись восстановилась — о следующем сбое снова предупредим
+            self._write_errors_shown.discard(source)
+        elif source not in self._write_errors_shown:
+            self._write_errors_shown.add(source)
+            QMessageBox.warning(self, title, f"{text}: {error}")
+
+    def _sync_turn_display(self):
+        prev_group = self.battle_engine.prev_group
+        in_combat = self.battle_engine.in_combat
+        self.current_initiative_group = prev_group[0].initiative if in_combat and prev_group else None
+        self.round_counter = self.battle_engine.round
+        self.round_label.setText(f"Раунд боя: {self.round_counter}")
+        self.refresh_table()
+
     def add_effect(self):
         name = self.effect_name_input.text().strip()
         if not name:
             return
         dur = self.effect_duration_input.value()
         dur = None if dur == 0 else dur
-        selected = self.get_selected_combatants
-        for combat in selected:
-            effects = combat.effects.setdefault("custom_effects", {})
-            effects[name] = {
-                "value": True,
-                "duration": dur,
-                "applied_round": self.battle_engine.round
-            }
+        self.battle_engine.apply_effect(self.get_selected_combatants, name, dur)
         self.refresh_table()
 
     def remove_effect(self, name):
@@ -466,15 +595,12 @@ class MasterUI(QWidget):
             return
         selected = self.get_selected_combatants
         if selected:
-            for combat in selected:
-                effects = combat.effects.get("custom_effects", {})
-                if name in effects:
-                    del effects[name]
+            with self.battle_engine.batch():
+                for combat in selected:
+                    if name in combat.effects.get("custom_effects", {}):
+                        self.battle_engine.remove_effect(combat, name)
         else:
-            for combat in self.battle_engine.combatants:
-                effects = combat.effects.get("custom_effects", {})
-                if name in effects:
-                    del effects[name]
+            self.battle_engine.remove_effect_everywhere(name)
         self.refresh_table()
         self.remove_effect_name_input.clear()
 
@@ -489,6 +615,7 @@ class MasterUI(QWidget):
         for i, c in enumerate(self.battle_engine.combatants):
             self.table.insertRow(i)
             cb = QCheckBox()
+            cb.stateChanged.connect(self.schedule_kill_chance)
             self.table.setCellWidget(i, 0, cb)
             self.table.setItem(i, 1, QTableWidgetItem(str(c.custom_name or c.name)))
             self.table.setItem(i, 2, QTableWidgetItem(str(c.hp)))
@@ -500,8 +627,8 @@ class MasterUI(QWidget):
             self.table.setItem(i, 4, QTableWidgetItem(ac_value))
             effs_list = []
             custom_effects = c.effects.get("custom_effects", {})
-            for eff_name, eff_data in custom_effects.items():
-                dur = eff_data["duration"]
+            for eff_name in custom_effects:
+                dur = c.effect_duration(eff_name)
                 if dur is None:
                     effs_list.append(f"{eff_name}")
                 else:
@@ -528,6 +655,50 @@ class MasterUI(QWidget):
                 item = self.table.item(i, col)
                 if item:
                     item.setForeground(color)
+        self.schedule_kill_chance()
+
+    def schedule_kill_chance(self, *_):
+        self.kill_chance_timer.start()
+
+    def update_kill_chance(self, *_):
+        """
+        Вероятность, что урон по формуле уложит выбранные цели
+        (урон сначала съедает временные хиты). Точная, если распределение
+        считается быстро, иначе — оценка по броскам с пометкой «≈»
+        """
+        formula = self.kill_formula_input.text().strip()
+        targets = [c for c in self.get_selected_combatants if c.hp is not None and c.state == "alive"]
+        if not formula or not targets:
+            self.kill_chance_label.setText("")
+            return
+        try:
+            plan = compile_formula(formula)
+        except ValueError:
+            self.kill_chance_label.setText("Неверная формула")
+            return
+
+        if plan.exact_cost() <= KILL_CHANCE_MAX_COST:
+            damage = plan.distribution()
+            summary = f"{formula}: {damage.min}–{damage.max}, в среднем {damage.mean:.1f}. "
+            chances = [damage.at_least(c.hp + c.temp_hp) for c in targets]
+            mark = ""
+        else:
+            samples = KILL_CHANCE_SAMPLE_DICE // max(1, plan.dice_count())
+            if samples < KILL_CHANCE_MIN_SAMPLES:
+                self.kill_chance_label.setText(f"{formula}: — (слишком много костей)")
+                return
+            rolls = sorted(plan.roll_many(samples))
+            summary = (
+                f"{formula}: ≈{rolls[0]}–{rolls[-1]}, в среднем ≈{sum(rolls) / samples:.1f} "
+                f"({samples} бросков). "
+            )
+            chances = [1 - bisect_left(rolls, c.hp + c.temp_hp) / samples for c in targets]
+            mark = "≈"
+        parts = [
+            f"{c.custom_name or c.name}: {mark}{chance * 100:.0f}%"
+            for c, chance in zip(targets, chances)
+        ]
+        self.kill_chance_label.setText(summary + ", ".join(parts))
 
     def toggle_concentration(self, combat, state):
         checked = bool(state)
@@ -560,7 +731,7 @@ class MasterUI(QWidget):
     def end_battle(self):
         self.battle_engine.end_combat()
         self.state_exporter.stop()
-        self.battle_engine.combatants.clear()
+        self.battle_engine.clear()
         self.current_initiative_group = None
         self.round_counter = 0
         self.round_label.setText(f"Раунд боя: {self.round_counter}")
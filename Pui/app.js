@@ -1,6 +1,8 @@
 const UI = document.getElementById("ui-root");
 
 const UPDATE_INTERVAL = 250;
+// index.html?push=8765 — получать состояние с SSE-сервера экспортёра
+const PUSH_PORT = new URLSearchParams(window.location.search).get("push");
 let lastState = null;
 let rows = [];
 
@@ -40,9 +42,47 @@ const BattleAPI = {
     } catch {
       return null;
     }
+  },
+
+  subscribe(port, onState) {
+    const source = new EventSource(`http://127.0.0.1:${port}/events`);
+    let state = null;
+
+    source.addEventListener("state", (e) => {
+      state = JSON.parse(e.data);
+      onState(state);
+    });
+    source.addEventListener("keyframe", (e) => {
+      state = JSON.parse(e.data).state;
+      onState(state);
+    });
+    source.addEventListener("patch", (e) => {
+      if (!state) return;
+      state = applyPatch(state, JSON.parse(e.data));
+      onState(state);
+    });
+    return source;
   }
 };
 
+function applyPatch(state, patch) {
+  const byId = new Map(state.combatants.map((c) => [c.id, c]));
+  (patch.removed || []).forEach((id) => byId.delete(id));
+  Object.entries(patch.changed || {}).forEach(([id, fields]) => {
+    const c = byId.get(id);
+    if (c) byId.set(id, { ...c, ...fields });
+  });
+  (patch.added || []).forEach((c) => byId.set(c.id, c));
+
+  const order = patch.order || [...byId.keys()];
+  return {
+    ...state,
+    round: "round" in patch ? patch.round : state.round,
+    active_ids: "active_ids" in patch ? patch.active_ids : state.active_ids,
+    combatants: order.map((id) => byId.get(id)).filter(Boolean)
+  };
+}
+
 /* ================= EFFECTS ================= */
 
 const VISUAL_EFFECTS = {
@@ -60,10 +100,17 @@ const TRANSIENT = {
 
 /* ================= LOOP ================= */
 
-setInterval(mainLoop, UPDATE_INTERVAL);
+if (PUSH_PORT) {
+  BattleAPI.subscribe(PUSH_PORT, render);
+} else {
+  setInterval(mainLoop, UPDATE_INTERVAL);
+}
 
 async function mainLoop() {
-  const state = await BattleAPI.loadJSON();
+  render(await BattleAPI.loadJSON());
+}
+
+function render(state) {
   if (!state || !state.running) return clearUI();
 
   syncUI(state);
@@ -1,9 +1,18 @@
+import argparse
+import bisect
+import http.client
 import json
 import html
+import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from PySide6.QtCore import QAbstractListModel, QTimer, Qt, QObject, Property, Signal
+from PySide6.QtCore import (
+    QAbstractListModel, QFileSystemWatcher, QModelIndex, QTimer, Qt, QObject, Property, Signal
+)
 from PySide6.QtQml import QQmlApplicationEngine
 from PySide6.QtGui import QGuiApplication
 
@@ -21,9 +30,39 @@ class CombatantModel(QAbstractListModel):
     DISPLAY_NAME_ROLE = Qt.UserRole + 10
     ID_ROLE = Qt.UserRole + 11
 
+    # роль -> ключ элемента модели и имя роли в QML; считаются один раз
+    ROLE_FIELDS = {
+        NAME_ROLE: "name",
+        HP_ROLE: "hp",
+        MAX_HP_ROLE: "max_hp",
+        TEMP_HP_ROLE: "temp_hp",
+        STATE_ROLE: "state",
+        ACTIVE_ROLE: "active",
+        EFFECTS_ROLE: "effects",
+        CUSTOM_EFFECTS_ROLE: "custom_effects",
+        KIND_ROLE: "kind",
+        DISPLAY_NAME_ROLE: "display_name",
+        ID_ROLE: "id",
+    }
+    ROLE_NAMES = {
+        NAME_ROLE: b"name",
+        HP_ROLE: b"hp",
+        MAX_HP_ROLE: b"max_hp",
+        TEMP_HP_ROLE: b"temp_hp",
+        STATE_ROLE: b"state",
+        ACTIVE_ROLE: b"is_active",
+        EFFECTS_ROLE: b"effects",
+        CUSTOM_EFFECTS_ROLE: b"custom_effects",
+        KIND_ROLE: b"kind",
+        DISPLAY_NAME_ROLE: b"display_name",
+        ID_ROLE: b"id",
+    }
+    FIELD_ROLES = tuple((field, role) for role, field in ROLE_FIELDS.items())
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self._items = []
+        self._rows = {}
 
     def rowCount(self, parent=None):
         return len(self._items)
@@ -31,45 +70,13 @@ class CombatantModel(QAbstractListModel):
     def data(self, index, role=Qt.DisplayRole):
         if not index.isValid():
             return None
-        item = self._items[index.row()]
-        if role == self.NAME_ROLE:
-            return item["name"]
-        if role == self.HP_ROLE:
-            return item["hp"]
-        if role == self.MAX_HP_ROLE:
-            return item["max_hp"]
-        if role == self.TEMP_HP_ROLE:
-            return item["temp_hp"]
-        if role == self.STATE_ROLE:
-            return item["state"]
-        if role == self.ACTIVE_ROLE:
-            return item["active"]
-        if role == self.EFFECTS_ROLE:
-            return item["effects"]
-        if role == self.CUSTOM_EFFECTS_ROLE:
-            return item["custom_effects"]
-        if role == self.KIND_ROLE:
-            return item["kind"]
-        if role == self.DISPLAY_NAME_ROLE:
-            return item["display_name"]
-        if role == self.ID_ROLE:
-            return item["id"]
-        return None
+        field = self.ROLE_FIELDS.get(role)
+        if field is None:
+            return None
+        return self._items[index.row()][field]
 
     def roleNames(self):
-        return {
-            self.NAME_ROLE: b"name",
-            self.HP_ROLE: b"hp",
-            self.MAX_HP_ROLE: b"max_hp",
-            self.TEMP_HP_ROLE: b"temp_hp",
-            self.STATE_ROLE: b"state",
-            self.ACTIVE_ROLE: b"is_active",
-            self.EFFECTS_ROLE: b"effects",
-            self.CUSTOM_EFFECTS_ROLE: b"custom_effects",
-            self.KIND_ROLE: b"kind",
-            self.DISPLAY_NAME_ROLE: b"display_name",
-            self.ID_ROLE: b"id",
-        }
+        return self.ROLE_NAMES
 
     @staticmethod
     def _build_item(combatant, active_ids):
@@ -88,30 +95,159 @@ class CombatantModel(QAbstractListModel):
             "display_name": combatant.get("display_name", combatant.get("name", "—")),
         }
 
+    def items(self):
+        return self._items
+
+    def item_by_id(self, combatant_id):
+        row = self._rows.get(combatant_id)
+        return None if row is None else self._items[row]
+
+    def _reindex(self):
+        self._rows = {item["id"]: row for row, item in enumerate(self._items)}
+
     def _full_reset(self, combatants, active_ids):
         self.beginResetModel()
         self._items = [self._build_item(combatant, active_ids) for combatant in combatants]
+        self._reindex()
         self.endResetModel()
 
-    def update_items(self, combatants, active_ids):
-        # Preserve delegates (and ongoing QML animations) by avoiding full model
-        # resets when the combatant list shape is unchanged.
-        if len(combatants) != len(self._items):
-            self._full_reset(combatants, active_ids)
+    def _replace_row(self, row, updated_item):
+        """
+        Сообщает QML только о ролях, значения которых изменились
+        """
+        current = self._items[row]
+        roles = [role for field, role in self.FIELD_ROLES if current[field] != updated_item[field]]
+        self._items[row] = updated_item
+        if roles:
+            model_index = self.index(row, 0)
+            self.dataChanged.emit(model_index, model_index, roles)
+
+    def apply_patch(self, patch, prev_active_ids, active_ids):
+        """
+        Применяет патч из потока battle_state.jsonl, трогая только
+        изменившиеся строки. Структурные изменения (добавление, удаление,
+        порядок) идут через update_items.
+        """
+        if "added" in patch or "removed" in patch or "order" in patch:
+            changed = patch.get("changed", {})
+            by_id = {item["id"]: item for item in self._items}
+            for combatant_id in patch.get("removed", []):
+                by_id.pop(combatant_id, None)
+            for combatant_id, fields in changed.items():
+                if combatant_id in by_id:
+                    by_id[combatant_id] = {**by_id[combatant_id], **fields}
+            for entry in patch.get("added", []):
+                by_id[entry.get("id")] = entry
+            order = patch.get("order") or list(by_id)
+            self.update_items([by_id[combatant_id] for combatant_id in order if combatant_id in by_id], active_ids)
             return
 
-        incoming_ids = [combatant.get("id") for combatant in combatants]
-        current_ids = [item.get("id") for item in self._items]
-        if incoming_ids != current_ids:
-            self._full_reset(combatants, active_ids)
+        active = set(active_ids)
+        touched = set(patch.get("changed", {}))
+        touched.update(set(prev_active_ids) ^ active)
+        for combatant_id in touched:
+            row = self._rows.get(combatant_id)
+            if row is None:
+                continue
+            fields = patch.get("changed", {}).get(combatant_id, {})
+            updated_item = self._build_item({**self._items[row], **fields}, active)
+            if self._items[row] != updated_item:
+                self._replace_row(row, updated_item)
+
+    def update_items(self, combatants, active_ids):
+        # Preserve delegates (and ongoing QML animations): rows are matched by
+        # id and only inserted/removed/moved ones are signalled, the model is
+        # reset only when ids are ambiguous.
+        active = set(active_ids)
+        incoming = [self._build_item(combatant, active) for combatant in combatants]
+        incoming_ids = [item["id"] for item in incoming]
+        if len(set(incoming_ids)) != len(incoming_ids):
+            self._full_reset(combatants, active)
             return
 
-        for row, combatant in enumerate(combatants):
-            updated_item = self._build_item(combatant, active_ids)
+        if [item["id"] for item in self._items] != incoming_ids:
+            self._sync_rows(incoming, incoming_ids)
+
+        for row, updated_item in enumerate(incoming):
             if self._items[row] != updated_item:
-                self._items[row] = updated_item
-                model_index = self.index(row, 0)
-                self.dataChanged.emit(model_index, model_index, list(self.roleNames().keys()))
+                self._replace_row(row, updated_item)
+
+    @staticmethod
+    def _stable_ids(current_ids, incoming_ids):
+        """
+        id, которые остаются на месте: наибольшая возрастающая
+        подпоследовательность текущих позиций в новом порядке
+        """
+        position = {combatant_id: row for row, combatant_id in enumerate(current_ids)}
+        sequence = [combatant_id for combatant_id in incoming_ids if combatant_id in position]
+
+        tails = []      # индексы в sequence — хвосты возрастающих цепочек
+        tail_rows = []  # их позиции, для bisect
+        parents = [-1] * len(sequence)
+        for i, combatant_id in enumerate(sequence):
+            row = position[combatant_id]
+            k = bisect.bisect_left(tail_rows, row)
+            if k > 0:
+                parents[i] = tails[k - 1]
+            if k == len(tails):
+                tails.append(i)
+                tail_rows.append(row)
+            else:
+                tails[k] = i
+                tail_rows[k] = row
+
+        stable = set()
+        i = tails[-1] if tails else -1
+        while i != -1:
+            stable.add(sequence[i])
+            i = parents[i]
+        return stable
+
+    def _sync_rows(self, incoming, incoming_ids):
+        parent = QModelIndex()
+        wanted = set(incoming_ids)
+
+        # удаления — снизу вверх, смежные строки одним сигналом
+        row = len(self._items) - 1
+        while row >= 0:
+            if self._items[row]["id"] in wanted:
+                row -= 1
+                continue
+            last = row
+            while row - 1 >= 0 and self._items[row - 1]["id"] not in wanted:
+                row -= 1
+            self.beginRemoveRows(parent, row, last)
+            del self._items[row:last + 1]
+            self.endRemoveRows()
+            row -= 1
+
+        current_ids = [item["id"] for item in self._items]
+        stable = self._stable_ids(current_ids, incoming_ids)
+
+        # остальные ставим сразу после предшественника в новом порядке
+        for index, combatant_id in enumerate(incoming_ids):
+            if combatant_id in stable:
+                continue
+            target = current_ids.index(incoming_ids[index - 1]) + 1 if index > 0 else 0
+            if combatant_id in current_ids:
+                source = current_ids.index(combatant_id)
+                if source == target or source + 1 == target:
+                    continue
+                self.beginMoveRows(parent, source, source, parent, target)
+                item = self._items.pop(source)
+                current_ids.pop(source)
+                if source < target:
+                    target -= 1
+                self._items.insert(target, item)
+                current_ids.insert(target, combatant_id)
+                self.endMoveRows()
+            else:
+                self.beginInsertRows(parent, target, target)
+                self._items.insert(target, incoming[index])
+                current_ids.insert(target, combatant_id)
+                self.endInsertRows()
+
+        self._reindex()
 
 
 class PlayerUiState(QObject):
@@ -124,7 +260,7 @@ class PlayerUiState(QObject):
         self._running = False
         self._round = 0
         self._model = model
-        self._prev_payload = None
+        self._last_event_seq = None
         self._active_ids = []
         self._log_lines = ["", "", ""]
         self._clear_logs_timer = QTimer(self)
@@ -147,10 +283,6 @@ class PlayerUiState(QObject):
     def logLines(self):
         return self._log_lines
 
-    @staticmethod
-    def _display_name(combatant):
-        return combatant.get("display_name") or combatant.get("name") or "—"
-
     @staticmethod
     def _name_markup(name):
         safe_name = html.escape(name)
@@ -169,102 +301,96 @@ class PlayerUiState(QObject):
         self._log_lines = ["", "", ""]
         self.logLinesChanged.emit()
 
-    def _collect_diff_logs(self, payload):
-        if self._prev_payload is None:
+    def _apply_events(self, events, events_from=None):
+        """
+        Лог по журналу событий движка. Первое окно после подключения
+        только запоминается — это история, а не новые события.
+        events_from — seq начала окна экспортёра: если оно дальше
+        следующего ожидаемого события, часть событий не дошла
+        """
+        if events is None:
             return
-
-        prev_combatants = {
-            c.get("id"): c
-            for c in self._prev_payload.get("combatants", [])
-        }
-        curr_combatants = {
-            c.get("id"): c
-            for c in payload.get("combatants", [])
-        }
-
-        for combatant_id, current in curr_combatants.items():
-            previous = prev_combatants.get(combatant_id)
-            if previous is None:
+        if events:
+            last_seq = events[-1].get("seq", 0)
+        else:
+            # снимок без новых событий: events_from — следующее ожидаемое
+            last_seq = events_from - 1 if events_from is not None else 0
+        if self._last_event_seq is None or (events and last_seq < self._last_event_seq):
+            # первый payload или движок перезапущен
+            self._last_event_seq = last_seq
+            return
+        if events_from is not None and events_from > self._last_event_seq + 1:
+            # таблица всё равно берётся из состояния, теряются только строки лога
+            self._push_log(f"… пропущено событий: {events_from - self._last_event_seq - 1}")
+            self._last_event_seq = events_from - 1
+        for event in events:
+            seq = event.get("seq", 0)
+            if seq <= self._last_event_seq:
                 continue
-
-            name = self._display_name(current)
-            prev_state = previous.get("state")
-            curr_state = current.get("state")
-            state_changed = prev_state != curr_state
-
-            if state_changed:
-                if curr_state == "dead":
-                    self._actor_log(name, "погибает")
-                elif curr_state == "unconscious":
-                    self._actor_log(name, "без сознания")
-                elif curr_state == "left":
-                    self._actor_log(name, "покидает бой")
-                elif curr_state == "alive":
-                    if prev_state == "dead":
-                        self._actor_log(name, "воскресает")
-                    elif prev_state == "left":
-                        self._actor_log(name, "возвращается в бой")
-                    else:
-                        self._actor_log(name, "приходит в себя")
+            self._last_event_seq = seq
+            self._log_event(event)
+
+    def _log_event(self, event):
+        name = event.get("name") or "—"
+        event_type = event.get("type")
+
+        if event_type == "state":
+            prev_state = event.get("from")
+            curr_state = event.get("to")
+            if curr_state == "dead":
+                self._actor_log(name, "погибает")
+            elif curr_state == "unconscious":
+                self._actor_log(name, "без сознания")
+            elif curr_state == "left":
+                self._actor_log(name, "покидает бой")
+            elif curr_state == "alive":
+                if prev_state == "dead":
+                    self._actor_log(name, "воскресает")
+                elif prev_state == "left":
+                    self._actor_log(name, "возвращается в бой")
                 else:
-                    self._actor_log(name, f"состояние {curr_state}")
-
-            prev_hp = previous.get("hp")
-            curr_hp = current.get("hp")
-            hp_changed = isinstance(prev_hp, int) and isinstance(curr_hp, int) and curr_hp != prev_hp
-
-            prev_temp = previous.get("temp_hp", 0)
-            curr_temp = current.get("temp_hp", 0)
-            temp_changed = isinstance(prev_temp, int) and isinstance(curr_temp, int) and curr_temp != prev_temp
-
-            if not state_changed and (hp_changed or temp_changed):
-                if isinstance(curr_hp, int) and isinstance(prev_hp, int) and curr_hp > prev_hp:
-                    self._actor_log(name, "восстанавливает HP")
-                elif isinstance(curr_temp, int) and isinstance(prev_temp, int) and curr_temp > prev_temp:
-                    self._actor_log(name, "получает временные HP")
-                else:
-                    self._actor_log(name, "получает урон")
-                    if (
-                        isinstance(prev_temp, int)
-                        and isinstance(curr_temp, int)
-                        and prev_temp > 0
-                        and curr_temp == 0
-                    ):
-                        self._actor_log(name, "теряет временные HP")
-
-            prev_effects = previous.get("effects", {})
-            curr_effects = current.get("effects", {})
-            prev_concentration = bool(prev_effects.get("concentration"))
-            curr_concentration = bool(curr_effects.get("concentration"))
-            if not state_changed and prev_concentration != curr_concentration:
-                if curr_concentration:
-                    self._actor_log(name, "концентрируется на заклинании")
-                else:
-                    self._actor_log(name, "теряет концентрацию")
-
-            prev_incapacitated = bool(prev_effects.get("incapacitated"))
-            curr_incapacitated = bool(curr_effects.get("incapacitated"))
-            if not state_changed and prev_incapacitated != curr_incapacitated:
-                if curr_incapacitated:
-                    self._actor_log(name, "теряет возможность действовать")
-                else:
-                    self._actor_log(name, "снова может действовать")
-
-            prev_custom = previous.get("custom_effects", {})
-            curr_custom = current.get("custom_effects", {})
-            prev_names = set(prev_custom.keys())
-            curr_names = set(curr_custom.keys())
-            for effect_name in sorted(curr_names - prev_names):
-                self._actor_log(name, f"получает эффект {html.escape(effect_name)}")
-            for effect_name in sorted(prev_names - curr_names):
-                self._actor_log(name, f"теряет эффект {html.escape(effect_name)}")
+                    self._actor_log(name, "приходит в себя")
+            else:
+                self._actor_log(name, f"состояние {curr_state}")
+
+        elif event_type == "damage":
+            absorbed = event.get("absorbed", 0)
+            if event.get("amount", 0) + absorbed > 0:
+                self._actor_log(name, "получает урон")
+                if absorbed > 0 and event.get("temp_hp") == 0:
+                    self._actor_log(name, "теряет временные HP")
+
+        elif event_type == "heal":
+            if event.get("amount", 0) > 0:
+                self._actor_log(name, "восстанавливает HP")
+
+        elif event_type == "temp_hp":
+            self._actor_log(name, "получает временные HP")
+
+        elif event_type == "concentration":
+            if event.get("value"):
+                self._actor_log(name, "концентрируется на заклинании")
+            else:
+                self._actor_log(name, "теряет концентрацию")
+
+        elif event_type == "incapacitated":
+            if event.get("value"):
+                self._actor_log(name, "теряет возможность действовать")
+            else:
+                self._actor_log(name, "снова может действовать")
+
+        elif event_type == "effect_added":
+            self._actor_log(name, f"получает эффект {html.escape(event.get('effect', ''))}")
+
+        elif event_type in ("effect_removed", "effect_expired"):
+            self._actor_log(name, f"теряет эффект {html.escape(event.get('effect', ''))}")
 
     def update_state(self, payload):
         running = bool(payload.get("running", False))
         round_value = int(payload.get("round", 0))
 
         was_running = self._running
-        self._collect_diff_logs(payload)
+        self._apply_events(payload.get("events"), payload.get("events_from"))
 
         if running and not was_running:
             if self._clear_logs_timer.isActive():
@@ -282,7 +408,256 @@ class PlayerUiState(QObject):
             self.roundChanged.emit()
 
         self._active_ids = list(payload.get("active_ids", []) or [])
-        self._prev_payload = payload
+
+    def apply_record(self, record):
+        """
+        Запись потока battle_state.jsonl: keyframe или patch
+        """
+        if record.get("type") == "keyframe":
+            payload = record.get("state", {})
+            self.update_state(payload)
+            self._model.update_items(payload.get("combatants", []), self._active_ids)
+            return
+        if record.get("type") == "patch":
+            self.apply_patch(record)
+
+    def apply_patch(self, patch):
+        self._apply_events(patch.get("events"), patch.get("events_from"))
+
+        if "round" in patch:
+            round_value = int(patch["round"] or 0)
+            if self._round != round_value:
+                self._round = round_value
+                self.roundChanged.emit()
+
+        prev_active_ids = self._active_ids
+        if "active_ids" in patch:
+            self._active_ids = list(patch["active_ids"] or [])
+        self._model.apply_patch(patch, prev_active_ids, self._active_ids)
+
+
+class PatchStreamReader:
+    """
+    Читает battle_state.jsonl с последней позиции. При разрыве нумерации
+    или перезаписи файла перечитывает его с ключевого кадра.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._offset = 0
+        self._tail = b""
+        self._seq = None
+        # (st_dev, st_ino) прочитанного файла: write_atomic подменяет файл
+        # целиком, и новый может оказаться не короче старой позиции
+        self._identity = None
+
+    def _reset(self):
+        self._offset = 0
+        self._tail = b""
+        self._seq = None
+
+    def read(self, _resynced=False):
+        try:
+            with open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                identity = (stat.st_dev, stat.st_ino)
+                if identity != self._identity or stat.st_size < self._offset:
+                    self._reset()
+                    self._identity = identity
+                f.seek(self._offset)
+                chunk = f.read()
+        except OSError:
+            return []
+        self._offset += len(chunk)
+
+        lines = (self._tail + chunk).split(b"\n")
+        self._tail = lines.pop()
+
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # в том числе UnicodeDecodeError: позиция посреди символа
+                record = None
+            if not isinstance(record, dict):
+                if _resynced:
+                    return records
+                self._reset()
+                return self.read(_resynced=True)
+
+            seq = record.get("seq")
+            if record.get("type") == "keyframe":
+                self._seq = seq
+                records.append(record)
+            elif self._seq is None:
+                # ждём ключевой кадр
+                continue
+            elif seq == self._seq + 1:
+                self._seq = seq
+                records.append(record)
+            elif not _resynced:
+                self._reset()
+                return records + self.read(_resynced=True)
+        return records
+
+
+class PushClient(QObject):
+    """
+    Клиент SSE-сервера экспортёра. Читает поток в фоновом потоке и отдаёт
+    события в GUI-поток через сигнал messageReceived(event, data).
+    """
+
+    messageReceived = Signal(str, object)
+
+    def __init__(self, host, port, parent=None):
+        super().__init__(parent)
+        self.host = host
+        self.port = port
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        backoff = 0.25
+        while self._running:
+            try:
+                self._listen()
+                backoff = 0.25
+            except (OSError, http.client.HTTPException):
+                pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 2.0)
+
+    def _listen(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            connection.request("GET", "/events", headers={"Accept": "text/event-stream"})
+            response = connection.getresponse()
+            if response.status != 200:
+                return
+            event, data_lines = "message", []
+            while self._running:
+                raw = response.readline()
+                if not raw:
+                    return
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if not line:
+                    if data_lines:
+                        self._dispatch(event, "\n".join(data_lines))
+                    event, data_lines = "message", []
+                elif line.startswith(":"):
+                    continue
+                elif line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data_lines.append(line[5:].lstrip())
+        finally:
+            connection.close()
+
+    def _dispatch(self, event, data):
+        try:
+            payload = json.loads(data)
+        except json.JSONDecodeError:
+            return
+        if isinstance(payload, dict):
+            self.messageReceived.emit(event, payload)
+
+
+class StateFileWatcher(QObject):
+    """
+    Перечитывает файл состояния только когда он изменился.
+
+    Источник событий — QFileSystemWatcher (следит и за файлом, и за папкой:
+    атомарная подмена файла снимает его с наблюдения). Редкий таймер —
+    страховка для ФС без уведомлений. Перед чтением сверяется
+    (mtime, size, inode); сам loader выполняется в рабочем потоке,
+    результат приходит сигналом loaded в GUI-поток.
+    """
+
+    loaded = Signal(object)
+    _finished = Signal(object)
+
+    def __init__(self, path, loader, fallback_interval=1000, parent=None):
+        super().__init__(parent)
+        self.path = Path(path)
+        self._loader = loader
+        self._signature = None
+        self._busy = False
+        self._dirty = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-loader")
+        self._finished.connect(self._on_finished, Qt.QueuedConnection)
+
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.fileChanged.connect(self._on_fs_event)
+        self._watcher.directoryChanged.connect(self._on_fs_event)
+        self._watcher.addPath(str(self.path.parent))
+        self._watch_file()
+
+        self._fallback = QTimer(self)
+        self._fallback.setInterval(fallback_interval)
+        self._fallback.timeout.connect(self.check)
+
+    def start(self):
+        self._fallback.start()
+        self.check()
+
+    def stop(self):
+        self._fallback.stop()
+        self._executor.shutdown(wait=False)
+
+    def _watch_file(self):
+        path = str(self.path)
+        if self.path.exists() and path not in self._watcher.files():
+            self._watcher.addPath(path)
+
+    def _on_fs_event(self, _path):
+        self._watch_file()
+        self.check()
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def check(self):
+        signature = self._stat_signature()
+        if signature is None or signature == self._signature:
+            return
+        if self._busy:
+            self._dirty = True
+            return
+        self._signature = signature
+        self._busy = True
+        self._executor.submit(self._load)
+
+    def _load(self):
+        try:
+            result = self._loader()
+        except Exception:
+            result = None
+        self._finished.emit(result)
+
+    def _on_finished(self, result):
+        self._busy = False
+        if result:
+            self.loaded.emit(result)
+        if self._dirty:
+            self._dirty = False
+            self.check()
 
 
 def load_state(path):
@@ -296,7 +671,14 @@ def load_state(path):
 
 
 def main():
-    app = QGuiApplication(sys.argv)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", action="store_true", help="читать battle_state.jsonl (патчи); мастер запускается с TNDM_EXPORT_MODE=stream")
+    parser.add_argument("--push", type=int, metavar="PORT", help="получать состояние с SSE-сервера экспортёра")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--poll", action="store_true", help="старый режим: перечитывать файл каждые 250 мс")
+    args, qt_args = parser.parse_known_args()
+
+    app = QGuiApplication([sys.argv[0], *qt_args])
     engine = QQmlApplicationEngine()
 
     model = CombatantModel()
@@ -304,10 +686,21 @@ def main():
 
     base_dir = Path(__file__).resolve().parent
     state_path = base_dir / "battle_state.json"
+    stream_reader = PatchStreamReader(base_dir / "battle_state.jsonl")
     last_payload = None
 
+    def apply_snapshot(payload):
+        state.update_state(payload)
+        combatants = payload.get("combatants", [])
+        active_ids = payload.get("active_ids", [])
+        model.update_items(combatants, active_ids)
+
     def tick():
         nonlocal last_payload
+        if args.stream:
+            for record in stream_reader.read():
+                state.apply_record(record)
+            return
         payload = load_state(state_path)
         if payload is None:
             if last_payload is None:
@@ -315,15 +708,54 @@ def main():
                 model.update_items([], [])
             return
         last_payload = payload
-        state.update_state(payload)
-        combatants = payload.get("combatants", [])
-        active_ids = payload.get("active_ids", [])
-        model.update_items(combatants, active_ids)
+        apply_snapshot(payload)
+
+    def on_push(event, payload):
+        if event == "state":
+            apply_snapshot(payload)
+        else:
+            state.apply_record(payload)
+
+    last_version = None
+
+    def load_snapshot():
+        # выполняется в рабочем потоке StateFileWatcher
+        nonlocal last_version
+        payload = load_state(state_path)
+        if payload is None:
+            return None
+        version = payload.get("version")
+        if version is not None and version == last_version:
+            return None
+        last_version = version
+        return payload
+
+    def on_loaded(result):
+        if args.stream:
+            for record in result:
+                state.apply_record(record)
+        else:
+            apply_snapshot(result)
 
     timer = QTimer()
-    timer.setInterval(250)
-    timer.timeout.connect(tick)
-    timer.start()
+    push_client = None
+    watcher = None
+    if args.push:
+        push_client = PushClient(args.host, args.push)
+        # слот выполняется в GUI-потоке, которому принадлежит push_client
+        push_client.messageReceived.connect(on_push, Qt.QueuedConnection)
+        push_client.start()
+    elif args.poll:
+        timer.setInterval(250)
+        timer.timeout.connect(tick)
+        timer.start()
+    else:
+        if args.stream:
+            watcher = StateFileWatcher(stream_reader.path, stream_reader.read)
+        else:
+            watcher = StateFileWatcher(state_path, load_snapshot)
+        watcher.loaded.connect(on_loaded)
+        watcher.start()
 
     engine.rootContext().setContextProperty("playerState", state)
     engine.rootContext().setContextProperty("playerModel", model)
@@ -1,76 +1,361 @@
-import random
-from typing import List
-from combatants import Combatant
+from collections import deque
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import List, NamedTuple
+from combatants import Combatant, Monster, Player
+from history import UndoHistory, UndoStep
+from initiative import InitiativeOrder
+from rng_service import INITIATIVE, default_service
+
+# сколько последних событий журнала держит движок и отдаёт в снимке
+EVENT_WINDOW = 128
+
+
+class CombatantSnapshot(NamedTuple):
+    """
+    Неизменяемый срез участника на момент публикации
+    """
+    id: int
+    version: int
+    kind: str
+    name: str
+    custom_name: str
+    hp: int | None
+    max_hp: int | None
+    temp_hp: int
+    ac: int | None
+    initiative: int | None
+    state: str
+    concentration: bool
+    incapacitated: bool
+    custom_effects: tuple  # ((название, длительность), ...)
+
+    @classmethod
+    def of(cls, combat):
+        kind = "combatant"
+        if isinstance(combat, Player):
+            kind = "player"
+        elif isinstance(combat, Monster):
+            kind = "monster"
+        custom_effects = tuple(
+            (name, combat.effect_duration(name))
+            for name in combat.effects.get("custom_effects", {})
+        )
+        return cls(
+            combat.id, combat.version, kind, combat.name, combat.custom_name,
+            combat.hp, combat.max_hp, combat.temp_hp, combat.ac, combat.initiative,
+            combat.state, bool(combat.concentration), combat.incapacitated, custom_effects,
+        )
+
+
+class EngineSnapshot(NamedTuple):
+    """
+    Версионированный снимок боя для фоновых читателей (экспорт, сеть).
+    Публикуется целиком одной ссылкой, неизменившиеся участники и
+    группы переиспользуются из предыдущего снимка.
+    """
+    version: int
+    in_combat: bool
+    round: int
+    current_index: int
+    combatants: tuple  # CombatantSnapshot в порядке таблицы
+    groups: tuple      # кортежи id по инициативным группам
+    by_id: MappingProxyType
+    events: tuple      # последние события журнала, по возрастанию seq
 
 
 class BattleEngine:
-    def __init__(self, combatants: List[Combatant] = None):
-        self.combatants = combatants or []
+    def __init__(self, combatants: List[Combatant] = None, history_limit=500, rng=None):
+        combatants = combatants or []
+        # RngService; None — общий сервис процесса
+        self.rng = rng
         self.current_index = 0
         self.round = 1
         self.in_combat = False
-        self.combatant_groups = []
         self.sub_index = 0
         self.turn_started = set()
         self.prev_group = None
         self.current_initiative_group = None
+        # версия состояния боя и подписчики на её изменение
+        self.version = 0
+        self._listeners = []
+        # подписчики на зафиксированные шаги (журнал сессии)
+        self._step_listeners = []
+        # вложенность batch() и были ли изменения внутри пачки
+        self._batch_depth = 0
+        self._batch_dirty = False
+        # планировщик эффектов: id участника -> {turns_ended истечения: {названия}}
+        self._effect_wheel = {}
+        # эффекты, наложенные до ближайшего конца хода носителя
+        self._fresh_effects = {}
+        # обратные индексы: название эффекта -> носители, концентрирующиеся
+        self._effect_carriers = {}
+        self._concentrating = set()
+        for c in combatants:
+            self._attach(c)
+            self._register_effects(c)
+        # порядок инициативы поддерживается инкрементально, в том числе посреди боя
+        self.initiative_order = InitiativeOrder(combatants)
+        # журнал событий боя: {"seq", "type", "combatant", ...поля события}
+        self.event_seq = 0
+        self.events = deque(maxlen=EVENT_WINDOW)
+        # отмена: шаг фиксируется при публикации снимка, мементо —
+        # последние зафиксированные состояния участников и полей движка
+        self.history = UndoHistory(history_limit)
+        self._mementos = {}
+        self._engine_memento = None
+        self._step_membership = []
+        self._replaying = False
+        # copy-on-write снимки для читателей из других потоков
+        self._structure_version = 0
+        self._combatant_snapshots = {}
+        self._groups_snapshot = (None, ())
+        self.snapshot = None
+        self._publish()
+
+    @property
+    def combatants(self):
+        return self.initiative_order.combatants
+
+    @property
+    def combatant_groups(self):
+        return self.initiative_order.groups
+
+    # =========================
+    # change notifications
+    # =========================
+
+    def subscribe(self, callback):
+        """
+        callback(version) вызывается после каждой мутации движка или участника
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def subscribe_steps(self, callback):
+        """
+        callback(step) получает каждый зафиксированный UndoStep, включая
+        шаги отмены/повтора и очистки — в отличие от истории
+        """
+        if callback not in self._step_listeners:
+            self._step_listeners.append(callback)
+
+    def unsubscribe_steps(self, callback):
+        if callback in self._step_listeners:
+            self._step_listeners.remove(callback)
+
+    def mark_changed(self, combat=None):
+        """
+        Для правок в обход API движка (прямые записи в effects и т.п.)
+        """
+        if combat is not None:
+            combat._touch()
+        else:
+            self._notify()
+
+    def _attach(self, combat):
+        if combat.id is None:
+            combat.id = Combatant.allocate_id()
+        combat._observer = self._on_combatant_changed
+
+    def _on_combatant_changed(self, combat, event=None):
+        self.initiative_order.refresh(combat)
+        if combat.concentration:
+            self._concentrating.add(combat)
+        else:
+            self._concentrating.discard(combat)
+        if event is not None:
+            event_type, fields = event
+            self._record(event_type, combat, **fields)
+        self._notify()
+
+    def _record(self, event_type, combat=None, **fields):
+        self.event_seq += 1
+        self.events.append({
+            "seq": self.event_seq,
+            "type": event_type,
+            "combatant": combat.id if combat is not None else None,
+            **fields,
+        })
+
+    @contextmanager
+    def batch(self):
+        """
+        Пачка мутаций с одним уведомлением и одним снимком в конце:
+        экспорт не увидит наполовину применённый урон по группе
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._batch_dirty:
+                self._batch_dirty = False
+                self._notify()
+
+    def _notify(self):
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
+        self.version += 1
+        self._publish()
+        for callback in list(self._listeners):
+            callback(self.version)
+
+    def _publish(self):
+        """
+        Собирает новый снимок в потоке, который мутирует движок, и
+        подменяет self.snapshot одной ссылкой — читателям не нужны блокировки
+        """
+        cache = self._combatant_snapshots
+        combatants = []
+        changes = []
+        for c in self.combatants:
+            cached = cache.get(c.id)
+            if cached is None or cached.version != c.version:
+                cached = CombatantSnapshot.of(c)
+                cache[c.id] = cached
+                self._capture(c, changes)
+            combatants.append(cached)
+        if len(cache) > len(combatants):
+            alive_ids = {c.id for c in self.combatants}
+            for combatant_id in [key for key in cache if key not in alive_ids]:
+                del cache[combatant_id]
+                self._mementos.pop(combatant_id, None)
+        self._commit_step(changes)
+
+        key, groups = self._groups_snapshot
+        if key != self._structure_version:
+            groups = tuple(tuple(c.id for c in group) for group in self.combatant_groups)
+            self._groups_snapshot = (self._structure_version, groups)
+
+        self.snapshot = EngineSnapshot(
+            self.version, self.in_combat, self.round, self.current_index,
+            tuple(combatants), groups,
+            MappingProxyType({c.id: c for c in combatants}),
+            tuple(self.events),
+        )
 
     def add_combatant(self, combatant):
-        self.combatants.append(combatant)
-        if not self.in_combat:
-            self.sort_initiative()
+        self._join(combatant)
+        self._step_membership.append((combatant, True, self._memento_of(combatant)))
+        self._notify()
 
-    def roll_initiative(self):
+    def remove_combatant(self, combatant):
+        if combatant not in self.initiative_order:
+            return
+        memento = self._memento_of(combatant)
+        self._leave(combatant)
+        self._step_membership.append((combatant, False, memento))
+        self._notify()
+
+    def _join(self, combat, ordinal=None):
+        self._attach(combat)
+        self._place(combat, ordinal)
+        self._register_effects(combat)
+
+    def _leave(self, combat):
+        self._unplace(combat)
+        combat._observer = None
+        self._unregister_effects(combat)
+
+    def set_initiative(self, combat, value):
+        if combat.initiative == value:
+            return
+        self._unplace(combat)
+        combat.initiative = value
+        self._place(combat)
+        combat._touch()
+
+    def _place(self, combat, ordinal=None):
+        """
+        Ставит участника в порядок инициативы. Посреди боя группа, вставленная
+        перед текущей позицией, уже пропустила свой ход в этом раунде
+        """
+        index, created = self.initiative_order.add(combat, ordinal)
+        if created and self.in_combat and index < self.current_index:
+            self.current_index += 1
+        self._structure_version += 1
+
+    def _unplace(self, combat):
+        index, dropped = self.initiative_order.remove(combat)
+        if dropped and self.in_combat:
+            if index < self.current_index:
+                self.current_index -= 1
+            if self.current_index >= len(self.combatant_groups):
+                # ушла последняя группа раунда — следующим ходит первая группа
+                if self.combatant_groups:
+                    self.round += 1
+                self.current_index = 0
+        self._structure_version += 1
+
+    def clear(self):
         for c in self.combatants:
+            self._step_membership.append((c, False, self._memento_of(c)))
+            c._observer = None
+        self.initiative_order = InitiativeOrder()
+        self._effect_wheel = {}
+        self._fresh_effects = {}
+        self._effect_carriers = {}
+        self._concentrating = set()
+        self.prev_group = None
+        self._structure_version += 1
+        self._notify()
+        # новый бой — старую историю не отменить
+        self.history.clear()
+
+    def roll_initiative(self):
+        rng = (self.rng or default_service()).stream(INITIATIVE)
+        for c in list(self.combatants):
             if c.initiative is None:
-                c.initiative = random.randint(1, 20)
-        self.sort_initiative()
+                self._unplace(c)
+                c.initiative = rng.randint(1, 20)
+                c.version += 1
+                self._place(c)
+        self._notify()
 
     def start_combat(self):
         if self.in_combat or not self.combatants:
             return
-        self.sort_initiative()
-        self.build_initiative_groups()
-        self.in_combat = True
-        self.current_index = 0
-        self.sub_index = 0
-        self.prev_group = None
-        if self.combatant_groups:
-            first_group = self.next_turn()
-            self.current_initiative_group = first_group[0].initiative
-            self.round = 1
+        # первый ход и старт боя — одно действие для отмены
+        with self.batch():
+            self.build_initiative_groups()
+            self.in_combat = True
+            self.current_index = 0
+            self.sub_index = 0
+            self.prev_group = None
+            if self.combatant_groups:
+                first_group = self.next_turn()
+                self.current_initiative_group = first_group[0].initiative
+                self.round = 1
+            self._record("combat_start")
+            self._notify()
 
     def end_combat(self):
         self.in_combat = False
         self.current_index = 0
         self.sub_index = 0
         self.round = 1
+        self._record("combat_end")
+        self._notify()
 
     def sort_initiative(self):
+        """
+        Полная перестройка порядка — только если инициативу меняли
+        в обход set_initiative
+        """
         if self.in_combat:
             return
-
-        self.combatants.sort(
-            key=lambda c: c.initiative if c.initiative is not None else 0,
-            reverse=True
-        )
+        self.initiative_order = InitiativeOrder(self.combatants)
+        self._structure_version += 1
 
     def build_initiative_groups(self):
-        sorted_units = sorted(self.combatants, key=lambda x: x.initiative, reverse=True)
-        groups = []
-        current_group = []
-        current_init = None
-        for unit in sorted_units:
-            if current_init is None or unit.initiative != current_init:
-                if current_group:
-                    groups.append(current_group)
-                current_group = [unit]
-                current_init = unit.initiative
-            else:
-                current_group.append(unit)
-        if current_group:
-            groups.append(current_group)
-        self.combatant_groups = groups
+        # группы уже поддерживает initiative_order, сбрасываем только позицию хода
+        self._structure_version += 1
         self.current_index = 0
         self.sub_index = 0
 
@@ -90,30 +375,42 @@ class BattleEngine:
         if self.prev_group:
             self._update_effects_for_prev_turn(self.prev_group)
 
+        order = self.initiative_order
         total = len(self.combatant_groups)
-        checked = 0
-        while checked < total:
-            group = self.combatant_groups[self.current_index]
-            if any(not c.incapacitated for c in group):
-                result = group
-                self.prev_group = result
-                self.current_index += 1
-                if self.current_index >= total:
-                    self.current_index = 0
-                    self.round += 1
-                return result
-            self.current_index += 1
-            if self.current_index >= total:
-                self.current_index = 0
+        while True:
+            found = order.next_ready(self.current_index)
+            if found is None:
+                # действовать некому: полный круг без хода
                 self.round += 1
-            checked += 1
-        return None
+                self._notify()
+                return None
+            index, wrapped = found
+            group = self.combatant_groups[index]
+            # страховка от правок состояния в обход _touch/mark_changed
+            stale = [order.refresh(c) for c in group]
+            if any(stale) and not order.can_act(index):
+                continue
+            break
+
+        if wrapped:
+            self.round += 1
+        self.prev_group = group
+        self._record("turn", round=self.round, ids=[c.id for c in group])
+        self.current_index = index + 1
+        if self.current_index >= total:
+            self.current_index = 0
+            self.round += 1
+        self._notify()
+        return group
 
     def set_state(self, combat, new_state):
         old_state = getattr(combat, "state", "alive")
         combat.state = new_state
+        if old_state != new_state:
+            self._record("state", combat, **{"from": old_state, "to": new_state})
 
-        combat.effects["concentration"] = False
+        if new_state != "alive":
+            combat.concentration = False
 
         if new_state == "dead":
             if combat.hp is not None:
@@ -132,22 +429,113 @@ class BattleEngine:
             if old_state in ("dead", "unconscious") and combat.hp is not None:
                 combat.hp = 1
             combat.effects["incapacitated"] = False
+        combat._touch()
+
+    # =========================
+    # bulk mutations
+    # =========================
+
+    def apply_damage(self, targets, amount, halved=()):
+        """
+        Урон по нескольким целям; halved — цели, преуспевшие в спасброске
+        (половина урона, с округлением вниз)
+        """
+        halved = set(halved)
+        with self.batch():
+            for combat in targets:
+                combat.take_damage(amount // 2 if combat in halved else amount)
+
+    def apply_heal(self, targets, amount):
+        with self.batch():
+            for combat in targets:
+                combat.heal(amount)
+
+    def apply_temp_hp(self, targets, amount):
+        with self.batch():
+            for combat in targets:
+                combat.add_temp_hp(amount)
+
+    def apply_effect(self, targets, name, duration):
+        with self.batch():
+            for combat in targets:
+                self.add_effect(combat, name, duration)
+
+    def set_states(self, targets, new_state):
+        with self.batch():
+            for combat in targets:
+                self.set_state(combat, new_state)
 
     def add_effect(self, combat, name, duration):
-        effects = combat.effects.get("custom_effects", {})
-        if duration == "вечный":
-            duration = None
-        effects[name] = {
-            "duration": duration,
-            "applied_round": self.round
-        }
-        combat.effects["custom_effects"] = effects
+        """
+        duration — в ходах носителя; None, 0 и "вечный" — бессрочный эффект
+        """
+        effects = combat.effects.setdefault("custom_effects", {})
+        duration = self._effect_duration(duration)
+        old = effects.get(name)
+        if old is not None:
+            self._unschedule_effect(combat, name, old)
+        entry = {"applied_round": self.round, "expires": None}
+        if duration is not None:
+            entry["expires"] = combat.turns_ended + duration
+        effects[name] = entry
+        if combat in self.initiative_order:
+            self._effect_carriers.setdefault(name, set()).add(combat)
+            if duration is not None:
+                self._schedule_effect(combat, name, entry)
+        self._record("effect_added", combat, effect=name, duration=duration)
+        combat._touch()
 
     def remove_effect(self, combat, name):
-            effects = combat.effects.get("custom_effects", {})
-            if name in effects:
-                del effects[name]
-            combat.effects["custom_effects"] = effects
+        self._drop_effect(combat, name)
+        combat._touch()
+
+    def remove_effect_everywhere(self, name):
+        """
+        Снимает эффект со всех носителей (туман, огонь фей) одним
+        уведомлением. Возвращает число носителей
+        """
+        carriers = list(self._effect_carriers.get(name, ()))
+        for combat in carriers:
+            self._drop_effect(combat, name)
+            combat.version += 1
+        if carriers:
+            self._notify()
+        return len(carriers)
+
+    def combatants_with_effect(self, name):
+        return tuple(self._effect_carriers.get(name, ()))
+
+    def concentrating(self):
+        return tuple(self._concentrating)
+
+    def effect_counts(self):
+        """
+        Название эффекта -> число носителей
+        """
+        return {name: len(carriers) for name, carriers in self._effect_carriers.items()}
+
+    def _drop_effect(self, combat, name):
+        entry = combat.effects.setdefault("custom_effects", {}).pop(name, None)
+        if entry is None:
+            return False
+        self._unschedule_effect(combat, name, entry)
+        self._unindex_effect(combat, name)
+        self._record("effect_removed", combat, effect=name)
+        return True
+
+    def _unindex_effect(self, combat, name):
+        carriers = self._effect_carriers.get(name)
+        if carriers is not None:
+            carriers.discard(combat)
+            if not carriers:
+                del self._effect_carriers[name]
+
+    @staticmethod
+    def _effect_duration(duration):
+        if duration is None or duration == "вечный":
+            return None
+        duration = int(duration)
+        return duration if duration > 0 else None
 
     def add_concentration(self, combat):
         combat.add_concentration()
@@ -156,14 +544,244 @@ class BattleEngine:
         combat.remove_concentration()
 
     def _update_effects_for_prev_turn(self, group):
+        """
+        Конец хода группы: тикают часы участников, удаляются только
+        те эффекты, чей срок пришёлся на этот ход
+        """
+        turn_round = self.round
         for combat in group:
+            # часы — часть состояния участника (отмена, журнал сессии)
+            combat.turns_ended += 1
+            combat.version += 1
             effects = combat.effects.get("custom_effects", {})
-            for name, eff in list(effects.items()):
-                dur = eff["duration"]
-                if dur is None:
-                    continue
-                if eff["applied_round"] == self.round:
-                    continue
-                eff["duration"] -= 1
-                if eff["duration"] <= 0:
-                    del effects[name]
+            # эффект, наложенный в том же раунде, концы хода этого раунда не считает;
+            # ждёт до первого конца хода в следующем раунде
+            fresh = self._fresh_effects.pop(combat.id, None)
+            if fresh:
+                still_fresh = []
+                for name, entry in fresh:
+                    if entry["applied_round"] == turn_round and effects.get(name) is entry:
+                        self._unschedule_effect(combat, name, entry)
+                        entry["expires"] += 1
+                        self._schedule_effect(combat, name, entry, fresh=False)
+                        still_fresh.append((name, entry))
+                if still_fresh:
+                    self._fresh_effects[combat.id] = still_fresh
+
+            pending = self._effect_wheel.get(combat.id)
+            if not pending:
+                continue
+            for name in pending.pop(combat.turns_ended, ()):
+                if effects.pop(name, None) is not None:
+                    self._unindex_effect(combat, name)
+                    self._record("effect_expired", combat, effect=name)
+            if not pending:
+                del self._effect_wheel[combat.id]
+
+    def _register_effects(self, combat):
+        """
+        Участник вошёл в бой: его эффекты попадают в планировщик и индексы
+        """
+        if combat.concentration:
+            self._concentrating.add(combat)
+        for name, entry in combat.effects.get("custom_effects", {}).items():
+            self._effect_carriers.setdefault(name, set()).add(combat)
+            if "expires" not in entry:
+                # эффект записан в обход add_effect
+                duration = self._effect_duration(entry.get("duration"))
+                entry["expires"] = None if duration is None else combat.turns_ended + duration
+                entry.setdefault("applied_round", self.round)
+            if entry["expires"] is not None:
+                self._schedule_effect(combat, name, entry)
+
+    def _unregister_effects(self, combat):
+        self._effect_wheel.pop(combat.id, None)
+        self._fresh_effects.pop(combat.id, None)
+        self._concentrating.discard(combat)
+        for name in combat.effects.get("custom_effects", {}):
+            self._unindex_effect(combat, name)
+
+    def _schedule_effect(self, combat, name, entry, fresh=True):
+        pending = self._effect_wheel.setdefault(combat.id, {})
+        pending.setdefault(entry["expires"], set()).add(name)
+        if fresh:
+            self._fresh_effects.setdefault(combat.id, []).append((name, entry))
+
+    def _unschedule_effect(self, combat, name, entry):
+        pending = self._effect_wheel.get(combat.id)
+        if not pending or entry.get("expires") not in pending:
+            return
+        bucket = pending[entry["expires"]]
+        bucket.discard(name)
+        if not bucket:
+            del pending[entry["expires"]]
+            if not pending:
+                del self._effect_wheel[combat.id]
+
+    # =========================
+    # undo / redo
+    # =========================
+
+    def undo(self):
+        if self._batch_depth or not self.history.can_undo:
+            return False
+        self._replay(self.history.pop_undo(), undo=True)
+        return True
+
+    def redo(self):
+        if self._batch_depth or not self.history.can_redo:
+            return False
+        self._replay(self.history.pop_redo(), undo=False)
+        return True
+
+    def _replay(self, step, undo):
+        self._replaying = True
+        try:
+            membership = reversed(step.membership) if undo else step.membership
+            for combat, added, memento in membership:
+                # отмена добавления и повтор удаления — убрать участника
+                if added == undo:
+                    self._step_membership.append((combat, False, self._memento_of(combat)))
+                    self._leave(combat)
+                else:
+                    # вне боя участника могли менять — возвращаем как был
+                    self._join(combat)
+                    self._restore(combat, memento)
+                    self._step_membership.append((combat, True, memento))
+            for combat, before, after in step.changes:
+                self._restore(combat, before if undo else after)
+            if step.engine:
+                self._restore_engine(step.engine[0] if undo else step.engine[1])
+            self._record("undo" if undo else "redo")
+            self._notify()
+        finally:
+            self._replaying = False
+
+    def _memento_of(self, combat):
+        custom_effects = tuple(
+            (name, entry.get("expires"), entry.get("applied_round"))
+            for name, entry in combat.effects.get("custom_effects", {}).items()
+        )
+        return (
+            combat.hp, combat.temp_hp, combat.state, combat.concentration,
+            combat.effects.get("incapacitated", False), combat.initiative,
+            self.initiative_order.ordinal(combat), combat.turns_ended, custom_effects,
+        )
+
+    def _engine_state(self):
+        prev_group = tuple(self.prev_group) if self.prev_group is not None else None
+        return (
+            self.in_combat, self.round, self.current_index, self.sub_index,
+            prev_group, self.current_initiative_group,
+        )
+
+    def _capture(self, combat, changes):
+        after = self._memento_of(combat)
+        before = self._mementos.get(combat.id)
+        self._mementos[combat.id] = after
+        if before is not None and before != after:
+            changes.append((combat, before, after))
+
+    def _commit_step(self, changes):
+        engine_before = self._engine_memento
+        engine_after = self._engine_state()
+        self._engine_memento = engine_after
+        # добавленного участника могли изменить в той же пачке: повтор
+        # должен вернуть его итоговое состояние, а не состояние при добавлении
+        membership = tuple(
+            (c, added, self._mementos.get(c.id, memento) if added else memento)
+            for c, added, memento in self._step_membership
+        )
+        self._step_membership = []
+        if engine_before is None:
+            return
+        engine = (engine_before, engine_after) if engine_before != engine_after else ()
+        if not (changes or membership or engine):
+            return
+        step = UndoStep(tuple(changes), membership, engine)
+        if not self._replaying:
+            self.history.push(step)
+        for callback in list(self._step_listeners):
+            callback(step)
+
+    def _restore(self, combat, memento):
+        (hp, temp_hp, state, concentration, disabled, initiative, ordinal,
+         turns_ended, custom_effects) = memento
+        placed = combat in self.initiative_order
+        if placed:
+            self._unregister_effects(combat)
+            if combat.initiative != initiative or self.initiative_order.ordinal(combat) != ordinal:
+                self._unplace(combat)
+                combat.initiative = initiative
+                self._place(combat, ordinal)
+        combat.initiative = initiative
+        combat.hp = hp
+        combat.temp_hp = temp_hp
+        combat.state = state
+        combat.concentration = concentration
+        combat.turns_ended = turns_ended
+        combat.effects["incapacitated"] = disabled
+        combat.effects["custom_effects"] = {
+            name: {"applied_round": applied_round, "expires": expires}
+            for name, expires, applied_round in custom_effects
+        }
+        if placed:
+            self._register_effects(combat)
+            self.initiative_order.refresh(combat)
+        combat.version += 1
+
+    def _restore_engine(self, state):
+        (self.in_combat, self.round, self.current_index, self.sub_index,
+         prev_group, self.current_initiative_group) = state
+        # группа могла пересоздаться — берём живой список по её участникам
+        live = [c for c in prev_group or () if c in self.initiative_order]
+        if live:
+            self.prev_group = self.combatant_groups[self.initiative_order.group_index(live[0])]
+        else:
+            self.prev_group = list(prev_group) if prev_group is not None else None
+
+    # =========================
+    # persistence
+    # =========================
+
+    def memento(self, combat):
+        """
+        Последнее зафиксированное состояние участника (см. _memento_of)
+        """
+        memento = self._mementos.get(combat.id)
+        return memento if memento is not None else self._memento_of(combat)
+
+    def turn_state(self):
+        return self._engine_memento or self._engine_state()
+
+    def load_state(self, joined=(), changed=(), left=(), turn=None):
+        """
+        Восстановление сохранённого состояния (журнал сессии, файл встречи)
+        одним уведомлением и (вне batch()) без записи в историю отмены.
+        joined — (участник, memento) для (пере)входа в бой,
+        changed — (участник, memento) для участников в бою,
+        left — убираемые участники, turn — поля движка, где prev_group —
+        кортеж участников
+        """
+        self._replaying = True
+        try:
+            for combat in left:
+                if combat in self.initiative_order:
+                    self._step_membership.append((combat, False, self._memento_of(combat)))
+                    self._leave(combat)
+            for combat, memento in joined:
+                if combat in self.initiative_order:
+                    self._leave(combat)
+                Combatant.reserve_id(combat.id)
+                # сразу на сохранённое место, без перестановки в _restore
+                combat.initiative = memento[5]
+                self._join(combat, memento[6])
+                self._restore(combat, memento)
+                self._step_membership.append((combat, True, memento))
+            for combat, memento in changed:
+                self._restore(combat, memento)
+            if turn is not None:
+                self._restore_engine(turn)
+            self._notify()
+        finally:
+            self._replaying = False
@@ -1,27 +1,136 @@
 import json
 import re
+import tempfile
 import time
 import threading
 import os
-from copy import deepcopy
 
-from combatants import Monster, Player
-
-EXPORT_DIR = r"C:\Users\8twii\PycharmProjects\CombatTracker\pui"
-EXPORT_FILE = os.path.join(EXPORT_DIR, "battle_state.json")
+from push_server import PushServer, DEFAULT_HOST
+
+EXPORT_DIR = os.environ.get(
+    "TNDM_EXPORT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "Pui")
+)
+EXPORT_FILE_NAME = "battle_state.json"
+STREAM_FILE_NAME = "battle_state.jsonl"
+
+EMPTY_PAYLOAD = {
+    "running": False,
+    "combatants": [],
+    "active_ids": []
+}
+
+FSYNC_POLICIES = ("never", "always", "periodic")
+
+# пауза перед повтором неудавшейся записи (файл занят читателем и т.п.)
+WRITE_RETRY_DELAY = 0.2
+
+# сколько последних событий журнала боя уходит историей в первую запись после
+# start() и в ключевые кадры потока; дальше снимок несёт только новые события
+EVENTS_WINDOW = 32
+
+
+def encode_payload(payload):
+    """
+    Компактный JSON (без отступов) в байтах — одна кодировка на файл и push
+    """
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def write_atomic(path, data, fsync=False, retries=5):
+    """
+    Пишет во временный файл рядом с path и подменяет его через os.replace,
+    так что читатель видит либо старое, либо новое содержимое целиком
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".battle_state.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        for attempt in range(retries):
+            try:
+                os.replace(tmp_path, path)
+                break
+            except PermissionError:
+                # Windows не даёт подменить файл, открытый читателем
+                if attempt == retries - 1:
+                    raise
+                time.sleep(0.005)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 class BattleStateExporter:
-    def __init__(self, battle_engine, interval=0.2):
+    """
+    mode="snapshot" — полный battle_state.json на каждое изменение,
+    mode="stream" — battle_state.jsonl: ключевой кадр + поток патчей.
+
+    export_dir=None отключает запись на диск, push_port включает
+    SSE-рассылку тех же данных экранам игроков.
+
+    fsync: "never" — полагаться на кэш ОС, "always" — на каждую запись,
+    "periodic" — не чаще раза в fsync_interval секунд.
+    max_stream_bytes ограничивает размер battle_state.jsonl: при превышении
+    поток начинается заново с ключевого кадра.
+    """
+
+    def __init__(self, battle_engine, coalesce=0.03, mode="snapshot", keyframe_every=200,
+                 export_dir=EXPORT_DIR, push_port=None, push_host=DEFAULT_HOST,
+                 fsync="never", fsync_interval=1.0, max_stream_bytes=4 * 1024 * 1024):
+        if mode not in ("snapshot", "stream"):
+            raise ValueError(f"Неизвестный режим экспорта: {mode}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Неизвестная политика fsync: {fsync}")
         self.engine = battle_engine
-        self.interval = interval
+        # окно, в которое склеиваются пачки изменений (урон по группе и т.п.)
+        self.coalesce = coalesce
+        self.mode = mode
+        self.keyframe_every = keyframe_every
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_stream_bytes = max_stream_bytes
+
+        self._last_fsync = 0.0
+        self._stream_size = 0
+
+        # кэш сериализации: id участника -> (version, entry, закодированный фрагмент)
+        self._cache = {}
 
         self._running = False
         self._thread = None
 
-        self._prev_payload = None
-
-        os.makedirs(EXPORT_DIR, exist_ok=True)
+        self._changed = threading.Event()
+        self._exported_version = None
+        # seq последнего выгруженного события журнала боя
+        self._exported_event_seq = None
+
+        # состояние потока патчей
+        self._seq = 0
+        self._patches_since_keyframe = 0
+        self._stream_prev = None
+
+        self.export_dir = export_dir
+        self.export_file = None
+        self.stream_file = None
+        if export_dir is not None:
+            os.makedirs(export_dir, exist_ok=True)
+            self.export_file = os.path.join(export_dir, EXPORT_FILE_NAME)
+            self.stream_file = os.path.join(export_dir, STREAM_FILE_NAME)
+
+        self.push_server = None
+        # почему не запустился SSE-сервер; экспорт в файлы при этом работает
+        self.push_error = None
+        # последняя ошибка записи файлов экспорта, None — запись идёт
+        self.write_error = None
+        if push_port is not None:
+            self.push_server = PushServer(push_host, push_port)
 
     # =========================
     # lifecycle
@@ -31,118 +140,320 @@ class BattleStateExporter:
         if self._running:
             return
         self._running = True
+        self._exported_version = None
+        self._exported_event_seq = None
+        if self.push_server is not None:
+            self.push_error = None if self.push_server.start() else self.push_server.error
+        self.engine.subscribe(self.notify)
+        self._changed.set()
         self._thread = threading.Thread(target=self._loop, daemon=True)
         self._thread.start()
 
     def stop(self):
         self._running = False
-        self._write_empty()
+        self.engine.unsubscribe(self.notify)
+        self._changed.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self._thread = None
+        try:
+            if self.mode == "stream":
+                self._emit_stream(EMPTY_PAYLOAD, {})
+            else:
+                self._write_empty()
+        except OSError as e:
+            self.write_error = e
+            self._stream_prev = None
+        # сервер не гасим: экраны игроков остаются подключены до следующего боя
+
+    def shutdown(self):
+        self.stop()
+        if self.push_server is not None:
+            self.push_server.stop()
+
+    def notify(self, version=None):
+        """
+        Вызывается движком при изменении состояния (из потока UI)
+        """
+        self._changed.set()
 
     def _loop(self):
         while self._running:
+            self._changed.wait()
+            if not self._running:
+                break
+            if self.coalesce:
+                time.sleep(self.coalesce)
+            self._changed.clear()
             self._tick()
-            time.sleep(self.interval)
+            if self.write_error is not None and self._running:
+                # повторяем, даже если бой больше не меняется
+                time.sleep(WRITE_RETRY_DELAY)
+                self._changed.set()
 
     # =========================
     # main tick
     # =========================
 
     def _tick(self):
-        if not self.engine.in_combat:
-            self._write_empty()
-            self._prev_payload = None
+        # поток экспорта читает только неизменяемый снимок движка
+        snapshot = self.engine.snapshot
+        # защита от лишних перезаписей
+        if snapshot.version == self._exported_version:
+            return
+        self._exported_version = snapshot.version
+        exported_event_seq = self._exported_event_seq
+        try:
+            self._export(snapshot)
+        except OSError as e:
+            # Windows не даёт подменить файл, пока его читает экран игрока;
+            # следующая попытка пишет снимок целиком (в потоке — ключевой кадр)
+            self.write_error = e
+            self._exported_version = None
+            self._exported_event_seq = exported_event_seq
+            self._stream_prev = None
+            return
+        self.write_error = None
+
+    def _export(self, snapshot):
+        if not snapshot.in_combat:
+            if self.mode == "stream":
+                self._emit_stream(EMPTY_PAYLOAD, {})
+            else:
+                self._write_empty()
             return
 
-        combatants = self._build_combatants()
-        active_ids = self._get_active_group_ids()
+        rows = self._collect_rows(snapshot)
+        active_ids = self._get_active_group_ids(snapshot)
 
         payload = {
             "running": True,
+            "version": snapshot.version,
             "timestamp": time.time(),
-            "round": self.engine.round,
+            "round": snapshot.round,
             "active_ids": active_ids,
-            "combatants": combatants
+            "events": self._export_events(snapshot),
         }
-
-        # защита от лишних перезаписей
-        if payload != self._prev_payload:
-            self._write(payload)
-            self._prev_payload = deepcopy(payload)
+        if payload["events"]:
+            # начало окна: по нему игрок видит, что события до него потеряны
+            payload["events_from"] = payload["events"][0]["seq"]
+        elif self._exported_event_seq is not None:
+            # новых событий нет — следующее ожидаемое, чтобы пропуск было видно
+            payload["events_from"] = self._exported_event_seq + 1
+
+        if self.mode == "stream":
+            payload["combatants"] = [entry for _, entry, _ in rows]
+            self._emit_stream(payload, {entry["id"]: version for version, entry, _ in rows})
+        else:
+            # payload без участников + готовые фрагменты; encode_payload даёт те же байты
+            head = encode_payload(payload)[:-1]
+            fragments = b",".join(fragment for _, _, fragment in rows)
+            self._write_encoded(head + b',"combatants":[' + fragments + b"]}")
 
     # =========================
-    # builders
+    # patch stream
     # =========================
 
-    def _build_combatants(self):
-        result = []
-
-        for c in self.engine.combatants:
-            kind = "combatant"
-            if isinstance(c, Player):
-                kind = "player"
-            elif isinstance(c, Monster):
-                kind = "monster"
-            entry = {
-                "id": self._combatant_id(c),
-                "name": c.custom_name or c.name,
-                "display_name": self._display_name(c),
-                "kind": kind,
-                "hp": c.hp,
-                "max_hp": c.max_hp,
-                "temp_hp": c.temp_hp,
-                "state": c.state,
-                "effects": {
-                    "temp_hp": c.hp is not None and c.temp_hp > 0,
-                    "concentration": bool(c.concentration),
-                    "dead": c.state == "dead",
-                    "unconscious": c.state == "unconscious",
-                    "incapacitated": c.incapacitated,
-                },
-                "custom_effects": self._export_custom_effects(c),
-            }
+    def _emit_stream(self, payload, versions):
+        """
+        Пишет ключевой кадр при старте/остановке боя и раз в keyframe_every
+        патчей, в остальное время — только изменившиеся поля участников.
+        versions: id -> Combatant.version, по ним ищутся изменившиеся записи
+        """
+        prev = self._stream_prev
+        entries = {c["id"]: c for c in payload["combatants"]}
+        order = list(entries)
+
+        if (
+            prev is None
+            or prev["running"] != payload["running"]
+            or self._patches_since_keyframe >= self.keyframe_every
+            or self._stream_size >= self.max_stream_bytes
+        ):
+            self._seq += 1
+            self._patches_since_keyframe = 0
+            self._write_stream({"seq": self._seq, "type": "keyframe", "state": payload}, truncate=True)
+        else:
+            patch = self._build_patch(prev, payload, entries, versions, order)
+            if patch is None:
+                return
+            self._seq += 1
+            self._patches_since_keyframe += 1
+            patch["seq"] = self._seq
+            self._write_stream(patch)
+
+        self._stream_prev = {
+            "running": payload["running"],
+            "round": payload.get("round"),
+            "active_ids": payload["active_ids"],
+            "event_seq": self._last_event_seq(payload, prev),
+            "entries": entries,
+            "versions": versions,
+            "order": order,
+        }
 
-            result.append(entry)
+    @staticmethod
+    def _build_patch(prev, payload, entries, versions, order):
+        patch = {"type": "patch"}
+        if payload.get("round") != prev["round"]:
+            patch["round"] = payload.get("round")
+        if payload["active_ids"] != prev["active_ids"]:
+            patch["active_ids"] = payload["active_ids"]
+        events = [e for e in payload.get("events", ()) if e["seq"] > prev["event_seq"]]
+        if events:
+            patch["events"] = events
+            patch["events_from"] = payload["events_from"]
+
+        prev_entries = prev["entries"]
+        prev_versions = prev["versions"]
+        changed = {}
+        added = []
+        for combatant_id, entry in entries.items():
+            old = prev_entries.get(combatant_id)
+            if old is None:
+                added.append(entry)
+            elif prev_versions.get(combatant_id) != versions[combatant_id]:
+                changed[combatant_id] = {
+                    key: value for key, value in entry.items() if old.get(key) != value
+                }
+        removed = [combatant_id for combatant_id in prev_entries if combatant_id not in entries]
+
+        if changed:
+            patch["changed"] = changed
+        if added:
+            patch["added"] = added
+        if removed:
+            patch["removed"] = removed
+        if order != prev["order"]:
+            patch["order"] = order
+
+        if len(patch) == 1:
+            return None
+        return patch
 
-        return result
+    # =========================
+    # builders
+    # =========================
+
+    def _collect_rows(self, snapshot):
+        """
+        (version, entry, fragment) для каждого участника. Заново
+        сериализуются только те, чья версия изменилась с прошлого тика
+        """
+        cache = self._cache
+        rows = []
+        for c in snapshot.combatants:
+            cached = cache.get(c.id)
+            if cached is None or cached[0] != c.version:
+                entry = self._build_entry(c)
+                cached = (c.version, entry, encode_payload(entry))
+                cache[c.id] = cached
+            rows.append(cached)
+
+        if len(cache) > len(rows):
+            alive_ids = snapshot.by_id
+            for combatant_id in [key for key in cache if key not in alive_ids]:
+                del cache[combatant_id]
+        return rows
+
+    def _build_entry(self, c):
+        return {
+            "id": self._combatant_id(c),
+            "name": c.custom_name or c.name,
+            "display_name": self._display_name(c),
+            "kind": c.kind,
+            "hp": c.hp,
+            "max_hp": c.max_hp,
+            "temp_hp": c.temp_hp,
+            "state": c.state,
+            "effects": {
+                "temp_hp": c.hp is not None and c.temp_hp > 0,
+                "concentration": bool(c.concentration),
+                "dead": c.state == "dead",
+                "unconscious": c.state == "unconscious",
+                "incapacitated": c.incapacitated,
+            },
+            "custom_effects": self._export_custom_effects(c),
+        }
 
     def _display_name(self, combatant):
         name = combatant.custom_name or combatant.name
-        if isinstance(combatant, Monster):
+        if combatant.kind == "monster":
             cleaned = re.sub(r"\s*\d+$", "", name).strip()
             return cleaned if cleaned else name
         return name
 
     def _export_custom_effects(self, combatant):
-        effects = combatant.effects.get("custom_effects", {})
         exported = {}
 
-        for name, data in effects.items():
+        for name, duration in combatant.custom_effects:
             exported[name] = {
-                "duration": data["duration"]
+                "duration": duration
             }
 
         return exported
 
-    def _get_active_group_ids(self):
+    def _export_events(self, snapshot):
+        """
+        Хвост журнала событий движка: id участника в формате экспорта
+        и отображаемое имя, чтобы экран игроков писал лог без сравнения состояний
+        """
+        events = snapshot.events
+        start = len(events)
+        if self._exported_event_seq is None or self.mode == "stream":
+            # история; патчи потока сами отбирают события новее прошлой записи
+            start = max(0, start - EVENTS_WINDOW)
+        # всё, что ещё не выгружалось: пачка по большой орде может превысить окно
+        if self._exported_event_seq is not None:
+            while start > 0 and events[start - 1]["seq"] > self._exported_event_seq:
+                start -= 1
+        if events:
+            self._exported_event_seq = events[-1]["seq"]
+
+        exported = []
+        for event in events[start:]:
+            entry = {"seq": event["seq"], "type": event["type"]}
+            combatant_id = event["combatant"]
+            if combatant_id is not None:
+                entry["id"] = f"id_{combatant_id}"
+                combatant = snapshot.by_id.get(combatant_id)
+                entry["name"] = self._display_name(combatant) if combatant is not None else None
+            for key, value in event.items():
+                if key in ("seq", "type", "combatant"):
+                    continue
+                if key == "ids":
+                    value = [f"id_{i}" for i in value]
+                entry[key] = value
+            exported.append(entry)
+        return exported
+
+    @staticmethod
+    def _last_event_seq(payload, prev):
+        events = payload.get("events")
+        if events:
+            return events[-1]["seq"]
+        return prev["event_seq"] if prev is not None else 0
+
+    def _get_active_group_ids(self, snapshot):
         """
         Возвращает список id всех участников текущей инициативной группы
         """
-        if not self.engine.in_combat:
+        if not snapshot.in_combat:
             return []
 
-        idx = self.engine.current_index - 1
+        idx = snapshot.current_index - 1
         if idx < 0:
-            idx = len(self.engine.combatant_groups) - 1
+            idx = len(snapshot.groups) - 1
 
-        if idx < 0 or idx >= len(self.engine.combatant_groups):
+        if idx < 0 or idx >= len(snapshot.groups):
             return []
 
-        group = self.engine.combatant_groups[idx]
+        group = snapshot.groups[idx]
 
         return [
-            self._combatant_id(c)
-            for c in group
-            if not c.incapacitated
+            self._combatant_id(snapshot.by_id[combatant_id])
+            for combatant_id in group
+            if combatant_id in snapshot.by_id and not snapshot.by_id[combatant_id].incapacitated
         ]
 
     # =========================
@@ -150,21 +461,42 @@ class BattleStateExporter:
     # =========================
 
     def _combatant_id(self, combatant):
-        return f"id_{id(combatant)}"
+        return f"id_{combatant.id}"
+
+    def _should_fsync(self):
+        if self.fsync == "always":
+            return True
+        if self.fsync == "periodic":
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                self._last_fsync = now
+                return True
+        return False
 
     def _write(self, payload):
-        with open(EXPORT_FILE, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
+        self._write_encoded(encode_payload(payload))
+
+    def _write_encoded(self, data):
+        if self.export_file is not None:
+            write_atomic(self.export_file, data, fsync=self._should_fsync())
+        if self.push_server is not None:
+            self.push_server.publish("state", data, reset=True)
 
     def _write_empty(self):
-        with open(EXPORT_FILE, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "running": False,
-                    "combatants": [],
-                    "active_ids": []
-                },
-                f,
-                ensure_ascii=False,
-                indent=2
-            )
+        self._write(EMPTY_PAYLOAD)
+
+    def _write_stream(self, record, truncate=False):
+        line = encode_payload(record) + b"\n"
+        if self.stream_file is not None:
+            if truncate:
+                write_atomic(self.stream_file, line, fsync=self._should_fsync())
+                self._stream_size = len(line)
+            else:
+                with open(self.stream_file, "ab") as f:
+                    f.write(line)
+                    if self._should_fsync():
+                        f.flush()
+                        os.fsync(f.fileno())
+                self._stream_size += len(line)
+        if self.push_server is not None:
+            self.push_server.publish(record["type"], line[:-1], event_id=record["seq"], reset=truncate)
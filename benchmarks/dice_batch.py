@@ -0,0 +1,49 @@
+"""
+Пакетные броски: 10 000 бросков 18d10+36 (хиты Аболета из бестиария).
+
+Сравнивает цикл roll_formula, roll_many на чистом Python и roll_many
+через NumPy (если установлен). Запуск из корня репозитория:
+    python -m benchmarks.dice_batch [--rolls 10000] [--formula 18d10+36]
+"""
+import argparse
+import statistics
+import time
+
+import dice_roll
+from dice_roll import roll_formula, roll_many
+
+
+def best_of(callback, repeat=5):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = callback()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rolls", type=int, default=10_000)
+    parser.add_argument("--formula", default="18d10+36")
+    args = parser.parse_args()
+
+    variants = [
+        ("roll_formula в цикле", lambda: [roll_formula(args.formula) for _ in range(args.rolls)]),
+        ("roll_many, Python", lambda: roll_many(args.formula, args.rolls, use_numpy=False)),
+    ]
+    if dice_roll.np is not None:
+        variants.append(("roll_many, NumPy", lambda: roll_many(args.formula, args.rolls, use_numpy=True)))
+
+    print(f"{args.rolls} x {args.formula}")
+    print(f"{'вариант':<22} {'мс':>9} {'бросков/с':>12} {'среднее':>9}")
+    for label, callback in variants:
+        rolls, ms = best_of(callback)
+        print(f"{label:<22} {ms:>9.2f} {args.rolls / ms * 1000:>12.0f} {statistics.mean(rolls):>9.2f}")
+    if dice_roll.np is None:
+        print("NumPy не установлен — векторный путь не измерен")
+
+
+if __name__ == "__main__":
+    main()
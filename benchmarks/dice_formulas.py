@@ -0,0 +1,77 @@
+"""
+roll_formula: вызовов в секунду до и после разбора формул в RollPlan.
+
+«До» — прежняя реализация: regex и форматирование строки на каждый вызов.
+Запуск из корня репозитория:
+    python -m benchmarks.dice_formulas [--seconds 0.5]
+"""
+import argparse
+import random
+import re
+import time
+
+from dice_roll import compile_formula, roll_formula
+
+FORMULAS = ("2d8", "135 (18d10 + 36)", "1d6+{mod}", "2d6+1d4+3", "4d6kh3", "1d20adv")
+
+
+def legacy_roll_formula(formula: str, **vars) -> int:
+    for var in re.findall(r"\{(\w+)}", formula):
+        if var not in vars:
+            vars[var] = 0
+    formula = formula.format(**vars)
+
+    formula = formula.lower().replace("д", "d").replace("к", "d").replace(" ", "")
+
+    match = re.search(r"\(([^)]+)\)", formula)
+    if match:
+        formula = match.group(1)
+
+    dice_pattern = re.fullmatch(r'(\d+)[d](\d+)([+-]\d+)?', formula)
+    if dice_pattern:
+        n, sides, modifier = dice_pattern.groups()
+        total = sum(random.randint(1, int(sides)) for _ in range(int(n)))
+        if modifier:
+            total += int(modifier)
+        return total
+
+    try:
+        return int(formula)
+    except ValueError:
+        raise ValueError(f"Неверный формат броска: {formula}")
+
+
+def calls_per_second(callback, seconds):
+    calls = 0
+    batch = 1000
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            callback()
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"{'формула':<20} {'до, выз/с':>12} {'после, выз/с':>13} {'ускорение':>10}")
+    for formula in FORMULAS:
+        compile_formula(formula)
+        after = calls_per_second(lambda: roll_formula(formula, mod=3), args.seconds)
+        try:
+            legacy_roll_formula(formula, mod=3)
+        except ValueError:
+            # прежняя грамматика знала только NdM±K
+            print(f"{formula:<20} {'не поддерж.':>12} {after:>13.0f} {'-':>10}")
+            continue
+        before = calls_per_second(lambda: legacy_roll_formula(formula, mod=3), args.seconds)
+        print(f"{formula:<20} {before:>12.0f} {after:>13.0f} {after / before:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Файл встречи: размер и время загрузки подготовленного боя.
+
+Сравнивает бинарный формат encounter_file с JSON-записями участников
+(как в журнале сессии) и с пересозданием монстров через CombatantFactory.
+Перед замером проверяет, что сохранение и загрузка дают тот же бой.
+Запуск из корня репозитория:
+    python -m benchmarks.encounter_load [--size 500]
+"""
+import argparse
+import json
+import random
+import time
+
+import encounter_file
+from battle_engine import BattleEngine
+from combatant_factory import CombatantFactory, bestiary_data
+from rng_service import RngService
+from session_journal import build_combatant, combatant_record
+
+
+def build_engine(size):
+    rng = random.Random(1)
+    factory = CombatantFactory(RngService(1))
+    engine = BattleEngine()
+    types = sorted(bestiary_data)[:25]
+    with engine.batch():
+        for i in range(size // 10):
+            engine.add_combatant(factory.create_player(f"Игрок {i}"))
+        while len(engine.combatants) < size:
+            monster_type = rng.choice(types)
+            for monster in factory.create_monster(monster_type, count=min(5, size - len(engine.combatants))):
+                engine.add_combatant(monster)
+                if rng.random() < 0.3:
+                    engine.add_effect(monster, "Благословение", rng.randint(1, 10))
+    engine.start_combat()
+    for _ in range(size // 20):
+        engine.next_turn()
+    return engine
+
+
+def fingerprint(engine):
+    *position, prev_group, current_group = engine.turn_state()
+    return (
+        position, current_group,
+        [engine.combatants.index(c) for c in prev_group or ()],
+        [
+            (type(c).__name__, c.name, c.custom_name, c.max_hp, c.ac, getattr(c, "traits", None),
+             engine.memento(c)[:6] + engine.memento(c)[7:])
+            for c in engine.combatants
+        ],
+    )
+
+
+def best_of(callback, repeat=7):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        callback()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=500)
+    args = parser.parse_args()
+
+    engine = build_engine(args.size)
+    data = encounter_file.dumps(engine)
+    loaded = encounter_file.loads(data, bestiary=bestiary_data)
+    # полные проверки формата — tests/test_encounter_file.py
+    if fingerprint(loaded) != fingerprint(engine):
+        raise SystemExit("загрузка не совпала с сохранённым боем")
+    if encounter_file.dumps(loaded) != data:
+        raise SystemExit("повторное сохранение дало другие байты")
+
+    records = [combatant_record(c, engine.memento(c)) for c in engine.combatants]
+    json_data = json.dumps(records, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def load_json():
+        joined = [build_combatant(record, bestiary_data) for record in json.loads(json_data)]
+        BattleEngine().load_state(joined=joined)
+
+    types = [c.monster_type for c in engine.combatants if hasattr(c, "monster_type")]
+
+    def recreate():
+        factory = CombatantFactory()
+        fresh = BattleEngine()
+        with fresh.batch():
+            for monster_type in types:
+                for monster in factory.create_monster(monster_type):
+                    fresh.add_combatant(monster)
+
+    binary_parse_ms = best_of(lambda: encounter_file._parse(data))
+    json_parse_ms = best_of(lambda: json.loads(json_data))
+    binary_ms = best_of(lambda: encounter_file.loads(data, bestiary=bestiary_data))
+    json_ms = best_of(load_json)
+    recreate_ms = best_of(recreate)
+
+    print(f"участников: {len(engine.combatants)}")
+    print(f"{'вариант':<28} {'байт':>9} {'разбор мс':>10} {'загрузка мс':>12}")
+    print(f"{'encounter_file (zlib)':<28} {len(data):>9} {binary_parse_ms:>10.2f} {binary_ms:>12.2f}")
+    print(f"{'JSON-записи участников':<28} {len(json_data):>9} {json_parse_ms:>10.2f} {json_ms:>12.2f}")
+    print(f"{'create_monster заново':<28} {'-':>9} {'-':>10} {recreate_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
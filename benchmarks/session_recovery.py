@@ -0,0 +1,84 @@
+"""
+Журнал сессии: задержка действия мастера и время восстановления после сбоя.
+
+Задержка — время действия в потоке UI с журналом и без; восстановление —
+последний снимок плюс хвост журнала после 1000 действий (цель < 100 мс).
+Запуск из корня репозитория:
+    python -m benchmarks.session_recovery [--actions 1000] [--size 100]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.undo_memory import build_engine, play
+from session_journal import (
+    JOURNAL_FILE_NAME, SNAPSHOT_FILE_NAME, SessionJournal, read_session, recover,
+)
+
+
+def action_latencies(engine, actions):
+    latencies = []
+    last = [time.perf_counter()]
+
+    def on_action():
+        now = time.perf_counter()
+        latencies.append(now - last[0])
+        last[0] = now
+
+    play(engine, actions, random.Random(1), on_action)
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--actions", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--snapshot-every", type=int, default=200)
+    args = parser.parse_args()
+
+    plain = action_latencies(build_engine(args.size), args.actions)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = build_engine(args.size)
+        journal = SessionJournal(engine, directory, snapshot_every=args.snapshot_every)
+        journal.start()
+        journaled = action_latencies(engine, args.actions)
+        journal.stop()
+        snapshot_bytes = os.path.getsize(os.path.join(directory, SNAPSHOT_FILE_NAME))
+        journal_bytes = os.path.getsize(os.path.join(directory, JOURNAL_FILE_NAME))
+
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            recovered = recover(directory, bestiary={})
+            timings.append(time.perf_counter() - start)
+        assert recovered is not None and read_session(directory)[2] == journal.seq
+        assert [engine.memento(c) for c in engine.combatants] == \
+               [recovered.memento(c) for c in recovered.combatants]
+
+        # худший случай: снимок только стартовый, весь бой — в хвосте журнала
+        engine = build_engine(args.size)
+        journal = SessionJournal(engine, directory, snapshot_every=args.actions + 1)
+        journal.start()
+        play(engine, args.actions, random.Random(1))
+        journal.stop()
+        start = time.perf_counter()
+        recover(directory, bestiary={})
+        tail_ms = (time.perf_counter() - start) * 1000
+
+    def p(latencies, q):
+        return latencies[int(len(latencies) * q)] * 1000
+
+    print(f"участников: {args.size}, действий: {args.actions}, шагов в журнале: {journal.seq}")
+    print(f"действие без журнала: p50 {p(plain, 0.5):.3f} мс, p99 {p(plain, 0.99):.3f} мс")
+    print(f"действие с журналом:  p50 {p(journaled, 0.5):.3f} мс, p99 {p(journaled, 0.99):.3f} мс")
+    print(f"снимок: {snapshot_bytes / 1024:.1f} КиБ, хвост журнала: {journal_bytes / 1024:.1f} КиБ")
+    print(f"восстановление (снимок раз в {args.snapshot_every}): {min(timings) * 1000:.1f} мс")
+    print(f"восстановление (весь бой в хвосте): {tail_ms:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
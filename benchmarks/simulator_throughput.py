@@ -0,0 +1,44 @@
+"""
+Монте-Карло симулятор встреч: боёв в секунду на ядро при разном числе
+процессов пула. Итог одинаков при любом числе процессов — проверяется.
+Запуск из корня репозитория:
+    python -m benchmarks.simulator_throughput [--runs 2000] [--max-workers N]
+        [--party "Ветеран x2"] [--enemies "Огр x2"]
+"""
+import argparse
+import os
+import time
+
+from encounter_simulator import parse_side, simulate
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=2000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--party", default="Ветеран x2")
+    parser.add_argument("--enemies", default="Огр x2")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    party = parse_side(args.party)
+    enemies = parse_side(args.enemies)
+    print(f"{args.party} против {args.enemies}, {args.runs} боёв, ядер: {os.cpu_count()}")
+    print(f"{'процессов':>9} {'с':>8} {'боёв/с':>9} {'боёв/с на ядро':>15} {'победа':>8}")
+    reference = None
+    workers = 1
+    while workers <= args.max_workers:
+        start = time.perf_counter()
+        result = simulate(party, enemies, args.runs, args.seed, workers)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = result
+        assert result == reference, "итог зависит от числа процессов"
+        rate = args.runs / elapsed
+        cores = min(workers, os.cpu_count() or 1)
+        print(f"{workers:>9} {elapsed:>8.2f} {rate:>9.0f} {rate / cores:>15.0f} {result.win_rate:>8.1%}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
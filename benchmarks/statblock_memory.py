@@ -0,0 +1,100 @@
+"""
+Орда из 200 зомби: память и время создания монстров.
+
+«До» — прежний Monster: атрибуты в __dict__, поля блока характеристик
+копируются в каждый экземпляр из записи бестиария. «После» — __slots__
+и общий интернированный StatBlock на тип.
+Запуск из корня репозитория:
+    python -m benchmarks.statblock_memory [--count 200] [--type Зомби]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from combatant_factory import bestiary_data
+from combatants import Monster, StatBlock
+
+
+class LegacyMonster:
+    """
+    Monster до введения StatBlock (поля те же, что у Combatant + Monster)
+    """
+
+    def __init__(self, name, initiative=None, hp=0, ac=0, effects=None,
+                 monster_data=None, monster_type=None, custom_name=""):
+        self.version = 0
+        self._observer = None
+        self.id = None
+        self.name = name
+        self.custom_name = custom_name
+        self.max_hp = hp
+        self.hp = hp
+        self.temp_hp = 0
+        self.ac = ac
+        self.effects = effects if effects else {}
+        self.concentration = False
+        self.effects["incapacitated"] = False
+        self.initiative = initiative if initiative is not None else random.randint(1, 20)
+        self.state = "alive"
+        self.turns_ended = 0
+        self.monster_type = monster_type if monster_type else name
+        self.traits = monster_data.get("Traits", "") if monster_data else ""
+        self.actions = monster_data.get("Actions", "") if monster_data else ""
+        self.legendary_actions = monster_data.get("Legendary Actions", "") if monster_data else ""
+        self.immunities = monster_data.get("Damage Immunities", "") if monster_data else ""
+
+
+def legacy_horde(monster_type, count):
+    data = bestiary_data[monster_type]
+    return [
+        LegacyMonster(f"{monster_type} {i}", 10, 22, 8, monster_data=data, monster_type=monster_type)
+        for i in range(1, count + 1)
+    ]
+
+
+def flyweight_horde(monster_type, count):
+    stat_block = StatBlock.of(monster_type, bestiary_data[monster_type])
+    return [
+        Monster(f"{monster_type} {i}", 10, 22, 8, monster_type=monster_type, stat_block=stat_block)
+        for i in range(1, count + 1)
+    ]
+
+
+def measure(build, monster_type, count, repeat=20):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    horde = build(monster_type, count)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build(monster_type, count)
+        timings.append(time.perf_counter() - start)
+    return horde, size, min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--type", default="Зомби")
+    args = parser.parse_args()
+
+    legacy, legacy_bytes, legacy_ms = measure(legacy_horde, args.type, args.count)
+    horde, horde_bytes, horde_ms = measure(flyweight_horde, args.type, args.count)
+    assert all(m.stat_block is horde[0].stat_block for m in horde)
+    assert horde[0].traits == legacy[0].traits and horde[0].actions == legacy[0].actions
+
+    print(f"{args.type} x {args.count}")
+    print(f"{'вариант':<22} {'байт':>9} {'байт/монстр':>12} {'создание мс':>12}")
+    for label, size, ms in (
+        ("__dict__ + копии", legacy_bytes, legacy_ms),
+        ("__slots__ + StatBlock", horde_bytes, horde_ms),
+    ):
+        print(f"{label:<22} {size:>9} {size / args.count:>12.0f} {ms:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
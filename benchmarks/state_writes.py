@@ -0,0 +1,105 @@
+"""
+Запись battle_state на каждый тик: байты и задержка.
+
+Запуск из корня репозитория:
+    python -m benchmarks.state_writes [--ticks 200]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from battle_engine import BattleEngine
+from battle_state_exporter import BattleStateExporter
+from combatants import Monster, Player
+
+SIZES = (10, 100, 1000)
+
+
+def build_engine(size):
+    engine = BattleEngine()
+    for i in range(size):
+        if i % 10 == 0:
+            combatant = Player(f"Игрок {i}", initiative=i % 20 + 1)
+        else:
+            combatant = Monster(f"Гоблин {i}", initiative=i % 20 + 1, hp=7, ac=15)
+            if i % 3 == 0:
+                engine.add_effect(combatant, "Благословение", 10)
+        engine.add_combatant(combatant)
+    engine.start_combat()
+    return engine
+
+
+class LegacyExporter(BattleStateExporter):
+    """
+    Старый путь: все участники сериализуются заново на каждом тике,
+    json.dump(indent=2) поверх файла на месте. События — те же, что в новом
+    снимке, чтобы сравнивались одинаковые данные
+    """
+
+    def _tick(self):
+        snapshot = self.engine.snapshot
+        payload = {
+            "running": True,
+            "timestamp": time.time(),
+            "round": snapshot.round,
+            "active_ids": self._get_active_group_ids(snapshot),
+            "events": self._export_events(snapshot),
+            "combatants": [self._build_entry(c) for c in snapshot.combatants],
+        }
+        with open(self.export_file, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+def run(exporter_cls, size, ticks, directory, **kwargs):
+    engine = build_engine(size)
+    exporter = exporter_cls(engine, export_dir=directory, **kwargs)
+    exporter._tick()
+    targets = [c for c in engine.combatants if c.hp is not None]
+
+    stream = exporter.mode == "stream"
+    path = exporter.stream_file if stream else exporter.export_file
+    latencies = []
+    written = 0
+    for tick in range(ticks):
+        targets[tick % len(targets)].take_damage(1)
+        before = os.path.getsize(path)
+        start = time.perf_counter()
+        exporter._tick()
+        latencies.append(time.perf_counter() - start)
+        after = os.path.getsize(path)
+        # поток дописывается, при ключевом кадре файл пишется заново
+        written += after - before if stream and after >= before else after
+    latencies.sort()
+    return {
+        "bytes_per_tick": written / ticks,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticks", type=int, default=200)
+    args = parser.parse_args()
+
+    variants = [
+        ("indent=2, на месте", LegacyExporter, {}),
+        ("компактно, atomic", BattleStateExporter, {}),
+        ("компактно, atomic, fsync", BattleStateExporter, {"fsync": "always"}),
+        ("поток патчей", BattleStateExporter, {"mode": "stream"}),
+    ]
+    print(f"{'участников':>10}  {'вариант':<26} {'байт/тик':>10} {'p50 мс':>8} {'p95 мс':>8}")
+    for size in SIZES:
+        for label, cls, kwargs in variants:
+            with tempfile.TemporaryDirectory() as directory:
+                result = run(cls, size, args.ticks, directory, **kwargs)
+            print(
+                f"{size:>10}  {label:<26} {result['bytes_per_tick']:>10.0f} "
+                f"{result['p50_ms']:>8.3f} {result['p95_ms']:>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
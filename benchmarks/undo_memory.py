@@ -0,0 +1,111 @@
+"""
+Память истории отмены на 1000 действий мастера.
+
+Сравнивает мементо-историю движка с наивной отменой через deepcopy
+всего боя на каждое действие. Запуск из корня репозитория:
+    python -m benchmarks.undo_memory [--actions 1000] [--size 100]
+"""
+import argparse
+import copy
+import random
+import time
+import tracemalloc
+
+from battle_engine import BattleEngine
+from combatants import Monster, Player
+
+
+def build_engine(size, history_limit=None):
+    engine = BattleEngine(history_limit=history_limit)
+    for i in range(size):
+        if i % 10 == 0:
+            engine.add_combatant(Player(f"Игрок {i}", initiative=i % 20 + 1))
+        else:
+            engine.add_combatant(Monster(f"Гоблин {i}", initiative=i % 20 + 1, hp=30, ac=15))
+    engine.start_combat()
+    engine.history.clear()
+    return engine
+
+
+def combatant_states(engine):
+    # данные участников без ссылки на движок (_observer)
+    return [
+        {
+            key: getattr(c, key)
+            for cls in type(c).__mro__ for key in getattr(cls, "__slots__", ())
+            if key != "_observer"
+        }
+        for c in engine.combatants
+    ]
+
+
+def play(engine, actions, rng, on_action=None):
+    monsters = [c for c in engine.combatants if isinstance(c, Monster)]
+    for _ in range(actions):
+        roll = rng.random()
+        if roll < 0.4:
+            rng.choice(monsters).take_damage(rng.randint(1, 4))
+        elif roll < 0.5:
+            targets = rng.sample(monsters, min(10, len(monsters)))
+            engine.apply_damage(targets, rng.randint(2, 8), halved=targets[::2])
+        elif roll < 0.65:
+            engine.add_effect(rng.choice(monsters), "Благословение", rng.randint(1, 10))
+        elif roll < 0.75:
+            rng.choice(monsters).heal(2)
+        else:
+            engine.next_turn()
+        if on_action is not None:
+            on_action()
+
+
+def measure(callback):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = callback()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--actions", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=100)
+    args = parser.parse_args()
+
+    engine = build_engine(args.size)
+
+    def with_history():
+        play(engine, args.actions, random.Random(1))
+        return len(engine.history)
+
+    history_bytes, steps = measure(with_history)
+
+    start = time.perf_counter()
+    while engine.undo():
+        pass
+    undo_ms = (time.perf_counter() - start) * 1000
+
+    # deepcopy дорогой — меряем на части действий и пересчитываем на 1000
+    naive_actions = min(args.actions, 100)
+    naive_engine = build_engine(args.size)
+    naive_engine.history = type(naive_engine.history)(0)
+    snapshots = []
+
+    def with_deepcopy():
+        play(naive_engine, naive_actions, random.Random(1),
+             lambda: snapshots.append(copy.deepcopy(combatant_states(naive_engine))))
+        return len(snapshots)
+
+    naive_bytes, _ = measure(with_deepcopy)
+
+    per_1000 = history_bytes * 1000 / args.actions
+    naive_per_1000 = naive_bytes * 1000 / naive_actions
+    print(f"участников: {args.size}, действий: {args.actions}, шагов в истории: {steps}")
+    print(f"мементо-история: {per_1000 / 1024:>10.1f} КиБ на 1000 действий")
+    print(f"deepcopy боя:    {naive_per_1000 / 1024:>10.1f} КиБ на 1000 действий")
+    print(f"отмена всех шагов: {undo_ms:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
 import json
-import random
-from combatants import Monster, Player
-from dice_roll import roll_formula
+from combatants import Combatant, Monster, Player, StatBlock
+from dice_roll import roll_many
+from rng_service import HP, INITIATIVE, default_service
 
 with open("srd_5e_monsters_ru.json", "r", encoding="utf-8") as f:
     raw_data = json.load(f)
 
 bestiary_data = {monster["name"]: monster for monster in raw_data}
 class CombatantFactory:
-    next_id = 1
+    def __init__(self, rng=None):
+        # RngService; None — общий сервис процесса
+        self.rng = rng
+
+    def _stream(self, name):
+        return (self.rng or default_service()).stream(name)
 
     @classmethod
     def _assign_id(cls, obj):
-        obj.id = cls.next_id
-        cls.next_id += 1
+        obj.id = Combatant.allocate_id()
 
     def create_player(
         self,
@@ -23,7 +27,7 @@ class CombatantFactory:
         players = []
         player = Player(
             name=name,
-            initiative=initiative if initiative is not None else random.randint(1, 20)
+            initiative=initiative if initiative is not None else self._stream(INITIATIVE).randint(1, 20)
         )
         self._assign_id(player)
         players.append(player)
@@ -39,17 +43,21 @@ class CombatantFactory:
         hp_input: str | None = None
     ):
         data = bestiary_data.get(name)
+        # один общий блок характеристик на всю группу
+        stat_block = StatBlock.of(name, data)
         monsters = []
 
-        group_initiative = initiative if initiative is not None else random.randint(1, 20)
+        group_initiative = initiative if initiative is not None else self._stream(INITIATIVE).randint(1, 20)
         display_name = custom_name.strip() if custom_name else name
+        # хиты всей группы — одним пакетным броском
+        hp_str = (stat_block.hit_points or "1d10") if data else "1d10"
+        hp_values = roll_many(hp_input or hp_str, count, rng=self._stream(HP))
 
         for i in range(1, count + 1):
+            hp_val = hp_values[i - 1]
             if data:
-                hp_str = data.get("Hit Points", "1d10")
-                hp_val = roll_formula(hp_input) if hp_input else roll_formula(hp_str)
                 ac_val = ac if ac is not None else 10
-                ac_str = data.get("Armor Class", "")
+                ac_str = stat_block.armor_class
                 if ac_str:
                     try:
                         ac_val = int(ac_str.split()[0])
@@ -64,11 +72,10 @@ class CombatantFactory:
                     hp=hp_val,
                     ac=ac_val,
                     initiative=group_initiative,
-                    monster_data=data,
-                    monster_type=name
+                    monster_type=name,
+                    stat_block=stat_block
                 )
             else:
-                hp_val = roll_formula(hp_input) if hp_input else roll_formula("1d10")
                 ac_val = ac if ac is not None else 10
 
                 monster = Monster(
@@ -76,7 +83,8 @@ class CombatantFactory:
                     hp=hp_val,
                     ac=ac_val,
                     initiative=group_initiative,
-                    monster_type=name
+                    monster_type=name,
+                    stat_block=stat_block
                 )
             self._assign_id(monster)
             monsters.append(monster)
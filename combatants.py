@@ -1,7 +1,53 @@
-import random
+import time
+from typing import NamedTuple
+
+import rng_service
+
+
+class StatBlock(NamedTuple):
+    """
+    Неизменяемый блок характеристик типа монстра из бестиария.
+    Интернируется по содержимому: все монстры одного типа ссылаются
+    на один объект, а не держат копии полей записи бестиария
+    """
+    monster_type: str
+    armor_class: str
+    hit_points: str
+    traits: str
+    actions: str
+    legendary_actions: str
+    immunities: str
+
+    @classmethod
+    def of(cls, monster_type, data=None):
+        data = data or {}
+        block = cls(monster_type, *(data.get(key, "") for key in STAT_BLOCK_KEYS))
+        return _stat_blocks.setdefault(block, block)
+
+
+# ключи записи бестиария для полей StatBlock после monster_type
+STAT_BLOCK_KEYS = (
+    "Armor Class", "Hit Points", "Traits", "Actions", "Legendary Actions", "Damage Immunities",
+)
+
+_stat_blocks = {}
+
 
 class Combatant:
+    # id монотонны в пределах сессии и не пересекаются между сессиями:
+    # счётчик стартует с текущего времени в микросекундах
+    _next_id = time.time_ns() // 1000
+
+    __slots__ = (
+        "version", "_observer", "id", "name", "custom_name", "max_hp", "hp", "temp_hp",
+        "ac", "effects", "concentration", "initiative", "state", "turns_ended",
+    )
+
     def __init__(self, name, initiative=None, hp=0, ac=0, effects=None, custom_name=""):
+        # version растёт при каждой мутации, _observer — колбэк движка
+        self.version = 0
+        self._observer = None
+        self.id: int | None = None
         self.name = name
         self.custom_name = custom_name
         self.max_hp = hp
@@ -10,9 +56,27 @@ class Combatant:
         self.ac = ac
         self.effects = effects if effects else {}
         self.concentration = False
-        self.manually_disabled = False
-        self.initiative = initiative if initiative is not None else random.randint(1, 20)
+        self.effects.setdefault("incapacitated", False)
+        if initiative is None:
+            initiative = rng_service.stream(rng_service.INITIATIVE).randint(1, 20)
+        self.initiative = initiative
         self.state = "alive"
+        # сколько ходов группы участника завершилось — часы для длительности эффектов
+        self.turns_ended = 0
+
+    @staticmethod
+    def allocate_id():
+        value = Combatant._next_id
+        Combatant._next_id += 1
+        return value
+
+    @staticmethod
+    def reserve_id(value):
+        """
+        Для загрузки сохранённых участников: новые id будут больше value
+        """
+        if value is not None and value >= Combatant._next_id:
+            Combatant._next_id = value + 1
 
     @property
     def incapacitated(self):
@@ -27,16 +91,41 @@ class Combatant:
 
     @manually_disabled.setter
     def manually_disabled(self, value):
+        changed = self.effects.get("incapacitated", False) != bool(value)
         self.effects["incapacitated"] = bool(value)
+        if changed:
+            self._touch("incapacitated", value=bool(value))
+        else:
+            self._touch()
+
+    def _touch(self, event_type=None, **fields):
+        """
+        event_type/fields — событие для журнала боя (урон, лечение и т.п.)
+        """
+        self.version += 1
+        if self._observer is not None:
+            self._observer(self, (event_type, fields) if event_type else None)
+
+    def effect_duration(self, name):
+        """
+        Оставшаяся длительность эффекта в ходах, None — бессрочный
+        """
+        entry = self.effects["custom_effects"][name]
+        expires = entry.get("expires")
+        if expires is None:
+            return entry.get("duration")
+        return expires - self.turns_ended
 
     def has_concentration(self):
         return self.concentration
 
     def add_concentration(self):
         self.concentration = True
+        self._touch("concentration", value=True)
 
     def remove_concentration(self):
         self.concentration = False
+        self._touch("concentration", value=False)
 
     @property
     def is_alive(self):
@@ -47,29 +136,38 @@ class Combatant:
     def take_damage(self, amount):
         if self.state in ("dead", "left"):
             return
+        absorbed = 0
         if self.temp_hp > 0:
             if self.temp_hp >= amount:
                 self.temp_hp -= amount
+                absorbed = amount
                 amount = 0
             else:
+                absorbed = self.temp_hp
                 amount -= self.temp_hp
                 self.temp_hp = 0
 
+        dealt = 0
         if amount > 0:
+            dealt = min(amount, self.hp)
             self.hp -= amount
             if self.hp <= 0:
                 self.hp = 0
+        self._touch("damage", amount=dealt, absorbed=absorbed, hp=self.hp, temp_hp=self.temp_hp)
 
     def heal(self, amount):
         if self.state == "dead":
             return
+        old_hp = self.hp
         self.hp = min(self.hp + amount, self.max_hp)
+        self._touch("heal", amount=self.hp - old_hp, hp=self.hp)
 
     def add_temp_hp(self, amount):
         if self.state == "dead":
             return
         if amount > self.temp_hp:
             self.temp_hp = amount
+            self._touch("temp_hp", amount=amount, temp_hp=self.temp_hp)
 
     def __repr__(self):
         if self.hp is None:
@@ -79,6 +177,8 @@ class Combatant:
 
 
 class Player(Combatant):
+    __slots__ = ("saving_throws", "spells")
+
     def __init__(self, name, initiative=None, effects=None, custom_name=""):
         super().__init__(name, initiative, hp=1, ac=0, effects=effects, custom_name=custom_name)
         self.max_hp = None
@@ -87,7 +187,6 @@ class Player(Combatant):
         self.ac = None
         self.saving_throws = {}
         self.spells = []
-        self.id: int | None = None
 
     def take_damage(self, amount):
         return
@@ -100,12 +199,44 @@ class Player(Combatant):
 
 
 class Monster(Combatant):
+    # в экземпляре — только состояние боя, блок характеристик общий для типа
+    __slots__ = ("monster_type", "_stat_block", "_bestiary")
+
     def __init__(self, name, initiative=None, hp=0, ac=0, effects=None,
-                 monster_data=None, monster_type=None, custom_name=""):
+                 monster_data=None, monster_type=None, custom_name="", bestiary=None,
+                 stat_block=None):
+        """
+        stat_block — общий блок характеристик (StatBlock.of), monster_data —
+        запись бестиария для него; вместо них можно передать bestiary,
+        тогда запись найдётся по monster_type при первом обращении
+        к блоку характеристик (загрузка сохранённых встреч)
+        """
         super().__init__(name, initiative, hp, ac, effects, custom_name)
         self.monster_type = monster_type if monster_type else name
-        self.traits = monster_data.get("Traits", "") if monster_data else ""
-        self.actions = monster_data.get("Actions", "") if monster_data else ""
-        self.legendary_actions = monster_data.get("Legendary Actions", "") if monster_data else ""
-        self.immunities = monster_data.get("Damage Immunities", "") if monster_data else ""
-        self.id: int | None = None
+        if stat_block is None and (monster_data is not None or bestiary is None):
+            stat_block = StatBlock.of(self.monster_type, monster_data)
+        self._stat_block = stat_block
+        self._bestiary = bestiary if stat_block is None else None
+
+    @property
+    def stat_block(self):
+        if self._stat_block is None:
+            self._stat_block = StatBlock.of(self.monster_type, self._bestiary.get(self.monster_type))
+            self._bestiary = None
+        return self._stat_block
+
+    @property
+    def traits(self):
+        return self.stat_block.traits
+
+    @property
+    def actions(self):
+        return self.stat_block.actions
+
+    @property
+    def legendary_actions(self):
+        return self.stat_block.legendary_actions
+
+    @property
+    def immunities(self):
+        return self.stat_block.immunities
@@ -1,29 +1,517 @@
 import re
-import random
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate
+from math import comb
+from itertools import repeat
+from operator import add, sub
+from typing import NamedTuple
 
+import rng_service
 
-def roll_formula(formula: str, **vars) -> int:
-    # все переменные, которых нет — 0
-    for var in re.findall(r"\{(\w+)}", formula):
-        if var not in vars:
-            vars[var] = 0
-    formula = formula.format(**vars)
-
-    formula = formula.lower().replace("д", "d").replace("к", "d").replace(" ", "")
-
-    match = re.search(r"\(([^)]+)\)", formula)
-    if match:
-        formula = match.group(1)
-
-    dice_pattern = re.fullmatch(r'(\d+)[d](\d+)([+-]\d+)?', formula)
-    if dice_pattern:
-        n, sides, modifier = dice_pattern.groups()
-        total = sum(random.randint(1, int(sides)) for _ in range(int(n)))
-        if modifier:
-            total += int(modifier)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# сколько разобранных формул держит кэш
+FORMULA_CACHE_SIZE = 1024
+# с какого числа костей в пачке roll_many бросает через NumPy
+NUMPY_MIN_DICE = 512
+# roll_many без NumPy бросает несколько костей одной выборкой из таблицы
+# сумм всех исходов, если исходов не больше PACKED_OUTCOMES
+PACKED_OUTCOMES = 4096
+# с какой длины многочленов распределения сворачиваются через NumPy
+NUMPY_MIN_CONVOLVE = 64
+
+KEEP_ALL = 0
+KEEP_HIGHEST = 1
+KEEP_LOWEST = 2
+
+# число или {переменная}
+_VALUE = r"\d+|\{\w+\}"
+_TERM = re.compile(
+    rf"(?P<sign>[+-])"
+    rf"(?:(?P<count>{_VALUE})?d(?P<sides>{_VALUE})"
+    rf"(?:(?P<keep>kh|kl|dh|dl|k)(?P<keep_count>{_VALUE})?)?"
+    rf"(?P<advantage>adv|dis)?"
+    rf"|(?P<constant>{_VALUE}))"
+)
+_VARIABLE = re.compile(r"\{\w+\}")
+
+
+class DiceTerm(NamedTuple):
+    """
+    Группа костей NdM. count, sides и keep_count — число или имя переменной
+    """
+    sign: int        # 1 или -1
+    count: int | str
+    sides: int | str
+    keep: int        # KEEP_ALL, KEEP_HIGHEST, KEEP_LOWEST
+    keep_count: int | str | None
+    advantage: int   # 1 — преимущество, -1 — помеха: группа бросается дважды
+
+
+class RollPlan:
+    """
+    Разобранная формула броска: константа, переменные со знаком
+    и группы костей. roll() не разбирает текст и не использует regex
+    """
+    __slots__ = ("text", "constant", "variables", "dice", "_simple")
+
+    def __init__(self, text, constant, variables, dice):
+        self.text = text
+        self.constant = constant
+        self.variables = variables  # ((знак, имя), ...)
+        self.dice = dice            # (DiceTerm, ...)
+        # формулы вида 18d10+36 — отдельный быстрый цикл
+        self._simple = None
+        if not variables and all(
+            type(t.count) is int and type(t.sides) is int and t.keep == KEEP_ALL and not t.advantage
+            for t in dice
+        ):
+            self._simple = tuple((t.sign, t.count, t.sides) for t in dice)
+
+    def __repr__(self):
+        return f"RollPlan({self.text!r})"
+
+    def roll(self, vars=None, rng=None):
+        """
+        vars — значения {переменных}, отсутствующие считаются 0;
+        rng — random.Random (поток RngService), по умолчанию поток DICE
+        """
+        rand = (rng or rng_service.stream(rng_service.DICE)).random
+        total = self.constant
+        if self._simple is not None:
+            for sign, count, sides in self._simple:
+                subtotal = count
+                for _ in range(count):
+                    subtotal += int(rand() * sides)
+                total += sign * subtotal
+            return total
+
+        vars = vars or {}
+        for sign, name in self.variables:
+            total += sign * vars.get(name, 0)
+        for term in self.dice:
+            count = _resolve(term.count, vars)
+            sides = _resolve(term.sides, vars)
+            if count <= 0 or sides <= 0:
+                continue
+            subtotal = _roll_group(term, count, sides, vars, rand)
+            if term.advantage:
+                other = _roll_group(term, count, sides, vars, rand)
+                subtotal = max(subtotal, other) if term.advantage > 0 else min(subtotal, other)
+            total += term.sign * subtotal
         return total
 
-    try:
-        return int(formula)
-    except ValueError:
-        raise ValueError(f"Неверный формат броска: {formula}")
\ No newline at end of file
+    def roll_many(self, n, vars=None, rng=None, use_numpy=None):
+        """
+        n независимых бросков одним вызовом. use_numpy=None — NumPy,
+        если он установлен и костей в пачке не меньше NUMPY_MIN_DICE.
+        Генератор NumPy засевается из rng, так что засеянный rng даёт
+        повторяемый результат
+        """
+        rng = rng or rng_service.stream(rng_service.DICE)
+        vars = vars or {}
+        groups = []
+        for term in self.dice:
+            count = _resolve(term.count, vars)
+            sides = _resolve(term.sides, vars)
+            if count > 0 and sides > 0:
+                keep = count if term.keep == KEEP_ALL else \
+                    max(0, min(_resolve(term.keep_count, vars), count))
+                groups.append((term, count, sides, keep))
+        constant = self.constant + sum(sign * vars.get(name, 0) for sign, name in self.variables)
+
+        if use_numpy is None:
+            dice = sum(count * (2 if term.advantage else 1) for term, count, _, _ in groups)
+            use_numpy = np is not None and dice * n >= NUMPY_MIN_DICE
+        if use_numpy:
+            return _roll_many_numpy(groups, constant, n, rng)
+
+        totals = [constant] * n
+        for term, count, sides, keep in groups:
+            sums = _roll_sums(term.keep, count, sides, keep, n, rng)
+            if term.advantage:
+                other = _roll_sums(term.keep, count, sides, keep, n, rng)
+                sums = list(map(max if term.advantage > 0 else min, sums, other))
+            totals = list(map(add if term.sign > 0 else sub, totals, sums))
+        return totals
+
+    def dice_count(self, vars=None):
+        """
+        Сколько костей бросается за один бросок (преимущество — вдвое)
+        """
+        vars = vars or {}
+        total = 0
+        for term in self.dice:
+            count = _resolve(term.count, vars)
+            if count > 0 and _resolve(term.sides, vars) > 0:
+                total += count * (2 if term.advantage else 1)
+        return total
+
+    def exact_cost(self, vars=None):
+        """
+        Грубая оценка работы distribution() в элементарных шагах:
+        интерфейс по ней решает, считать ли точно («1000d100» — десятки секунд)
+        """
+        vars = vars or {}
+        cost = 0
+        width = 1
+        for term in self.dice:
+            count = _resolve(term.count, vars)
+            sides = _resolve(term.sides, vars)
+            if count <= 0 or sides <= 0:
+                continue
+            if term.keep == KEEP_ALL:
+                group = count * (sides - 1) + 1
+                cost += count * group
+            else:
+                keep = max(1, min(_resolve(term.keep_count, vars), count))
+                group = keep * (sides - 1) + 1
+                # динамика _kept_distribution: грани x состояния x число костей
+                cost += sides * count * count * group
+            cost += width * group
+            width += group - 1
+        return cost
+
+    def distribution(self, vars=None):
+        """
+        Точное распределение суммы (Distribution), с кэшем по формуле
+        и значениям переменных
+        """
+        vars = vars or {}
+        return _distribution(self, tuple(sorted(vars.items())))
+
+
+class Distribution:
+    """
+    Точное распределение целочисленного броска:
+    pmf[i] — вероятность значения offset + i
+    """
+    __slots__ = ("offset", "pmf", "_cdf")
+
+    def __init__(self, offset, pmf):
+        self.offset = offset
+        self.pmf = tuple(pmf)
+        self._cdf = tuple(accumulate(self.pmf))
+
+    def __repr__(self):
+        return f"Distribution({self.min}..{self.max}, mean={self.mean:.2f})"
+
+    @property
+    def min(self):
+        return self.offset
+
+    @property
+    def max(self):
+        return self.offset + len(self.pmf) - 1
+
+    @property
+    def mean(self):
+        return sum((self.offset + i) * p for i, p in enumerate(self.pmf))
+
+    @property
+    def variance(self):
+        mean = self.mean
+        return sum((self.offset + i - mean) ** 2 * p for i, p in enumerate(self.pmf))
+
+    def probability(self, value):
+        index = value - self.offset
+        return self.pmf[index] if 0 <= index < len(self.pmf) else 0.0
+
+    def at_most(self, value):
+        index = value - self.offset
+        if index < 0:
+            return 0.0
+        return 1.0 if index >= len(self.pmf) - 1 else min(1.0, self._cdf[index])
+
+    def at_least(self, value):
+        """
+        P(сумма >= value) — например, шанс, что урон уложит цель с value хитами
+        """
+        return max(0.0, 1.0 - self.at_most(value - 1))
+
+    def percentile(self, q):
+        """
+        Наименьшее значение, до которого включительно набирается q процентов
+        """
+        index = bisect_left(self._cdf, q / 100 - 1e-12)
+        return self.offset + min(index, len(self.pmf) - 1)
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def _distribution(plan, vars):
+    vars = dict(vars)
+    offset = plan.constant + sum(sign * vars.get(name, 0) for sign, name in plan.variables)
+    pmf = [1.0]
+    for term in plan.dice:
+        count = _resolve(term.count, vars)
+        sides = _resolve(term.sides, vars)
+        if count <= 0 or sides <= 0:
+            continue
+        if term.keep == KEEP_ALL:
+            low, group = count, _uniform_sum(sides, count)
+        else:
+            keep = max(0, min(_resolve(term.keep_count, vars), count))
+            low, group = _kept_distribution(count, sides, keep, term.keep == KEEP_HIGHEST)
+        if term.advantage:
+            group = _best_of_two(group, term.advantage > 0)
+        if term.sign < 0:
+            low, group = -(low + len(group) - 1), group[::-1]
+        offset += low
+        pmf = _convolve(pmf, group)
+    return Distribution(offset, pmf)
+
+
+def _convolve(a, b):
+    if np is not None and min(len(a), len(b)) >= NUMPY_MIN_CONVOLVE:
+        return np.convolve(a, b).tolist()
+    result = [0.0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                result[i + j] += x * y
+    return result
+
+
+def _uniform_sum(sides, count):
+    """
+    pmf суммы count костей dsides (от count до count * sides)
+    """
+    if np is not None and count * sides >= NUMPY_MIN_CONVOLVE:
+        # возведение в степень с удвоением: log2(count) свёрток NumPy
+        result, pmf = [1.0], [1.0 / sides] * sides
+        while count:
+            if count & 1:
+                result = _convolve(result, pmf)
+            count >>= 1
+            if count:
+                pmf = _convolve(pmf, pmf)
+        return result
+    # без NumPy: свёртка с равномерной костью — разность скользящих сумм
+    pmf = [1.0]
+    for _ in range(count):
+        cumulative = list(accumulate(pmf))
+        padded = [0.0] * sides + cumulative + [cumulative[-1]] * (sides - 1)
+        size = len(pmf) + sides - 1
+        pmf = [max(0.0, d) / sides for d in map(sub, padded[sides:], padded[:size])]
+    return pmf
+
+
+def _kept_distribution(count, sides, keep, highest):
+    """
+    (минимум, pmf) суммы keep лучших (худших) из count костей.
+    Грани перебираются от лучшей к худшей; состояние — сколько костей
+    уже расставлено и сумма оставленных, вес — число исходов
+    """
+    faces = range(sides, 0, -1) if highest else range(1, sides + 1)
+    states = {(0, 0): 1}
+    for face in faces:
+        following = {}
+        for (placed, total), ways in states.items():
+            for dice in range(count - placed + 1):
+                kept = min(dice, max(0, keep - placed))
+                key = (placed + dice, total + kept * face)
+                following[key] = following.get(key, 0) + ways * comb(count - placed, dice)
+        states = following
+    outcomes = sides ** count
+    low = keep
+    pmf = [0.0] * (keep * (sides - 1) + 1)
+    for (placed, total), ways in states.items():
+        if placed == count:
+            pmf[total - low] += ways / outcomes
+    return low, pmf
+
+
+def _best_of_two(pmf, highest):
+    cdf = list(accumulate(pmf))
+    if highest:
+        squared = [c * c for c in cdf]
+    else:
+        squared = [1 - (1 - c) ** 2 for c in cdf]
+    return [c - p for c, p in zip(squared, [0.0] + squared[:-1])]
+
+
+def _roll_sums(mode, count, sides, keep, n, rng):
+    """
+    n сумм по count костей (с учётом keep) без NumPy
+    """
+    if mode == KEEP_ALL:
+        packed = 1
+        while packed < count and sides ** (packed + 1) <= PACKED_OUTCOMES:
+            packed += 1
+        full, rest = divmod(count, packed)
+        sums = None
+        if full:
+            draws = _draw(_packed_sums(sides, packed), n * full, rng)
+            sums = draws if full == 1 else map(sum, zip(*[iter(draws)] * full))
+        if rest:
+            draws = _draw(_packed_sums(sides, rest), n, rng)
+            sums = draws if sums is None else map(add, sums, draws)
+        return list(sums)
+    flat = _draw(_packed_sums(sides, 1), n * count, rng)
+    groups = map(sorted, zip(*[iter(flat)] * count))
+    if mode == KEEP_HIGHEST:
+        return [sum(group[count - keep:]) for group in groups]
+    return [sum(group[:keep]) for group in groups]
+
+
+@lru_cache(maxsize=64)
+def _packed_sums(sides, dice):
+    """
+    Суммы dice костей для всех sides ** dice равновероятных исходов
+    """
+    table = [0]
+    for _ in range(dice):
+        table = [total + face for total in table for face in range(1, sides + 1)]
+    return table
+
+
+def _draw(table, k, rng):
+    size = len(table)
+    if size & (size - 1) == 0:
+        # степень двойки (d2, d4, d8...) — ровно столько случайных бит
+        getrandbits = rng.getrandbits
+        bits = size.bit_length() - 1
+        return [table[getrandbits(bits)] for _ in repeat(None, k)]
+    return rng.choices(table, k=k)
+
+
+def _roll_many_numpy(groups, constant, n, rng):
+    generator = np.random.default_rng(rng.getrandbits(64))
+    totals = np.full(n, constant, dtype=np.int64)
+    for term, count, sides, keep in groups:
+        sums = _roll_sums_numpy(generator, term.keep, count, sides, keep, n)
+        if term.advantage:
+            other = _roll_sums_numpy(generator, term.keep, count, sides, keep, n)
+            sums = np.maximum(sums, other) if term.advantage > 0 else np.minimum(sums, other)
+        totals += term.sign * sums
+    return totals.tolist()
+
+
+def _roll_sums_numpy(generator, mode, count, sides, keep, n):
+    rolls = generator.integers(1, sides + 1, size=(n, count), dtype=np.int64)
+    if mode == KEEP_ALL:
+        return rolls.sum(axis=1)
+    rolls.sort(axis=1)
+    if mode == KEEP_HIGHEST:
+        return rolls[:, count - keep:].sum(axis=1)
+    return rolls[:, :keep].sum(axis=1)
+
+
+def _resolve(value, vars):
+    return vars.get(value, 0) if type(value) is str else value
+
+
+def _roll_group(term, count, sides, vars, rand):
+    if term.keep == KEEP_ALL:
+        subtotal = count
+        for _ in range(count):
+            subtotal += int(rand() * sides)
+        return subtotal
+    rolls = sorted(int(rand() * sides) + 1 for _ in range(count))
+    keep = max(0, min(_resolve(term.keep_count, vars), count))
+    return sum(rolls[count - keep:]) if term.keep == KEEP_HIGHEST else sum(rolls[:keep])
+
+
+def normalize_formula(formula):
+    """
+    Текст формулы без пробелов, в нижнем регистре (кроме имён переменных),
+    русские «д»/«к» — как d. Если есть скобки, берётся их содержимое:
+    «135 (18d10 + 36)» из бестиария — это 18d10+36
+    """
+    parts = []
+    pos = 0
+    for match in _VARIABLE.finditer(formula):
+        parts.append(formula[pos:match.start()].lower())
+        parts.append(match.group())
+        pos = match.end()
+    parts.append(formula[pos:].lower())
+    text = "".join(parts)
+    text = text.replace("д", "d").replace("к", "d").replace(" ", "").replace("−", "-")
+    start = text.find("(")
+    if start != -1:
+        end = text.find(")", start)
+        if end != -1:
+            text = text[start + 1:end]
+    return text
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def compile_formula(formula):
+    """
+    Формула -> RollPlan (с кэшем по исходному и нормализованному тексту).
+    Поддерживается сумма термов: 2d6+1d4+3, d20, 4d6kh3 (k, kh, kl, dh, dl),
+    1d20adv / 1d20dis, {переменные} на месте любого числа
+    """
+    return _compile_normalized(normalize_formula(formula))
+
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def _compile_normalized(text):
+    source = text if text[:1] in ("+", "-") else "+" + text
+    constant = 0
+    variables = []
+    dice = []
+    pos = 0
+    while pos < len(source):
+        match = _TERM.match(source, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(f"Неверный формат броска: {text}")
+        pos = match.end()
+        sign = -1 if match.group("sign") == "-" else 1
+        value = match.group("constant")
+        if value is not None:
+            value = _parse_value(value)
+            if type(value) is str:
+                variables.append((sign, value))
+            else:
+                constant += sign * value
+            continue
+
+        count = _parse_value(match.group("count") or "1")
+        keep, keep_count = KEEP_ALL, None
+        keep_mode = match.group("keep")
+        if keep_mode:
+            keep_count = _parse_value(match.group("keep_count") or "1")
+            if keep_mode in ("dh", "dl"):
+                # отбросить n худших = оставить count - n лучших
+                if type(count) is str or type(keep_count) is str:
+                    raise ValueError(f"Неверный формат броска: {text}")
+                keep_count = count - keep_count
+                keep = KEEP_HIGHEST if keep_mode == "dl" else KEEP_LOWEST
+            else:
+                keep = KEEP_LOWEST if keep_mode == "kl" else KEEP_HIGHEST
+        sides = _parse_value(match.group("sides"))
+        if type(sides) is int and sides <= 0:
+            # d{переменная} со значением 0 — пустая группа во всех API
+            raise ValueError(f"Неверный формат броска: {text}")
+        advantage = {"adv": 1, "dis": -1}.get(match.group("advantage"), 0)
+        dice.append(DiceTerm(sign, count, sides, keep, keep_count, advantage))
+    return RollPlan(text, constant, tuple(variables), tuple(dice))
+
+
+def _parse_value(value):
+    return value[1:-1] if value[0] == "{" else int(value)
+
+
+def roll_formula(formula: str, rng=None, **vars) -> int:
+    # все переменные, которых нет — 0
+    return compile_formula(formula).roll(vars, rng)
+
+
+def distribution(formula: str, **vars) -> Distribution:
+    """
+    Точное распределение формулы: distribution("8d6").at_least(45) —
+    шанс, что огненный шар уложит тролля с 45 хитами
+    """
+    return compile_formula(formula).distribution(vars)
+
+
+def roll_many(formula: str, n: int, use_numpy=None, rng=None, **vars) -> list:
+    """
+    n независимых бросков формулы (хиты орды, урон по группе)
+    """
+    return compile_formula(formula).roll_many(n, vars, rng, use_numpy)
@@ -0,0 +1,295 @@
+import json
+import struct
+import zlib
+
+from battle_engine import BattleEngine
+from battle_state_exporter import write_atomic
+from combatants import Combatant, Monster, Player
+
+# Файл встречи (.tndm): заголовок + тело, сжатое zlib.
+#
+# Тело — секции подряд:
+#   строки     — число, длины в байтах, utf-8 одним блоком; остальные
+#                секции ссылаются на строки по номеру
+#   движок     — поля хода и номера участников prev_group
+#   участники  — записи фиксированного размера в порядке таблицы
+#   эффекты    — записи фиксированного размера подряд для всех участников
+#
+# Блок характеристик монстра не хранится: при загрузке он ищется
+# в бестиарии по monster_type при первом обращении.
+MAGIC = b"TNDMENC\0"
+FORMAT_VERSION = 1
+
+NONE = 0xFFFFFFFF  # пустая ссылка на строку
+
+HEADER = struct.Struct("<8sH")
+COUNT = struct.Struct("<I")
+# флаги, раунд, текущая группа, подгруппа, инициатива текущей группы, размер prev_group
+ENGINE = struct.Struct("<BiIIiI")
+# вид, флаги, имя, своё имя, тип монстра, состояние, прочие effects (JSON),
+# max_hp, hp, temp_hp, ac, инициатива, порядковый номер, turns_ended, число эффектов
+COMBATANT = struct.Struct("<BBIIIIIiiiiiIIH")
+# название, expires, applied_round, флаги
+EFFECT = struct.Struct("<IiiB")
+
+KINDS = (Combatant, Player, Monster)
+
+# флаги движка
+IN_COMBAT = 1
+NO_CURRENT_GROUP = 2
+NO_PREV_GROUP = 4
+
+# флаги участника
+CONCENTRATION = 1
+DISABLED = 2
+NO_HP = 4
+NO_MAX_HP = 8
+NO_AC = 16
+NO_INITIATIVE = 32
+
+# флаги эффекта
+NO_EXPIRES = 1
+NO_APPLIED_ROUND = 2
+
+# ключи effects, которые хранятся в записях участника и эффектов
+STATE_EFFECTS = ("custom_effects", "incapacitated")
+
+
+class EncounterFormatError(ValueError):
+    pass
+
+
+class _Strings:
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def ref(self, value):
+        if value is None:
+            return NONE
+        ref = self.index.get(value)
+        if ref is None:
+            ref = self.index[value] = len(self.values)
+            self.values.append(value)
+        return ref
+
+    def pack(self):
+        blobs = [value.encode("utf-8") for value in self.values]
+        lengths = struct.pack(f"<{len(blobs)}I", *map(len, blobs))
+        return COUNT.pack(len(blobs)) + lengths + b"".join(blobs)
+
+
+def _int(value):
+    return 0 if value is None else value
+
+
+# =========================
+# save
+# =========================
+
+def dumps(engine, level=6):
+    """
+    Бой целиком (участники, эффекты, позиция хода) в байты файла встречи
+    """
+    strings = _Strings()
+    combatants = engine.combatants
+    positions = {c.id: i for i, c in enumerate(combatants)}
+
+    records = []
+    effects = []
+    for combat in combatants:
+        (hp, temp_hp, state, concentration, disabled, initiative, ordinal,
+         turns_ended, custom_effects) = engine.memento(combat)
+        flags = (
+            (CONCENTRATION if concentration else 0) | (DISABLED if disabled else 0)
+            | (NO_HP if hp is None else 0) | (NO_MAX_HP if combat.max_hp is None else 0)
+            | (NO_AC if combat.ac is None else 0) | (NO_INITIATIVE if initiative is None else 0)
+        )
+        extra = {k: v for k, v in combat.effects.items() if k not in STATE_EFFECTS}
+        records.append(COMBATANT.pack(
+            KINDS.index(type(combat)) if type(combat) in KINDS else 0, flags,
+            strings.ref(combat.name), strings.ref(combat.custom_name or ""),
+            strings.ref(getattr(combat, "monster_type", None)), strings.ref(state),
+            strings.ref(json.dumps(extra, ensure_ascii=False) if extra else None),
+            _int(combat.max_hp), _int(hp), temp_hp, _int(combat.ac), _int(initiative),
+            ordinal, turns_ended, len(custom_effects),
+        ))
+        for name, expires, applied_round in custom_effects:
+            effects.append(EFFECT.pack(
+                strings.ref(name), _int(expires), _int(applied_round),
+                (NO_EXPIRES if expires is None else 0)
+                | (NO_APPLIED_ROUND if applied_round is None else 0),
+            ))
+
+    in_combat, round_, current_index, sub_index, prev_group, current_group = engine.turn_state()
+    prev = [positions[c.id] for c in prev_group or () if c.id in positions]
+    engine_flags = (
+        (IN_COMBAT if in_combat else 0)
+        | (NO_CURRENT_GROUP if current_group is None else 0)
+        | (NO_PREV_GROUP if prev_group is None else 0)
+    )
+    body = b"".join((
+        strings.pack(),
+        ENGINE.pack(engine_flags, round_, current_index, sub_index, _int(current_group), len(prev)),
+        struct.pack(f"<{len(prev)}I", *prev),
+        COUNT.pack(len(records)), *records,
+        COUNT.pack(len(effects)), *effects,
+    ))
+    return HEADER.pack(MAGIC, FORMAT_VERSION) + zlib.compress(body, level)
+
+
+def save(engine, path):
+    # сбой посреди записи не портит прежний файл
+    write_atomic(path, dumps(engine), fsync=True)
+
+
+# =========================
+# load
+# =========================
+
+def _parse(data):
+    if len(data) < HEADER.size:
+        raise EncounterFormatError("файл встречи обрезан")
+    magic, version = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise EncounterFormatError("это не файл встречи")
+    if version != FORMAT_VERSION:
+        raise EncounterFormatError(f"неподдерживаемая версия файла встречи: {version}")
+    try:
+        body = zlib.decompress(data[HEADER.size:])
+    except zlib.error as e:
+        raise EncounterFormatError(f"файл встречи повреждён: {e}") from None
+
+    try:
+        offset = 0
+        (count,) = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+        lengths = struct.unpack_from(f"<{count}I", body, offset)
+        offset += 4 * count
+        strings = []
+        for length in lengths:
+            strings.append(body[offset:offset + length].decode("utf-8"))
+            offset += length
+
+        engine_fields = ENGINE.unpack_from(body, offset)
+        offset += ENGINE.size
+        prev_count = engine_fields[-1]
+        prev = struct.unpack_from(f"<{prev_count}I", body, offset)
+        offset += 4 * prev_count
+
+        (count,) = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+        end = offset + COMBATANT.size * count
+        records = list(COMBATANT.iter_unpack(body[offset:end]))
+        offset = end
+
+        (count,) = COUNT.unpack_from(body, offset)
+        offset += COUNT.size
+        end = offset + EFFECT.size * count
+        effects = list(EFFECT.iter_unpack(body[offset:end]))
+        if end != len(body):
+            raise EncounterFormatError("файл встречи повреждён: лишние данные")
+    except (struct.error, UnicodeDecodeError) as e:
+        raise EncounterFormatError(f"файл встречи повреждён: {e}") from None
+    _check_refs(strings, prev, records, effects)
+    return strings, engine_fields, prev, records, effects
+
+
+def _check_refs(strings, prev, records, effects):
+    """
+    Ссылки на строки, виды участников и номера prev_group в пределах
+    прочитанных секций — иначе loads упал бы с IndexError
+    """
+    def check(ref, optional=False):
+        if ref >= len(strings) and not (optional and ref == NONE):
+            raise EncounterFormatError(f"файл встречи повреждён: нет строки {ref}")
+
+    for (kind, _, name, custom_name, monster_type, state, extra, *_, effect_count) in records:
+        if kind >= len(KINDS):
+            raise EncounterFormatError(f"файл встречи повреждён: неизвестный вид участника {kind}")
+        check(name)
+        check(custom_name)
+        check(monster_type, optional=True)
+        check(state)
+        check(extra, optional=True)
+    for effect_name, *_ in effects:
+        check(effect_name)
+    if sum(record[-1] for record in records) != len(effects):
+        raise EncounterFormatError("файл встречи повреждён: число эффектов не сходится")
+    if any(i >= len(records) for i in prev):
+        raise EncounterFormatError("файл встречи повреждён: неверный номер участника хода")
+
+
+def loads(data, engine=None, bestiary=None):
+    """
+    Загружает встречу в engine (текущий бой очищается) или в новый
+    BattleEngine. Участники получают новые id. Возвращает движок
+    """
+    strings, engine_fields, prev, records, effects = _parse(data)
+    if bestiary is None:
+        from combatant_factory import bestiary_data as bestiary
+
+    def text(ref):
+        return None if ref == NONE else strings[ref]
+
+    joined = []
+    effect_pos = 0
+    for (kind, flags, name, custom_name, monster_type, state, extra,
+         max_hp, hp, temp_hp, ac, initiative, ordinal, turns_ended, effect_count) in records:
+        custom_effects = []
+        for effect_name, expires, applied_round, effect_flags in effects[effect_pos:effect_pos + effect_count]:
+            custom_effects.append((
+                strings[effect_name],
+                None if effect_flags & NO_EXPIRES else expires,
+                None if effect_flags & NO_APPLIED_ROUND else applied_round,
+            ))
+        effect_pos += effect_count
+
+        initiative = None if flags & NO_INITIATIVE else initiative
+        max_hp = None if flags & NO_MAX_HP else max_hp
+        ac = None if flags & NO_AC else ac
+        try:
+            static_effects = json.loads(strings[extra]) if extra != NONE else {}
+        except ValueError as e:
+            raise EncounterFormatError(f"файл встречи повреждён: {e}") from None
+        cls = KINDS[kind]
+        if cls is Player:
+            combat = Player(strings[name], initiative, effects=static_effects,
+                            custom_name=strings[custom_name])
+        elif cls is Monster:
+            combat = Monster(strings[name], initiative, max_hp, ac, static_effects,
+                             monster_type=text(monster_type), custom_name=strings[custom_name],
+                             bestiary=bestiary)
+        else:
+            combat = Combatant(strings[name], initiative, max_hp, ac, static_effects,
+                               strings[custom_name])
+        combat.max_hp = max_hp
+        combat.ac = ac
+        memento = (
+            None if flags & NO_HP else hp, temp_hp, strings[state],
+            bool(flags & CONCENTRATION), bool(flags & DISABLED),
+            initiative, ordinal, turns_ended, tuple(custom_effects),
+        )
+        joined.append((combat, memento))
+
+    engine_flags, round_, current_index, sub_index, current_group, _ = engine_fields
+    prev_group = None
+    if not engine_flags & NO_PREV_GROUP:
+        prev_group = tuple(joined[i][0] for i in prev)
+    turn = (
+        bool(engine_flags & IN_COMBAT), round_, current_index, sub_index, prev_group,
+        None if engine_flags & NO_CURRENT_GROUP else current_group,
+    )
+
+    if engine is None:
+        engine = BattleEngine()
+    with engine.batch():
+        engine.clear()
+        engine.load_state(joined=joined, turn=turn)
+    engine.history.clear()
+    return engine
+
+
+def load(path, engine=None, bestiary=None):
+    with open(path, "rb") as f:
+        return loads(f.read(), engine, bestiary)
@@ -0,0 +1,438 @@
+"""
+Безголовая симуляция встреч методом Монте-Карло.
+
+Стороны описываются группами: «Ветеран x2, Зомби x6» — монстры из
+бестиария (атаки разбираются из HTML «Actions»), «Воин:45:18:+7:1d8+4:2 x2» —
+своя группа имя:хиты:КД:бонус атаки:урон[:атак за ход]. Запуск из корня
+репозитория:
+    python -m encounter_simulator --party "Воин:45:18:+7:1d8+4:2 x4" --enemies "Огр x3"
+"""
+import argparse
+import os
+import re
+import statistics
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import NamedTuple
+
+from battle_engine import BattleEngine
+from combatant_factory import CombatantFactory, bestiary_data
+from dice_roll import compile_formula
+from rng_service import DAMAGE, INITIATIVE, RngService
+
+PARTY = 0
+ENEMIES = 1
+
+POLICIES = ("random", "weakest")
+
+# поток бросков атаки и выбора целей
+ATTACK = "attack"
+
+# после стольких раундов бой считается ничьей
+MAX_ROUNDS = 50
+
+
+class Attack(NamedTuple):
+    name: str
+    bonus: int
+    damage: str  # формула урона при попадании, «1d8+3»
+
+    @property
+    def mean(self):
+        return compile_formula(self.damage).distribution().mean
+
+
+class FighterGroup(NamedTuple):
+    """
+    Группа одинаковых бойцов одной стороны; передаётся в процессы пула
+    """
+    name: str
+    count: int
+    hp: str             # формула хитов
+    ac: int
+    initiative_bonus: int
+    attack: Attack | None  # None — атаковать нечем (заклинатели и т.п.)
+    attacks_per_turn: int
+
+
+# =========================
+# actions parsing
+# =========================
+
+_PARAGRAPH = re.compile(r"<p>(.*?)</p>", re.S)
+_TAG = re.compile(r"<[^>]+>")
+_NAME = re.compile(r"<strong>(.*?)</strong>", re.S)
+_TO_HIT = re.compile(r"([+\-−])\s*(\d+) к попаданию")
+# двоеточие после «Попадание» в части записей пропущено
+_HIT = re.compile(r"Попадание:?")
+_DICE = re.compile(r"(\d+) \(([^)]*\d+[dкд]\d+[^)]*)\)")
+_EXTRA_DICE = re.compile(r"плюс[^.()]*?(\d+) \(([^)]*\d+[dкд]\d+[^)]*)\)")
+_FLAT = re.compile(r"(\d+)")
+_MULTIATTACK = re.compile(r"^(?:множественная атака|многократная атака|мультиатака)")
+_COUNT_WORDS = {
+    "одну": 1, "одна": 1, "две": 2, "два": 2, "три": 3,
+    "четыре": 4, "пять": 5, "шесть": 6,
+}
+_COUNT = re.compile(r"\b(" + "|".join(_COUNT_WORDS) + r")\b")
+
+
+def parse_actions(html):
+    """
+    HTML «Actions» из бестиария -> (атаки, число атак «Множественной атаки»).
+    Атака — абзац с «+N к попаданию»; урон — первая формула после
+    «Попадание:» плюс дополнительные «плюс N (XdY)» (урон ядом и т.п.);
+    альтернатива «или …» (двуручный хват, половина хитов роя) не учитывается
+    """
+    attacks = []
+    multiattack = 1
+    for paragraph in _PARAGRAPH.findall(html or ""):
+        name_match = _NAME.search(paragraph)
+        name = _TAG.sub("", name_match.group(1)).strip(" .") if name_match else ""
+        text = _TAG.sub("", paragraph).replace("\xa0", " ").replace("–", "-").replace("—", "-")
+        if _MULTIATTACK.match(name.lower()):
+            count = _COUNT.search(text.lower())
+            if count:
+                multiattack = max(multiattack, _COUNT_WORDS[count.group(1)])
+            continue
+        to_hit = _TO_HIT.search(text)
+        hit = _HIT.search(text)
+        if to_hit is None or hit is None:
+            continue
+        clause = text[hit.end():].split(". ")[0].split(" или ")[0]
+        dice = _DICE.search(clause)
+        if dice:
+            parts = [dice.group(2)]
+            parts += [extra.group(2) for extra in _EXTRA_DICE.finditer(clause, dice.end())]
+        else:
+            # «Попадание: 1 колющий урон» — без костей
+            flat = _FLAT.search(clause)
+            if flat is None:
+                continue
+            parts = [flat.group(1)]
+        try:
+            damage = "+".join(compile_formula(part).text for part in parts)
+        except ValueError:
+            continue
+        sign = -1 if to_hit.group(1) in "-−" else 1
+        attacks.append(Attack(name, sign * int(to_hit.group(2)), damage))
+    return attacks, multiattack
+
+
+def best_attack(attacks):
+    """
+    Простая политика: каждый ход — атака с наибольшим средним уроном
+    """
+    return max(attacks, key=lambda a: (a.mean, a.bonus), default=None)
+
+
+# =========================
+# encounter description
+# =========================
+
+def _leading_int(text, default=0):
+    match = re.search(r"[+\-−]?\d+", text or "")
+    if match is None:
+        return default
+    return int(match.group().replace("−", "-"))
+
+
+def bestiary_group(monster_type, count=1, bestiary=None):
+    data = (bestiary if bestiary is not None else bestiary_data).get(monster_type)
+    if data is None:
+        raise ValueError(f"Нет в бестиарии: {monster_type}")
+    attacks, multiattack = parse_actions(data.get("Actions", ""))
+    return FighterGroup(
+        name=monster_type,
+        count=count,
+        hp=data.get("Hit Points") or "1d10",
+        ac=_leading_int(data.get("Armor Class"), 10),
+        initiative_bonus=_leading_int(data.get("DEX_mod")),
+        attack=best_attack(attacks),
+        attacks_per_turn=multiattack,
+    )
+
+
+def custom_group(text, count=1):
+    """
+    «имя:хиты:КД:бонус атаки:урон[:атак за ход]», например «Воин:45:18:+7:1d8+4:2»
+    """
+    fields = [part.strip() for part in text.split(":")]
+    if len(fields) not in (5, 6):
+        raise ValueError(f"Ожидается имя:хиты:КД:бонус:урон[:атак], получено: {text}")
+    name, hp, ac, bonus, damage = fields[:5]
+    compile_formula(hp)
+    compile_formula(damage)
+    return FighterGroup(
+        name=name,
+        count=count,
+        hp=hp,
+        ac=int(ac),
+        initiative_bonus=0,
+        attack=Attack("Атака", int(bonus.replace("−", "-")), compile_formula(damage).text),
+        attacks_per_turn=int(fields[5]) if len(fields) == 6 else 1,
+    )
+
+
+def parse_side(text, bestiary=None):
+    """
+    «Ветеран x2, Воин:45:18:+7:1d8+4» -> [FighterGroup, ...]
+    """
+    groups = []
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        match = re.fullmatch(r"(.*?)(?:\s+[xх×]\s*(\d+))?", item)
+        spec, count = match.group(1), int(match.group(2) or 1)
+        if ":" in spec:
+            groups.append(custom_group(spec, count))
+        else:
+            groups.append(bestiary_group(spec, count, bestiary))
+    return groups
+
+
+# =========================
+# single combat
+# =========================
+
+class _Fighter:
+    __slots__ = ("combat", "side", "group", "plan")
+
+    def __init__(self, combat, side, group):
+        self.combat = combat
+        self.side = side
+        self.group = group
+        self.plan = compile_formula(group.attack.damage) if group.attack else None
+
+
+def _choose_target(enemies, policy, rand):
+    if policy == "weakest":
+        return min(enemies, key=lambda f: f.combat.hp)
+    return enemies[int(rand() * len(enemies))]
+
+
+def simulate_combat(party, enemies, rng, policy="random", max_rounds=MAX_ROUNDS):
+    """
+    Один бой на BattleEngine. rng — RngService прогона.
+    Возвращает (победившая сторона или None при ничьей, раунды, выбывшие (сторона, имя)).
+    Выбывшим считается опустившийся до 0 хитов: монстры умирают,
+    герои теряют сознание (спасброски от смерти не моделируются)
+    """
+    factory = CombatantFactory(rng=rng)
+    initiative = rng.stream(INITIATIVE)
+    rand = rng.stream(ATTACK).random
+    damage_rng = rng.stream(DAMAGE)
+
+    fighters = {}
+    for side, groups in ((PARTY, party), (ENEMIES, enemies)):
+        for group in groups:
+            combatants = factory.create_monster(
+                group.name,
+                count=group.count,
+                initiative=initiative.randint(1, 20) + group.initiative_bonus,
+                ac=group.ac,
+                hp_input=group.hp,
+            )
+            for combat in combatants:
+                combat.hp = combat.max_hp = max(1, combat.hp)
+                fighters[combat.id] = _Fighter(combat, side, group)
+
+    engine = BattleEngine([f.combat for f in fighters.values()], history_limit=0, rng=rng)
+    alive = {PARTY: [], ENEMIES: []}
+    for fighter in fighters.values():
+        alive[fighter.side].append(fighter)
+    fallen = []
+
+    engine.start_combat()
+    group = engine.prev_group
+    rounds = 1
+    while group is not None:
+        # номер раунда хода — из события "turn" (engine.round к этому моменту
+        # уже может указывать на следующий раунд)
+        rounds = engine.events[-1].get("round", rounds)
+        if rounds > max_rounds:
+            return None, max_rounds, fallen
+        # атаки группы и переход хода — одна публикация снимка
+        with engine.batch():
+            for combat in group:
+                attacker = fighters[combat.id]
+                if not combat.is_alive or attacker.plan is None:
+                    continue
+                for _ in range(attacker.group.attacks_per_turn):
+                    targets = alive[ENEMIES - attacker.side]
+                    if not targets:
+                        break
+                    target = _choose_target(targets, policy, rand)
+                    d20 = int(rand() * 20) + 1
+                    if d20 == 1 or (d20 < 20 and d20 + attacker.group.attack.bonus < target.combat.ac):
+                        continue
+                    damage = attacker.plan.roll(rng=damage_rng)
+                    if d20 == 20:
+                        # критическое попадание: кости урона бросаются дважды
+                        damage += attacker.plan.roll(rng=damage_rng) - attacker.plan.constant
+                    target.combat.take_damage(max(1, damage))
+                    if target.combat.hp == 0:
+                        engine.set_state(target.combat, "dead" if target.side == ENEMIES else "unconscious")
+                        targets.remove(target)
+                        fallen.append((target.side, target.combat.name))
+            group = engine.next_turn() if alive[PARTY] and alive[ENEMIES] else None
+    for side in (PARTY, ENEMIES):
+        if not alive[side]:
+            return ENEMIES - side, rounds, fallen
+    return None, rounds, fallen
+
+
+# =========================
+# Monte Carlo
+# =========================
+
+class SimulationResult(NamedTuple):
+    runs: int
+    seed: int
+    party_wins: int
+    enemy_wins: int
+    draws: int
+    rounds: Counter   # раунды до исхода -> число боёв (без ничьих)
+    fallen: Counter   # (сторона, имя) -> в скольких боях выбыл
+    names: tuple      # все участники: (сторона, имя)
+
+    @property
+    def win_rate(self):
+        return self.party_wins / self.runs if self.runs else 0.0
+
+    @property
+    def loss_rate(self):
+        return self.enemy_wins / self.runs if self.runs else 0.0
+
+    @property
+    def draw_rate(self):
+        return self.draws / self.runs if self.runs else 0.0
+
+    @property
+    def rounds_mean(self):
+        return statistics.fmean(self.rounds.elements()) if self.rounds else 0.0
+
+    def rounds_percentile(self, q):
+        total = sum(self.rounds.values())
+        seen = 0
+        for value in sorted(self.rounds):
+            seen += self.rounds[value]
+            if seen >= q * total:
+                return value
+        return 0
+
+    def death_probability(self):
+        """
+        (сторона, имя) -> вероятность выбыть (0 хитов) за бой
+        """
+        return {key: self.fallen[key] / self.runs for key in self.names}
+
+
+def _names(party, enemies):
+    names = []
+    for side, groups in ((PARTY, party), (ENEMIES, enemies)):
+        for group in groups:
+            names += [(side, f"{group.name} {i}") for i in range(1, group.count + 1)]
+    if len(set(names)) != len(names):
+        raise ValueError("Имена групп одной стороны должны быть уникальны")
+    return tuple(names)
+
+
+def _simulate_chunk(party, enemies, seed, start, stop, policy, max_rounds):
+    """
+    Прогоны start..stop-1 в процессе пула. Прогон i берёт RngService(seed).split(i),
+    поэтому итог не зависит от числа процессов и размера пачек
+    """
+    root = RngService(seed)
+    wins = Counter()
+    rounds = Counter()
+    fallen = Counter()
+    for i in range(start, stop):
+        winner, finished, names = simulate_combat(party, enemies, root.split(i), policy, max_rounds)
+        wins[winner] += 1
+        if winner is not None:
+            rounds[finished] += 1
+        fallen.update(names)
+    return wins, rounds, fallen
+
+
+def simulate(party, enemies, runs=1000, seed=None, workers=None, policy="random",
+             max_rounds=MAX_ROUNDS, chunk_size=None):
+    """
+    runs боёв party против enemies (списки FighterGroup).
+    workers — процессов в пуле (None — по числу ядер, 1 — в текущем процессе)
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Неизвестная политика: {policy}")
+    names = _names(party, enemies)
+    seed = RngService(seed).seed
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        # несколько пачек на процесс — выравнивает нагрузку
+        chunk_size = max(1, -(-runs // (workers * 4)))
+    chunks = [(start, min(start + chunk_size, runs)) for start in range(0, runs, chunk_size)]
+    args = (repeat(party), repeat(enemies), repeat(seed),
+            [c[0] for c in chunks], [c[1] for c in chunks], repeat(policy), repeat(max_rounds))
+
+    if workers == 1 or len(chunks) == 1:
+        parts = map(_simulate_chunk, *args)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_simulate_chunk, *args))
+
+    wins, rounds, fallen = Counter(), Counter(), Counter()
+    for part_wins, part_rounds, part_fallen in parts:
+        wins.update(part_wins)
+        rounds.update(part_rounds)
+        fallen.update(part_fallen)
+    return SimulationResult(
+        runs, seed, wins[PARTY], wins[ENEMIES], wins[None], rounds, fallen, names,
+    )
+
+
+# =========================
+# CLI
+# =========================
+
+def format_result(result):
+    lines = [
+        f"боёв: {result.runs}, зерно: {result.seed}",
+        f"победа героев: {result.win_rate:.1%}, поражение: {result.loss_rate:.1%}, "
+        f"ничья: {result.draw_rate:.1%}",
+        f"раундов до исхода: среднее {result.rounds_mean:.2f}, "
+        f"медиана {result.rounds_percentile(0.5)}, 90% {result.rounds_percentile(0.9)}",
+        "шанс выбыть:",
+    ]
+    deaths = result.death_probability()
+    for side, name in result.names:
+        label = "герои" if side == PARTY else "враги"
+        lines.append(f"  {label:<6} {name:<30} {deaths[side, name]:>7.1%}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Монте-Карло симуляция встречи")
+    parser.add_argument("--party", required=True, help="«Воин:45:18:+7:1d8+4:2 x4, Ветеран»")
+    parser.add_argument("--enemies", required=True, help="«Огр x2, Гоблин x6»")
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--policy", choices=POLICIES, default="random")
+    parser.add_argument("--max-rounds", type=int, default=MAX_ROUNDS)
+    args = parser.parse_args(argv)
+
+    try:
+        party = parse_side(args.party)
+        enemies = parse_side(args.enemies)
+        # повторяющиеся имена групп — ошибка ввода, а не симуляции
+        _names(party, enemies)
+    except (KeyError, ValueError) as e:
+        parser.error(str(e))
+    for group in party + enemies:
+        if group.attack is None:
+            print(f"{group.name}: атаки не распознаны, в симуляции не атакует")
+    result = simulate(party, enemies, args.runs, args.seed, args.workers,
+                      args.policy, args.max_rounds)
+    print(format_result(result))
+
+
+if __name__ == "__main__":
+    main()
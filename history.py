@@ -0,0 +1,54 @@
+from collections import deque
+from typing import NamedTuple
+
+
+class UndoStep(NamedTuple):
+    """
+    Одно действие мастера (или пачка batch()) в виде обратимых записей.
+    Мементо неизменяемы и разделяются соседними шагами: after одного
+    шага — тот же объект, что before следующего для того же участника
+    """
+    changes: tuple     # (участник, memento до, memento после)
+    membership: tuple  # (участник, True — добавлен / False — убран, memento)
+    engine: tuple      # (поля движка до, после) или ()
+
+
+class UndoHistory:
+    """
+    Стек отмены с ограничением глубины (limit=None — без ограничения)
+    и стек повтора, который сбрасывается новым действием
+    """
+
+    def __init__(self, limit=500):
+        self.limit = limit
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+
+    def __len__(self):
+        return len(self._undo)
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def push(self, step):
+        self._undo.append(step)
+        self._redo.clear()
+
+    def pop_undo(self):
+        step = self._undo.pop()
+        self._redo.append(step)
+        return step
+
+    def pop_redo(self):
+        step = self._redo.pop()
+        self._undo.append(step)
+        return step
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
@@ -0,0 +1,154 @@
+from bisect import bisect_left, bisect_right
+
+
+class InitiativeOrder:
+    """
+    Участники по убыванию инициативы, сгруппированные по её значению.
+
+    Вставка, удаление и смена инициативы ищут место бинарным поиском
+    по ключам, без пересортировки всего списка. Внутри группы участники
+    идут в порядке добавления (как при стабильной сортировке): каждому
+    выдаётся порядковый номер, по которому отмена возвращает участника
+    на прежнее место.
+
+    Для каждой группы хранится число участников, способных действовать,
+    а ключи таких групп — в отдельном отсортированном списке: поиск
+    следующей группы с ходом не перебирает выбывших.
+    """
+
+    def __init__(self, combatants=()):
+        self.combatants = []  # плоский порядок таблицы
+        self.groups = []      # списки участников по группам
+        self._flat_keys = []
+        self._group_keys = []
+        self._keys = {}       # id участника -> ключ, под которым он стоит
+        self._ordinals = {}   # id участника -> порядковый номер внутри группы
+        self._next_ordinal = 0
+        self._able = {}       # id участника -> может ли действовать
+        self._able_counts = []
+        self._ready_keys = []  # ключи групп, где кто-то может действовать
+        for combat in combatants:
+            self.add(combat)
+
+    @staticmethod
+    def key_of(combat):
+        # отрицание — чтобы bisect работал по возрастанию
+        return -(combat.initiative if combat.initiative is not None else 0)
+
+    def __len__(self):
+        return len(self.combatants)
+
+    def __contains__(self, combat):
+        return combat.id in self._keys
+
+    def ordinal(self, combat):
+        return self._ordinals.get(combat.id)
+
+    def group_index(self, combat):
+        return bisect_left(self._group_keys, self._keys[combat.id])
+
+    def add(self, combat, ordinal=None):
+        """
+        ordinal — явный порядковый номер (восстановление), иначе участник
+        встаёт в конец своей группы.
+        Возвращает (позиция группы, создана ли новая группа)
+        """
+        if ordinal is None:
+            ordinal = self._next_ordinal
+        # восстановленный номер не должен совпасть с номерами новых участников
+        self._next_ordinal = max(self._next_ordinal, ordinal + 1)
+        self._ordinals[combat.id] = ordinal
+
+        key = self.key_of(combat)
+        able = not combat.incapacitated
+        self._keys[combat.id] = key
+        self._able[combat.id] = able
+
+        flat_key = (key, ordinal)
+        pos = bisect_right(self._flat_keys, flat_key)
+        self._flat_keys.insert(pos, flat_key)
+        self.combatants.insert(pos, combat)
+
+        index = bisect_left(self._group_keys, key)
+        if index < len(self._group_keys) and self._group_keys[index] == key:
+            group = self.groups[index]
+            group.insert(bisect_right(group, ordinal, key=self.ordinal), combat)
+            created = False
+        else:
+            self._group_keys.insert(index, key)
+            self.groups.insert(index, [combat])
+            self._able_counts.insert(index, 0)
+            created = True
+        if able:
+            self._change_able_count(index, 1)
+        return index, created
+
+    def remove(self, combat):
+        """
+        Возвращает (позиция группы, удалена ли группа целиком)
+        """
+        key = self._keys.pop(combat.id)
+        able = self._able.pop(combat.id)
+
+        pos = bisect_left(self._flat_keys, (key, self._ordinals.pop(combat.id)))
+        while self.combatants[pos] is not combat:
+            pos += 1
+        del self._flat_keys[pos]
+        del self.combatants[pos]
+
+        index = bisect_left(self._group_keys, key)
+        group = self.groups[index]
+        group.remove(combat)
+        if able:
+            self._change_able_count(index, -1)
+        if group:
+            return index, False
+        del self.groups[index]
+        del self._group_keys[index]
+        del self._able_counts[index]
+        return index, True
+
+    # =========================
+    # able-to-act index
+    # =========================
+
+    def refresh(self, combat):
+        """
+        Пересчитать, может ли участник действовать (после смены состояния
+        или ручного отключения). True — если значение изменилось
+        """
+        if combat.id not in self._able:
+            return False
+        able = not combat.incapacitated
+        if self._able[combat.id] == able:
+            return False
+        self._able[combat.id] = able
+        self._change_able_count(self.group_index(combat), 1 if able else -1)
+        return True
+
+    def can_act(self, index):
+        return self._able_counts[index] > 0
+
+    def next_ready(self, index):
+        """
+        (позиция, перешли ли через конец раунда) для первой группы
+        с ходом начиная с index; None — действовать некому
+        """
+        ready = self._ready_keys
+        if not ready:
+            return None
+        if index < len(self._group_keys):
+            pos = bisect_left(ready, self._group_keys[index])
+            if pos < len(ready):
+                return bisect_left(self._group_keys, ready[pos]), False
+        return bisect_left(self._group_keys, ready[0]), True
+
+    def _change_able_count(self, index, delta):
+        before = self._able_counts[index]
+        after = before + delta
+        self._able_counts[index] = after
+        key = self._group_keys[index]
+        if before == 0 and after > 0:
+            self._ready_keys.insert(bisect_left(self._ready_keys, key), key)
+        elif before > 0 and after == 0:
+            del self._ready_keys[bisect_left(self._ready_keys, key)]
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+SSE_HEADERS = (
+    "HTTP/1.1 200 OK\r\n"
+    "Content-Type: text/event-stream; charset=utf-8\r\n"
+    "Cache-Control: no-cache\r\n"
+    "Connection: keep-alive\r\n"
+    "Access-Control-Allow-Origin: *\r\n"
+    "\r\n"
+).encode("ascii")
+
+NOT_FOUND = (
+    "HTTP/1.1 404 Not Found\r\n"
+    "Content-Length: 0\r\n"
+    "Connection: close\r\n"
+    "\r\n"
+).encode("ascii")
+
+
+def encode_event(event, data, event_id=None):
+    """
+    Кадр Server-Sent Events. data — однострочный JSON (str или уже
+    закодированные utf-8 байты)
+    """
+    head = f"event: {event}\n"
+    if event_id is not None:
+        head += f"id: {event_id}\n"
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return head.encode("utf-8") + b"data: " + data + b"\n\n"
+
+
+class PushServer:
+    """
+    Локальный SSE-сервер для экранов игроков (GET /events).
+
+    Новый клиент сначала получает backlog — последний ключевой кадр
+    и патчи после него, затем все новые события. Медленные клиенты
+    отключаются и переподключаются сами.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, heartbeat=15.0, max_queue=256):
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.max_queue = max_queue
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        # исключение запуска (порт занят и т.п.), None — сервер работает
+        self.error = None
+
+        self._clients = set()
+        self._handlers = set()
+        self._backlog = []
+
+    # =========================
+    # lifecycle
+    # =========================
+
+    def start(self):
+        """
+        True — сервер слушает порт; False — запуск не удался, причина в self.error
+        """
+        if self._thread is not None:
+            return True
+        self._ready.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout=5.0):
+            self.error = TimeoutError("сервер не запустился за 5 с")
+        if self.error is not None:
+            # publish() без цикла ничего не делает — кадры не копятся
+            self._loop = None
+            self._thread = None
+            return False
+        return True
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        self._thread.join(timeout=2.0)
+        self._thread = None
+        self._loop = None
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port)
+            )
+            # при port=0 ОС выдаёт свободный порт
+            self.port = self._server.sockets[0].getsockname()[1]
+            self._loop = loop
+        except Exception as e:
+            self.error = e
+            loop.close()
+            return
+        finally:
+            self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    async def _shutdown(self):
+        self._server.close()
+        for queue in list(self._clients):
+            queue.put_nowait(None)
+        if self._handlers:
+            await asyncio.wait(list(self._handlers), timeout=1.0)
+        self._loop.stop()
+
+    # =========================
+    # publishing
+    # =========================
+
+    def publish(self, event, data, event_id=None, reset=False):
+        """
+        Потокобезопасно рассылает событие всем клиентам.
+        reset=True — событие содержит полное состояние и начинает новый backlog
+        """
+        if self._loop is None:
+            return
+        frame = encode_event(event, data, event_id)
+        self._loop.call_soon_threadsafe(self._broadcast, frame, reset)
+
+    def _broadcast(self, frame, reset):
+        if reset:
+            self._backlog = [frame]
+        else:
+            self._backlog.append(frame)
+        for queue in list(self._clients):
+            if queue.qsize() >= self.max_queue:
+                # клиент не успевает читать — отключаем, backlog получит при переподключении
+                self._clients.discard(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(frame)
+
+    # =========================
+    # connections
+    # =========================
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            request_line = await reader.readline()
+            while True:
+                line = await reader.readline()
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] != "GET" or not parts[1].startswith("/events"):
+                writer.write(NOT_FOUND)
+                await writer.drain()
+                return
+
+            queue = asyncio.Queue()
+            for frame in self._backlog:
+                queue.put_nowait(frame)
+            self._clients.add(queue)
+
+            writer.write(SSE_HEADERS)
+            await writer.drain()
+            try:
+                while True:
+                    try:
+                        frame = await asyncio.wait_for(queue.get(), timeout=self.heartbeat)
+                    except asyncio.TimeoutError:
+                        frame = b": ping\n\n"
+                    if frame is None:
+                        break
+                    writer.write(frame)
+                    await writer.drain()
+            finally:
+                self._clients.discard(queue)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(task)
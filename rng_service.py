@@ -0,0 +1,74 @@
+import hashlib
+import os
+import random
+
+# стандартные потоки
+INITIATIVE = "initiative"
+HP = "hp"
+DAMAGE = "damage"
+DICE = "dice"  # броски без своего потока (roll_formula по умолчанию)
+
+
+def derive_seed(seed, *path):
+    """
+    64-битное зерно из корневого зерна и пути имён; стабильно между
+    процессами и запусками (в отличие от hash())
+    """
+    text = "/".join(str(part) for part in (seed, *path))
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class RngService:
+    """
+    Именованные независимые потоки случайных чисел от одного зерна.
+
+    stream(name) — random.Random, засеянный из (seed, name): бросок
+    хитов не сдвигает последовательность инициативы. split(key) —
+    дочерний сервис для отдельной задачи (процесс пула, прогон
+    симуляции): результат зависит от ключа задачи, а не от того,
+    какой процесс и в каком порядке её выполнил.
+    """
+
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = int.from_bytes(os.urandom(8), "little")
+        self.seed = seed
+        self._streams = {}
+
+    def __repr__(self):
+        return f"RngService(seed={self.seed})"
+
+    def stream(self, name):
+        rng = self._streams.get(name)
+        if rng is None:
+            rng = self._streams[name] = random.Random(derive_seed(self.seed, name))
+        return rng
+
+    def split(self, key):
+        return RngService(derive_seed(self.seed, "split", key))
+
+    def reset(self):
+        """
+        Все потоки начинаются заново — повтор прогона с тем же зерном
+        """
+        self._streams.clear()
+
+
+_default = RngService(int(os.environ["TNDM_SEED"]) if os.environ.get("TNDM_SEED") else None)
+
+
+def default_service():
+    """
+    Общий сервис процесса — им пользуются компоненты, которым не передали rng
+    """
+    return _default
+
+
+def seed_default(seed=None):
+    global _default
+    _default = RngService(seed)
+    return _default
+
+
+def stream(name):
+    return _default.stream(name)
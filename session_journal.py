@@ -0,0 +1,372 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from battle_engine import BattleEngine
+from battle_state_exporter import encode_payload, write_atomic
+from combatants import Combatant, Monster, Player
+
+SESSION_DIR = os.environ.get(
+    "TNDM_SESSION_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions")
+)
+SNAPSHOT_FILE_NAME = "session.snapshot.json"
+JOURNAL_FILE_NAME = "session.journal.jsonl"
+
+FORMAT_VERSION = 1
+
+# ключи effects, которые восстанавливаются из memento
+MEMENTO_EFFECTS = ("custom_effects", "incapacitated")
+
+
+# =========================
+# records
+# =========================
+
+def memento_to_json(memento):
+    *fields, custom_effects = memento
+    return [*fields, [list(entry) for entry in custom_effects]]
+
+
+def memento_from_json(data):
+    *fields, custom_effects = data
+    return (*fields, tuple(tuple(entry) for entry in custom_effects))
+
+
+def turn_to_json(state):
+    in_combat, round_, current_index, sub_index, prev_group, current_group = state
+    prev_ids = [c.id for c in prev_group] if prev_group is not None else None
+    return [in_combat, round_, current_index, sub_index, prev_ids, current_group]
+
+
+def combatant_record(combat, memento):
+    """
+    Участник целиком: неизменяемые в бою поля и memento.
+    Блок характеристик монстра не пишется — он берётся из бестиария по monster_type
+    """
+    kind = "combatant"
+    if isinstance(combat, Player):
+        kind = "player"
+    elif isinstance(combat, Monster):
+        kind = "monster"
+    record = {
+        "id": combat.id,
+        "kind": kind,
+        "name": combat.name,
+        "custom_name": combat.custom_name,
+        "max_hp": combat.max_hp,
+        "ac": combat.ac,
+        "m": memento_to_json(memento),
+    }
+    if kind == "monster":
+        record["monster_type"] = combat.monster_type
+    extra = {k: v for k, v in combat.effects.items() if k not in MEMENTO_EFFECTS}
+    if extra:
+        record["effects"] = extra
+    return record
+
+
+def build_combatant(record, bestiary):
+    memento = memento_from_json(record["m"])
+    effects = dict(record.get("effects", {}))
+    initiative = memento[5]
+    kind = record["kind"]
+    if kind == "player":
+        combat = Player(record["name"], initiative, effects=effects, custom_name=record["custom_name"])
+    elif kind == "monster":
+        monster_type = record.get("monster_type")
+        combat = Monster(
+            record["name"], initiative, record["max_hp"], record["ac"], effects,
+            monster_type=monster_type, bestiary=bestiary,
+            custom_name=record["custom_name"],
+        )
+    else:
+        combat = Combatant(record["name"], initiative, record["max_hp"], record["ac"], effects,
+                           record["custom_name"])
+    combat.id = record["id"]
+    combat.max_hp = record["max_hp"]
+    return combat, memento
+
+
+# =========================
+# recovery
+# =========================
+
+def read_session(directory=SESSION_DIR):
+    """
+    Последний снимок с применённым хвостом журнала:
+    (записи участников по id, поля движка, seq) или None, если снимка нет
+    """
+    try:
+        with open(os.path.join(directory, SNAPSHOT_FILE_NAME), "rb") as f:
+            snapshot = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("format") != FORMAT_VERSION:
+        return None
+
+    records = {record["id"]: record for record in snapshot["combatants"]}
+    turn = snapshot["turn"]
+    seq = snapshot["seq"]
+    try:
+        with open(os.path.join(directory, JOURNAL_FILE_NAME), "rb") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        lines = []
+
+    header = {}
+    if lines:
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            pass
+    # журнал от другого снимка: снимок уже включает все его записи
+    if header.get("session") != snapshot["session"] or header.get("snapshot") != seq:
+        lines = []
+
+    for line in lines[1:]:
+        try:
+            delta = json.loads(line)
+        except ValueError:
+            # оборванная последняя запись при сбое
+            break
+        if delta["seq"] <= seq:
+            continue
+        seq = delta["seq"]
+        for combatant_id in delta.get("remove", ()):
+            records.pop(combatant_id, None)
+        for record in delta.get("add", ()):
+            records[record["id"]] = record
+        for combatant_id, memento in delta.get("set", ()):
+            record = records.get(combatant_id)
+            if record is not None:
+                record["m"] = memento
+        if "turn" in delta:
+            turn = delta["turn"]
+    return records, turn, seq
+
+
+def recover(directory=SESSION_DIR, bestiary=None, history_limit=500):
+    """
+    Новый BattleEngine в состоянии последней записи журнала или None.
+    Журнал хранит итоговые состояния, а не команды: повтор не бросает
+    кости и не зависит от кода действий
+    """
+    session = read_session(directory)
+    if session is None:
+        return None
+    records, turn, _ = session
+    if bestiary is None:
+        from combatant_factory import bestiary_data as bestiary
+
+    joined = [build_combatant(record, bestiary) for record in records.values()]
+    by_id = {combat.id: combat for combat, _ in joined}
+    in_combat, round_, current_index, sub_index, prev_ids, current_group = turn
+    prev_group = None
+    if prev_ids is not None:
+        prev_group = tuple(by_id[i] for i in prev_ids if i in by_id)
+
+    engine = BattleEngine(history_limit=history_limit)
+    engine.load_state(
+        joined=joined,
+        turn=(in_combat, round_, current_index, sub_index, prev_group, current_group),
+    )
+    return engine
+
+
+# =========================
+# journal
+# =========================
+
+class SessionJournal:
+    """
+    Журнал сессии: каждый зафиксированный шаг движка дописывается строкой
+    в session.journal.jsonl, раз в snapshot_every шагов состояние целиком
+    пишется в session.snapshot.json и журнал начинается заново.
+
+    Поток UI только ставит записи в очередь; запись на диск и fsync делает
+    фоновый поток пачками — все шаги за flush_interval секунд одним fsync.
+    """
+
+    def __init__(self, battle_engine, directory=SESSION_DIR, snapshot_every=200,
+                 flush_interval=0.05, fsync=True):
+        self.engine = battle_engine
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.snapshot_file = os.path.join(directory, SNAPSHOT_FILE_NAME)
+        self.journal_file = os.path.join(directory, JOURNAL_FILE_NAME)
+
+        self.seq = 0
+        self._snapshot_seq = 0
+        self._session = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._file = None
+        # последняя ошибка записи на диск, None — журнал пишется
+        self.error = None
+        # после ошибки журнал на диске неполон: шаги пропускаются до нового снимка,
+        # который поток UI ставит в очередь на следующем шаге
+        self._broken = False
+        self._resync = False
+
+    # =========================
+    # lifecycle
+    # =========================
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._session = time.time_ns()
+        self.seq = 0
+        self.error = None
+        self._broken = False
+        self._resync = False
+        self._enqueue_snapshot()
+        self.engine.subscribe_steps(self._on_step)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Дописывает очередь на диск и останавливает поток
+        """
+        if self._thread is None:
+            return
+        self.engine.unsubscribe_steps(self._on_step)
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def flush(self):
+        """
+        Блокирует до записи всех поставленных в очередь шагов
+        """
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    # =========================
+    # engine thread
+    # =========================
+
+    def _on_step(self, step):
+        engine = self.engine
+        order = engine.initiative_order
+        added = {}
+        removed = []
+        for combat, _, _ in step.membership:
+            if combat in order:
+                added[combat.id] = combatant_record(combat, engine.memento(combat))
+            elif combat.id not in removed:
+                removed.append(combat.id)
+
+        self.seq += 1
+        delta = {"seq": self.seq}
+        if removed:
+            delta["remove"] = removed
+        if added:
+            delta["add"] = list(added.values())
+        changed = [
+            [combat.id, memento_to_json(after)]
+            for combat, _, after in step.changes
+            if combat.id not in added and combat in order
+        ]
+        if changed:
+            delta["set"] = changed
+        if step.engine:
+            delta["turn"] = turn_to_json(step.engine[1])
+        self._queue.put(delta)
+
+        if self._resync or self.seq - self._snapshot_seq >= self.snapshot_every:
+            self._enqueue_snapshot()
+
+    def _enqueue_snapshot(self):
+        engine = self.engine
+        self._snapshot_seq = self.seq
+        self._resync = False
+        self._queue.put(("snapshot", {
+            "format": FORMAT_VERSION,
+            "session": self._session,
+            "seq": self.seq,
+            "combatants": [combatant_record(c, engine.memento(c)) for c in engine.combatants],
+            "turn": turn_to_json(engine.turn_state()),
+        }))
+
+    # =========================
+    # writer thread
+    # =========================
+
+    def _run(self):
+        running = True
+        while running:
+            items = [self._queue.get()]
+            if items[0] is not None and self.flush_interval:
+                # окно группового коммита: шаги одной серии кликов — один fsync
+                time.sleep(self.flush_interval)
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            waiters = []
+            for item in items:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif isinstance(item, tuple):
+                    self._try_write(self._write_lines, lines)
+                    lines = []
+                    if self._try_write(self._write_snapshot, item[1]):
+                        self._broken = False
+                        self.error = None
+                elif not self._broken:
+                    lines.append(encode_payload(item))
+            self._try_write(self._write_lines, lines)
+            for waiter in waiters:
+                waiter.set()
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _try_write(self, write, data):
+        try:
+            write(data)
+        except OSError as e:
+            # диск полон, файл заблокирован и т.п.: поток продолжает разбирать
+            # очередь, иначе flush() зависнет, а очередь будет расти
+            self.error = e
+            self._broken = True
+            self._resync = True
+            return False
+        return True
+
+    def _write_lines(self, lines):
+        if not lines:
+            return
+        self._file.write(b"\n".join(lines) + b"\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _write_snapshot(self, snapshot):
+        write_atomic(self.snapshot_file, encode_payload(snapshot), fsync=self.fsync)
+        # после подмены снимка старый журнал не нужен: его записи уже в снимке
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._file = open(self.journal_file, "wb")
+        header = {"session": snapshot["session"], "snapshot": snapshot["seq"]}
+        self._write_lines([encode_payload(header)])
@@ -0,0 +1,194 @@
+import random
+
+import pytest
+
+from battle_engine import BattleEngine
+from combatants import Combatant, Monster, Player
+
+
+def make_engine(*initiatives):
+    engine = BattleEngine()
+    with engine.batch():
+        for initiative in initiatives:
+            engine.add_combatant(Combatant(f"Инициатива {initiative}", initiative, 20, 12))
+    return engine
+
+
+def turn_initiatives(engine, turns):
+    return [engine.next_turn()[0].initiative for _ in range(turns)]
+
+
+def fingerprint(engine):
+    in_combat, round_, current_index, sub_index, prev_group, current_group = engine.turn_state()
+    return (
+        in_combat, round_, current_index, sub_index, current_group,
+        [c.id for c in prev_group] if prev_group is not None else None,
+        [(c.id, engine.memento(c)) for c in engine.combatants],
+    )
+
+
+# =========================
+# initiative order
+# =========================
+
+def test_insert_before_current_group_waits_for_next_round():
+    engine = make_engine(20, 10, 5)
+    engine.start_combat()
+    assert engine.next_turn()[0].initiative == 10
+
+    # группа 15 уже пропустила свой ход в этом раунде
+    engine.add_combatant(Combatant("Призванный волк", 15, 11, 13))
+    assert turn_initiatives(engine, 5) == [5, 20, 15, 10, 5]
+    assert engine.round == 3
+
+
+def test_insert_after_current_group_acts_this_round():
+    engine = make_engine(20, 10, 5)
+    engine.start_combat()
+
+    engine.add_combatant(Combatant("Призванный волк", 15, 11, 13))
+    assert turn_initiatives(engine, 4) == [15, 10, 5, 20]
+
+
+def test_insert_into_existing_group_keeps_position():
+    engine = make_engine(20, 10, 5)
+    engine.start_combat()
+    engine.next_turn()
+
+    wolf = Combatant("Волк", 20, 11, 13)
+    engine.add_combatant(wolf)
+    assert turn_initiatives(engine, 2) == [5, 20]
+    assert wolf in engine.prev_group
+
+
+def test_removing_last_group_wraps_round():
+    engine = make_engine(20, 10, 5)
+    reference = make_engine(20, 10)
+    engine.start_combat()
+    reference.start_combat()
+    engine.next_turn()
+    reference.next_turn()
+    assert engine.round == 1
+
+    # следующей ходила бы группа 5: раунд переходит, как будто она сходила
+    engine.remove_combatant(engine.combatant_groups[-1][0])
+    assert engine.round == reference.round == 2
+    assert engine.next_turn()[0].initiative == reference.next_turn()[0].initiative == 20
+    assert engine.round == reference.round
+    assert engine.events[-1]["round"] == reference.events[-1]["round"]
+
+
+def test_removing_last_remaining_group_resets_position():
+    engine = make_engine(20)
+    engine.start_combat()
+    engine.remove_combatant(engine.combatants[0])
+    assert engine.current_index == 0
+    assert engine.next_turn() is None
+
+
+# =========================
+# effect expiry
+# =========================
+
+def old_countdown(effects, group, round_):
+    """
+    Прежнее правило: в конце хода носителя длительность уменьшается на 1,
+    кроме эффектов, наложенных в текущем раунде
+    """
+    for combat in group:
+        own = effects[combat.id]
+        for name, effect in list(own.items()):
+            if effect["duration"] is None or effect["applied_round"] == round_:
+                continue
+            effect["duration"] -= 1
+            if effect["duration"] <= 0:
+                del own[name]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_effect_expiry_matches_per_turn_countdown(seed):
+    rng = random.Random(seed)
+    engine = make_engine(20, 15, 15, 10, 5, 1)
+    expected = {c.id: {} for c in engine.combatants}
+    engine.start_combat()
+
+    for _ in range(80):
+        for _ in range(rng.randint(0, 2)):
+            combat = rng.choice(engine.combatants)
+            name = rng.choice(("Благословение", "Опутан", "Ослеплён"))
+            duration = rng.choice((None, 1, 1, 2, 3, 4))
+            engine.add_effect(combat, name, duration)
+            expected[combat.id][name] = {"duration": duration, "applied_round": engine.round}
+        if engine.prev_group:
+            old_countdown(expected, engine.prev_group, engine.round)
+        engine.next_turn()
+
+        for combat in engine.combatants:
+            assert set(combat.effects.get("custom_effects", {})) == set(expected[combat.id])
+        for name in ("Благословение", "Опутан", "Ослеплён"):
+            carriers = {c.id for c in engine.combatants_with_effect(name)}
+            assert carriers == {i for i, own in expected.items() if name in own}
+
+
+def test_effect_expiry_on_carrier_turn_only():
+    engine = make_engine(20, 10)
+    engine.start_combat()
+    fast, slow = engine.combatants
+    engine.add_effect(fast, "Благословение", 1)
+    engine.add_effect(slow, "Опутан", 1)
+    # конец хода группы 20 в раунде наложения не считается
+    engine.next_turn()
+    assert set(slow.effects["custom_effects"]) == {"Опутан"}
+    assert set(fast.effects["custom_effects"]) == {"Благословение"}
+    # конец хода носителя — эффект снят, чужой не тронут
+    engine.next_turn()
+    assert slow.effects["custom_effects"] == {}
+    assert set(fast.effects["custom_effects"]) == {"Благословение"}
+    assert [e["combatant"] for e in engine.events if e["type"] == "effect_expired"] == [slow.id]
+
+
+# =========================
+# undo / redo
+# =========================
+
+def test_undo_all_redo_all_round_trip():
+    engine = BattleEngine()
+    states = [fingerprint(engine)]
+
+    def step(action, *args):
+        action(*args)
+        states.append(fingerprint(engine))
+
+    player = Player("Арагорн", 15)
+    goblins = [Monster(f"Гоблин {i}", 12, 7, 15, monster_type="Гоблин") for i in range(3)]
+    wolf = Combatant("Волк", 8, 11, 13)
+
+    step(engine.add_combatant, player)
+    with engine.batch():
+        for goblin in goblins:
+            engine.add_combatant(goblin)
+    states.append(fingerprint(engine))
+    step(engine.add_combatant, wolf)
+    step(engine.start_combat)
+    step(engine.apply_damage, goblins[:2], 5)
+    step(engine.apply_effect, [wolf, player], "Благословение", 2)
+    step(engine.next_turn)
+    step(engine.set_initiative, wolf, 13)
+    step(engine.set_state, goblins[0], "unconscious")
+    step(engine.apply_temp_hp, [wolf], 4)
+    step(engine.next_turn)
+    step(engine.remove_combatant, goblins[1])
+    step(engine.add_combatant, Combatant("Призванный волк", 14, 11, 13))
+    for _ in range(6):
+        step(engine.next_turn)
+    step(engine.remove_effect_everywhere, "Благословение")
+
+    for expected in reversed(states[:-1]):
+        assert engine.undo()
+        assert fingerprint(engine) == expected
+    assert not engine.undo()
+
+    for expected in states[1:]:
+        assert engine.redo()
+        assert fingerprint(engine) == expected
+    assert not engine.redo()
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from dice_roll import compile_formula, distribution, roll_formula, roll_many
+
+
+@pytest.mark.parametrize("formula", ["1d0", "2d0+3", "1d6+1d0", "4d0kh1"])
+def test_zero_sided_dice_rejected(formula):
+    with pytest.raises(ValueError):
+        compile_formula(formula)
+
+
+def test_zero_sided_variable_agrees_across_apis():
+    rng = random.Random(1)
+    assert roll_formula("2d{sides}+3", rng=rng, sides=0) == 3
+    assert roll_many("2d{sides}+3", 5, use_numpy=False, rng=rng, sides=0) == [3] * 5
+    support = distribution("2d{sides}+3", sides=0)
+    assert (support.min, support.max) == (3, 3)
+
+
+@pytest.mark.parametrize("formula", ["1d1", "3d6+2", "135 (18d10 + 36)", "4d6kh3", "1d20adv"])
+def test_rolls_within_distribution(formula):
+    rng = random.Random(2)
+    support = distribution(formula)
+    rolls = [roll_formula(formula, rng=rng) for _ in range(200)]
+    rolls += roll_many(formula, 200, use_numpy=False, rng=rng)
+    assert all(support.min <= value <= support.max for value in rolls)
+
+
+def test_cost_helpers():
+    assert compile_formula("2d6+1d20adv+3").dice_count() == 4
+    assert compile_formula("2d{n}").dice_count({"n": 0}) == 0
+    small = compile_formula("8d6").exact_cost()
+    assert small < compile_formula("300d100").exact_cost()
+    assert small < compile_formula("20d20kh10").exact_cost()
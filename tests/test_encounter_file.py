@@ -0,0 +1,186 @@
+import struct
+import zlib
+
+import pytest
+
+import encounter_file
+from battle_engine import BattleEngine
+from combatants import Combatant, Monster, Player
+from encounter_file import EncounterFormatError
+
+# без бестиария: загрузка не должна читать srd_5e_monsters_ru.json
+BESTIARY = {}
+
+
+def fingerprint(engine):
+    *position, prev_group, current_group = engine.turn_state()
+    return (
+        position, current_group,
+        [engine.combatants.index(c) for c in prev_group] if prev_group is not None else None,
+        [
+            (type(c).__name__, c.name, c.custom_name, c.max_hp, c.ac,
+             getattr(c, "monster_type", None),
+             engine.memento(c)[:6] + engine.memento(c)[7:])
+            for c in engine.combatants
+        ],
+    )
+
+
+def round_trip(engine):
+    data = encounter_file.dumps(engine)
+    loaded = encounter_file.loads(data, bestiary=BESTIARY)
+    assert fingerprint(loaded) == fingerprint(engine)
+    assert encounter_file.dumps(loaded) == data
+    return loaded
+
+
+def make_engine():
+    engine = BattleEngine()
+    with engine.batch():
+        engine.add_combatant(Player("Арагорн", 15))
+        engine.add_combatant(Monster("Гоблин 1", 12, 7, 15, monster_type="Гоблин", custom_name="Вожак"))
+        engine.add_combatant(Monster("Гоблин 2", 12, 6, 15, monster_type="Гоблин"))
+        engine.add_combatant(Combatant("Волк", 8, 11, 13))
+    return engine
+
+
+def test_empty_engine():
+    loaded = round_trip(BattleEngine())
+    assert loaded.combatants == []
+    assert not loaded.in_combat
+
+
+def test_mid_combat_prev_group():
+    engine = make_engine()
+    engine.start_combat()
+    engine.next_turn()
+    goblin = engine.combatants[1]
+    engine.apply_damage([goblin], 3)
+    engine.set_state(engine.combatants[3], "unconscious")
+
+    loaded = round_trip(engine)
+    assert loaded.in_combat
+    assert [c.name for c in loaded.prev_group] == ["Гоблин 1", "Гоблин 2"]
+    assert loaded.combatants[1].hp == 4
+    assert loaded.next_turn() is not None
+
+
+def test_custom_effects():
+    engine = make_engine()
+    engine.start_combat()
+    wolf, player = engine.combatants[3], engine.combatants[0]
+    engine.add_effect(wolf, "Благословение", None)
+    engine.add_effect(wolf, "Опутан", 2)
+    engine.add_effect(player, "Ускорение", "вечный")
+
+    loaded = round_trip(engine)
+    assert loaded.combatants_with_effect("Благословение") == (loaded.combatants[3],)
+    assert loaded.combatants[3].effect_duration("Благословение") is None
+    assert loaded.combatants[3].effect_duration("Опутан") == 2
+
+
+def test_none_fields():
+    engine = BattleEngine()
+    nobody = Combatant("Статист", 10, hp=None, ac=None)
+    nobody.initiative = None
+    engine.add_combatant(nobody)
+    engine.add_combatant(Player("Леголас", 18))
+
+    loaded = round_trip(engine)
+    statist = next(c for c in loaded.combatants if c.name == "Статист")
+    assert statist.hp is None and statist.max_hp is None
+    assert statist.ac is None and statist.initiative is None
+    player = next(c for c in loaded.combatants if c.name == "Леголас")
+    assert isinstance(player, Player) and player.hp is None
+
+
+def test_loads_into_existing_engine():
+    engine = make_engine()
+    target = BattleEngine([Player("Старый", 1)])
+    encounter_file.loads(encounter_file.dumps(engine), target, bestiary=BESTIARY)
+    assert fingerprint(target) == fingerprint(engine)
+    assert not target.history.can_undo
+
+
+def test_save_and_load(tmp_path):
+    engine = make_engine()
+    path = tmp_path / "встреча.tndm"
+    encounter_file.save(engine, str(path))
+    encounter_file.save(engine, str(path))
+    assert [p.name for p in tmp_path.iterdir()] == ["встреча.tndm"]
+    loaded = encounter_file.load(str(path), bestiary=BESTIARY)
+    assert fingerprint(loaded) == fingerprint(engine)
+
+
+# =========================
+# corrupt files
+# =========================
+
+def _body(engine=None):
+    data = encounter_file.dumps(engine or make_engine())
+    return bytearray(zlib.decompress(data[encounter_file.HEADER.size:]))
+
+
+def _pack(body):
+    header = encounter_file.HEADER.pack(encounter_file.MAGIC, encounter_file.FORMAT_VERSION)
+    return header + zlib.compress(bytes(body))
+
+
+def _first_record_offset(body):
+    (count,) = struct.unpack_from("<I", body)
+    offset = 4 + 4 * count + sum(struct.unpack_from(f"<{count}I", body, 4))
+    prev_count = encounter_file.ENGINE.unpack_from(body, offset)[-1]
+    return offset + encounter_file.ENGINE.size + 4 * prev_count + 4
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"TNDMENC",
+    b"NOTTNDM\0\x01\x00" + zlib.compress(b""),
+    encounter_file.HEADER.pack(encounter_file.MAGIC, 99) + zlib.compress(b""),
+    encounter_file.HEADER.pack(encounter_file.MAGIC, encounter_file.FORMAT_VERSION) + b"not zlib",
+])
+def test_rejects_bad_header(data):
+    with pytest.raises(EncounterFormatError):
+        encounter_file.loads(data, bestiary=BESTIARY)
+
+
+def test_rejects_truncated_file():
+    data = encounter_file.dumps(make_engine())
+    for size in (len(data) - 1, len(data) // 2, encounter_file.HEADER.size + 2):
+        with pytest.raises(EncounterFormatError):
+            encounter_file.loads(data[:size], bestiary=BESTIARY)
+
+
+def test_rejects_truncated_body():
+    body = _body()
+    with pytest.raises(EncounterFormatError):
+        encounter_file.loads(_pack(body[:-3]), bestiary=BESTIARY)
+    with pytest.raises(EncounterFormatError):
+        encounter_file.loads(_pack(body + b"\0"), bestiary=BESTIARY)
+
+
+def test_rejects_bad_string_ref():
+    body = _body()
+    offset = _first_record_offset(body)
+    # поле имени — сразу после вида и флагов
+    struct.pack_into("<I", body, offset + 2, 10_000)
+    with pytest.raises(EncounterFormatError):
+        encounter_file.loads(_pack(body), bestiary=BESTIARY)
+
+
+def test_rejects_bad_kind():
+    body = _body()
+    body[_first_record_offset(body)] = len(encounter_file.KINDS)
+    with pytest.raises(EncounterFormatError):
+        encounter_file.loads(_pack(body), bestiary=BESTIARY)
+
+
+def test_rejects_bad_effect_ref():
+    engine = make_engine()
+    engine.add_effect(engine.combatants[0], "Благословение", 3)
+    body = _body(engine)
+    # эффекты — последняя секция, название — первое поле записи
+    struct.pack_into("<I", body, len(body) - encounter_file.EFFECT.size, 10_000)
+    with pytest.raises(EncounterFormatError):
+        encounter_file.loads(_pack(body), bestiary=BESTIARY)
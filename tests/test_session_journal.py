@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from battle_engine import BattleEngine
+from combatants import Combatant, Monster, Player
+from session_journal import JOURNAL_FILE_NAME, SessionJournal, read_session, recover
+
+# без бестиария: восстановление не должно читать srd_5e_monsters_ru.json
+BESTIARY = {}
+
+
+def fingerprint(engine):
+    in_combat, round_, current_index, sub_index, prev_group, current_group = engine.turn_state()
+    return (
+        in_combat, round_, current_index, sub_index, current_group,
+        [c.id for c in prev_group] if prev_group is not None else None,
+        [
+            (c.id, type(c).__name__, c.name, c.custom_name, c.max_hp, c.ac, engine.memento(c))
+            for c in engine.combatants
+        ],
+    )
+
+
+def play(engine, turns):
+    player = Player("Арагорн", 15)
+    goblins = [Monster(f"Гоблин {i}", 12, 7, 15, monster_type="Гоблин") for i in range(4)]
+    with engine.batch():
+        engine.add_combatant(player)
+        for goblin in goblins:
+            engine.add_combatant(goblin)
+        engine.add_combatant(Combatant("Волк", 8, 11, 13, custom_name="Серый"))
+    engine.start_combat()
+    engine.apply_effect([player, goblins[0]], "Благословение", 3)
+    for turn in range(turns):
+        goblin = goblins[turn % len(goblins)]
+        engine.apply_damage([goblin], 1)
+        if turn == 3:
+            engine.remove_combatant(goblins[-1])
+        if turn == 5:
+            engine.add_combatant(Combatant("Призванный волк", 14, 11, 13))
+        if turn == 7:
+            engine.set_initiative(player, 9)
+        engine.next_turn()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    engine = BattleEngine()
+    journal = SessionJournal(engine, str(tmp_path), snapshot_every=7, flush_interval=0, fsync=False)
+    journal.start()
+    yield journal
+    journal.stop()
+
+
+@pytest.mark.parametrize("turns", [0, 1, 6, 13, 20])
+def test_recover_after_snapshot_and_tail(journal, turns):
+    play(journal.engine, turns)
+    journal.flush()
+
+    recovered = recover(journal.directory, bestiary=BESTIARY)
+    assert fingerprint(recovered) == fingerprint(journal.engine)
+    # снимок и хвост журнала вместе дают последний шаг
+    assert read_session(journal.directory)[2] == journal.seq
+    assert not recovered.history.can_undo
+
+
+def test_recovered_engine_continues(journal):
+    play(journal.engine, 10)
+    journal.flush()
+
+    recovered = recover(journal.directory, bestiary=BESTIARY)
+    for _ in range(6):
+        assert [c.id for c in recovered.next_turn()] == [c.id for c in journal.engine.next_turn()]
+    assert fingerprint(recovered) == fingerprint(journal.engine)
+
+
+def test_recover_ignores_torn_last_line(journal):
+    play(journal.engine, 9)
+    journal.flush()
+    expected = fingerprint(journal.engine)
+    journal.engine.apply_damage([journal.engine.combatants[-1]], 2)
+    journal.flush()
+
+    path = os.path.join(journal.directory, JOURNAL_FILE_NAME)
+    with open(path, "rb") as f:
+        data = f.read()
+    # сбой посреди записи последнего шага
+    with open(path, "wb") as f:
+        f.write(data[:-5])
+
+    recovered = recover(journal.directory, bestiary=BESTIARY)
+    assert fingerprint(recovered) == expected
+
+
+def test_recover_without_session(tmp_path):
+    assert recover(str(tmp_path), bestiary=BESTIARY) is None